@@ -31,12 +31,43 @@ from xml.dom.minidom import Document
 from optparse import OptionParser
 from tools.filesystem import dirEntries
 from tools.commons import printProgressIndicator, progressIndicatorReset, setupDeferredLogging
+from tools.cache import ConversionCache
 from machinery.parser import H90XMLCallGraphGenerator
+from machinery.intermediate import H90FileIntermediate, getLineClassificationPath
+from tools.metadata import binaryFromDocument, parseString, appendPartialCallGraph
+from tools.instrumentation import StageReport, addStageReportOptions
 import os
 import sys
 import fileinput
 import pdb
 import logging, atexit
+import itertools, multiprocessing, multiprocessing.util
+
+def flushLogging():
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+def initCallGraphWorker():
+    #pool workers leave through os._exit, so the deferred log records would otherwise be lost
+    multiprocessing.util.Finalize(None, flushLogging, exitpriority=10)
+    stageReport.initWorker()
+
+def getIntermediate(fileInDir):
+    return H90FileIntermediate(fileInDir, getLineClassificationPath(fileInDir) if options.classifyLines else None)
+
+def generatePartialCallGraph(fileInDir):
+    #returns (fileInDir, callgraph of this file alone in binary format, exit code, stage record)
+    timer = stageReport.startStage("Callgraph parsing", file=fileInDir)
+    partialDoc = Document()
+    partialDoc.appendChild(partialDoc.createElement("callGraph"))
+    try:
+        parser = H90XMLCallGraphGenerator(partialDoc)
+        parser.processFile(fileInDir, getIntermediate(fileInDir))
+    except SystemExit as e:
+        #the parser has already logged the reason
+        return fileInDir, None, e.code if e.code not in [None, 0] else 1, timer.getRecord()
+    logging.debug("Callgraph generated for " + fileInDir + "")
+    return fileInDir, binaryFromDocument(partialDoc), 0, timer.getRecord()
 
 ##################### MAIN ##############################
 #get all program arguments
@@ -47,33 +78,107 @@ parser.add_option("-d", "--debug", action="store_true", dest="debug",
                   help="show debug print in standard error output")
 parser.add_option("-p", "--pretty", action="store_true", dest="pretty",
                   help="make xml output pretty")
+parser.add_option("-b", "--binary", action="store_true", dest="binary",
+                  help="write the callgraph in binary format instead of xml (faster to load for the following stages - use pretty.py to export it as xml)")
+parser.add_option("--classifyLines", action="store_true", dest="classifyLines",
+                  help="keep the pattern matches of every line in a .classification file next to each h90 file, such that later passes skip the pattern matching for unchanged files")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                  help="number of processes used to generate the callgraphs of the h90 files in parallel before merging them (default: 1)", metavar="N")
+parser.add_option("--cacheDir", dest="cacheDir",
+                  help="directory for caching the callgraphs of the single h90 files. Only files that have changed are then parsed again", metavar="DIR")
+parser.add_option("--cacheSizeLimit", dest="cacheSizeLimit", type="int", default=512,
+                  help="size limit of the cache in MB. Least recently used entries are evicted beyond that (default: 512)", metavar="MB")
+parser.add_option("--cacheStats", action="store_true", dest="cacheStats",
+                  help="print cache statistics to standard error output")
+addStageReportOptions(parser)
 (options, args) = parser.parse_args()
 
 setupDeferredLogging('preprocessor.log', logging.DEBUG if options.debug else logging.INFO)
-
-if (not options.sourceDir):
-    logging.error("sourceDirectory option is mandatory. Use '--help' for informations on how to use this module")
-    sys.exit(1)
-
-#prepare xml output
-doc = Document()
-callGraphRoot = doc.createElement("callGraph")
-doc.appendChild(callGraphRoot)
-
-filesInDir = dirEntries(str(options.sourceDir), True, 'h90')
-
-#first pass: loop through all h90 files (hybrid fortran 90) in the current directory
-#   and build the basic callgraph based on subprocedures and calls. Also parse @-directives for annotations.
-progressIndicatorReset(sys.stderr)
-for fileNum, fileInDir in enumerate(filesInDir):
-    parser = H90XMLCallGraphGenerator(doc)
-    parser.processFile(fileInDir)
-    logging.debug("Callgraph generated for " + fileInDir + "")
-    printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesInDir), "Callgraph parsing")
-
-#second pass: moved to generateP90Codebase.py since we need symbol analysis already
-
-if (options.pretty):
-	sys.stdout.write(doc.toprettyxml())
-else:
-	sys.stdout.write(doc.toxml())
\ No newline at end of file
+stageReport = StageReport(options.stageReport, options.profile)
+with stageReport:
+    if (not options.sourceDir):
+        logging.error("sourceDirectory option is mandatory. Use '--help' for informations on how to use this module")
+        sys.exit(1)
+
+    if options.jobs < 1:
+        logging.error("jobs option needs to be at least 1")
+        sys.exit(1)
+
+    #prepare xml output
+    doc = Document()
+    callGraphRoot = doc.createElement("callGraph")
+    doc.appendChild(callGraphRoot)
+
+    filesInDir = dirEntries(str(options.sourceDir), True, 'h90')
+
+    #first pass: loop through all h90 files (hybrid fortran 90) in the current directory
+    #   and build the basic callgraph based on subprocedures and calls. Also parse @-directives for annotations.
+    progressIndicatorReset(sys.stderr)
+    parsingTimer = stageReport.startStage("Callgraph parsing")
+    if options.jobs == 1 and not options.cacheDir:
+        for fileNum, fileInDir in enumerate(filesInDir):
+            timer = stageReport.startStage("Callgraph parsing", file=fileInDir)
+            parser = H90XMLCallGraphGenerator(doc)
+            parser.processFile(fileInDir, getIntermediate(fileInDir))
+            logging.debug("Callgraph generated for " + fileInDir + "")
+            stageReport.endStage(timer)
+            printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesInDir), "Callgraph parsing")
+        stageReport.endStage(parsingTimer)
+    else:
+        #every file gets a callgraph of its own (taken from the cache if the file is unchanged), these are then merged
+        partialCallGraphsByFile = {}
+        cache = None
+        cacheKeysByFile = {}
+        if options.cacheDir:
+            cache = ConversionCache(options.cacheDir, options.cacheSizeLimit * 1024 * 1024)
+            for fileInDir in filesInDir:
+                cacheKeysByFile[fileInDir] = cache.keyForPartialCallGraph(fileInDir)
+                partialCallGraph = cache.load(cacheKeysByFile[fileInDir])
+                if partialCallGraph != None:
+                    logging.debug("Callgraph for %s taken from cache" %(fileInDir))
+                    partialCallGraphsByFile[fileInDir] = partialCallGraph
+        filesToParse = [fileInDir for fileInDir in filesInDir if not fileInDir in partialCallGraphsByFile]
+        pool = None
+        if options.jobs > 1 and len(filesToParse) > 1:
+            pool = multiprocessing.Pool(min(options.jobs, len(filesToParse)), initializer=initCallGraphWorker)
+        try:
+            results = pool.imap(generatePartialCallGraph, filesToParse) if pool else itertools.imap(generatePartialCallGraph, filesToParse)
+            for fileNum, (fileInDir, partialCallGraph, exitCode, stageRecord) in enumerate(results):
+                if exitCode != 0:
+                    sys.exit(exitCode)
+                stageReport.addStage(stageRecord)
+                partialCallGraphsByFile[fileInDir] = partialCallGraph
+                if cache:
+                    cache.storeData(cacheKeysByFile[fileInDir], partialCallGraph, fileInDir)
+                printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesToParse), "Callgraph parsing")
+            if pool:
+                pool.close()
+        except (KeyboardInterrupt, SystemExit):
+            if pool:
+                pool.terminate()
+            raise
+        finally:
+            if pool:
+                pool.join()
+        stageReport.endStage(parsingTimer)
+        #merging in file order makes the result independent of the number of jobs and of which files have been cached
+        timer = stageReport.startStage("Callgraph merging")
+        for fileInDir in filesInDir:
+            appendPartialCallGraph(doc, parseString(partialCallGraphsByFile[fileInDir]))
+        stageReport.endStage(timer)
+        if cache:
+            cache.evict()
+            if options.cacheStats:
+                progressIndicatorReset(sys.stderr)
+                cache.printStatistics(sys.stderr)
+
+    #second pass: moved to generateP90Codebase.py since we need symbol analysis already
+
+    timer = stageReport.startStage("Writing the callgraph")
+    if (options.binary):
+        sys.stdout.write(binaryFromDocument(doc))
+    elif (options.pretty):
+        sys.stdout.write(doc.toprettyxml())
+    else:
+        sys.stdout.write(doc.toxml())
+    stageReport.endStage(timer)
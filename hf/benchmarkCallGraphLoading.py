@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        benchmarkCallGraphLoading.py                       #
+#  Comment          Compares the load times of a callgraph in xml      #
+#                   and binary format                                  #
+#**********************************************************************#
+
+from xml.dom.minidom import parseString as parseStringUsingMinidom
+from tools.metadata import parseString, binaryFromDocument
+from tools.commons import getDataFromFile, setupDeferredLogging
+from optparse import OptionParser
+import sys
+import time
+import logging
+
+def bestLoadTime(data, loadFunction, repetitions):
+    bestTime = None
+    for _ in range(repetitions):
+        startTime = time.time()
+        loadFunction(data)
+        elapsed = time.time() - startTime
+        if bestTime == None or elapsed < bestTime:
+            bestTime = elapsed
+    return bestTime
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser()
+parser.add_option("-i", "--callgraph", dest="callgraph",
+                  help="callgraph to load, either in XML or binary format", metavar="XML")
+parser.add_option("-n", "--repetitions", dest="repetitions", type="int", default=5,
+                  help="number of times each format is loaded - the best time is reported (default: 5)")
+(options, args) = parser.parse_args()
+
+setupDeferredLogging('preprocessor.log', logging.INFO)
+
+if (not options.callgraph):
+    logging.error("callgraph option is mandatory. Use '--help' for informations on how to use this module")
+    sys.exit(1)
+
+doc = parseString(getDataFromFile(options.callgraph))
+xmlData = doc.toxml().encode('utf-8')
+binaryData = binaryFromDocument(doc)
+del doc
+
+results = [
+    ("xml (minidom)", len(xmlData), bestLoadTime(xmlData, parseStringUsingMinidom, options.repetitions)),
+    ("xml", len(xmlData), bestLoadTime(xmlData, parseString, options.repetitions)),
+    ("binary", len(binaryData), bestLoadTime(binaryData, parseString, options.repetitions))
+]
+referenceTime = results[0][2]
+for formatName, size, loadTime in results:
+    sys.stdout.write("%-15s %10i bytes %8.3fs %6.2fx\n" %(
+        formatName,
+        size,
+        loadTime,
+        referenceTime / loadTime if loadTime > 0 else 0.0
+    ))
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        benchmarkLineClassification.py                     #
+#  Comment          Compares the per line cost of matching the static  #
+#                   patterns of each parser state one by one with the  #
+#                   combined line classifier of that state             #
+#**********************************************************************#
+
+from machinery.parser import CallGraphParser
+from tools.patterns import LineClassifier
+from tools.filesystem import dirEntries
+from tools.commons import setupDeferredLogging
+from optparse import OptionParser
+import sys
+import time
+import logging
+
+def bestTime(function, repetitions):
+    bestTime = None
+    for _ in range(repetitions):
+        startTime = time.time()
+        function()
+        elapsed = time.time() - startTime
+        if bestTime == None or elapsed < bestTime:
+            bestTime = elapsed
+    return bestTime
+
+def matchOneByOne(staticPatterns, lines):
+    #what the parser states did before: compute the match of every pattern, then decide
+    def run():
+        for line in lines:
+            matches = [staticPattern.match(line) for staticPattern in staticPatterns]
+    return run
+
+def classify(lineClassifier, lines):
+    def run():
+        for line in lines:
+            lineClassifier.classify(line)
+    return run
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser()
+parser.add_option("-i", "--sourceDirectory", dest="sourceDir",
+                  help="read h90 files recursively from DIR, e.g. the examples directory", metavar="DIR")
+parser.add_option("-n", "--repetitions", dest="repetitions", type="int", default=5,
+                  help="number of times each variant is run - the best time is reported (default: 5)")
+(options, args) = parser.parse_args()
+
+setupDeferredLogging('preprocessor.log', logging.INFO)
+
+if (not options.sourceDir):
+    logging.error("sourceDirectory option is mandatory. Use '--help' for informations on how to use this module")
+    sys.exit(1)
+
+lines = []
+for fileName in dirEntries(options.sourceDir, True, 'h90', 'H90'):
+    with open(fileName, 'r') as sourceFile:
+        lines += sourceFile.readlines()
+if len(lines) == 0:
+    logging.error("no h90 files found in %s" %(options.sourceDir))
+    sys.exit(1)
+
+callGraphParser = CallGraphParser()
+lineClassifiersByAttributeName = dict(
+    (attributeName, value)
+    for attributeName, value in vars(callGraphParser).items()
+    if isinstance(value, LineClassifier)
+)
+sys.stdout.write("%i lines; per line cost in microseconds\n" %(len(lines)))
+sys.stdout.write("%-40s %8s %8s %10s %6s\n" %("classifier", "patterns", "before", "classifier", "ratio"))
+totalBefore = 0.0
+totalAfter = 0.0
+for attributeName, lineClassifier in sorted(lineClassifiersByAttributeName.items()):
+    staticPatterns = [getattr(callGraphParser.patterns, patternName) for patternName in lineClassifier.patternNames]
+    before = bestTime(matchOneByOne(staticPatterns, lines), options.repetitions)
+    after = bestTime(classify(lineClassifier, lines), options.repetitions)
+    totalBefore += before
+    totalAfter += after
+    sys.stdout.write("%-40s %8i %8.2f %10.2f %5.2fx\n" %(
+        attributeName,
+        len(staticPatterns),
+        before * 1e6 / len(lines),
+        after * 1e6 / len(lines),
+        before / after if after > 0 else 0.0
+    ))
+sys.stdout.write("%-40s %8s %8.2f %10.2f %5.2fx\n" %(
+    "total",
+    "",
+    totalBefore * 1e6 / len(lines),
+    totalAfter * 1e6 / len(lines),
+    totalBefore / totalAfter if totalAfter > 0 else 0.0
+))
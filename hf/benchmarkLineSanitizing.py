@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        benchmarkLineSanitizing.py                         #
+#  Comment          Measures how long FortranCodeSanitizer takes to    #
+#                   break up synthetic long lines, as they are         #
+#                   generated for big directives and argument lists    #
+#**********************************************************************#
+
+from machinery.commons import FortranCodeSanitizer
+from tools.commons import setupDeferredLogging
+from optparse import OptionParser
+import sys
+import time
+import logging
+
+def bestTime(function, repetitions):
+    bestTime = None
+    for _ in range(repetitions):
+        startTime = time.time()
+        function()
+        elapsed = time.time() - startTime
+        if bestTime == None or elapsed < bestTime:
+            bestTime = elapsed
+    return bestTime
+
+def syntheticLine(prefix, element, suffix, lineLength):
+    elements = []
+    length = len(prefix) + len(suffix)
+    index = 0
+    while length < lineLength:
+        elements.append(element %(index))
+        length += len(elements[-1]) + 2
+        index += 1
+    return prefix + ", ".join(elements) + suffix
+
+def sanitize(line):
+    def run():
+        FortranCodeSanitizer().sanitizeLines(line)
+    return run
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser()
+parser.add_option("-l", "--lineLength", dest="lineLength", type="int", default=10000,
+                  help="number of characters of each synthetic line (default: 10000)")
+parser.add_option("-n", "--repetitions", dest="repetitions", type="int", default=5,
+                  help="number of times each line is sanitized - the best time is reported (default: 5)")
+(options, args) = parser.parse_args()
+
+setupDeferredLogging('preprocessor.log', logging.INFO)
+
+linesByName = [
+    ("argument list", syntheticLine("call kernel(", "argument_%i", ")", options.lineLength)),
+    ("acc deviceptr", syntheticLine("!$acc kernels deviceptr(", "device_array_%i", ")", options.lineLength)),
+    ("omp private", syntheticLine("!$OMP PARALLEL DO PRIVATE(", "iterator_%i", ")", options.lineLength)),
+    ("quoted strings", syntheticLine("write(0,*) ", "'value %i is'", "", options.lineLength))
+]
+sys.stdout.write("%-20s %10s %8s %10s\n" %("line", "characters", "lines", "time"))
+for name, line in linesByName:
+    sys.stdout.write("%-20s %10i %8i %9.2fms\n" %(
+        name,
+        len(line),
+        FortranCodeSanitizer().sanitizeLines(line).count("\n"),
+        bestTime(sanitize(line), options.repetitions) * 1000
+    ))
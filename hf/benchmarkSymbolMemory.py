@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        benchmarkSymbolMemory.py                           #
+#  Comment          Measures the peak memory used by the module and    #
+#                   routine symbol tables that generateP90Codebase.py  #
+#                   builds, for a callgraph or a synthetic codebase    #
+#**********************************************************************#
+
+from xml.dom.minidom import Document
+from tools.metadata import parseString, setDomainDependants, setTemplateInfos, createOrGetFirstNodeWithName
+from tools.commons import getDataFromFile, setupDeferredLogging
+from tools.callgraph import CallGraph
+from machinery.converter import getSymbolsByModuleNameAndSymbolName, getSymbolsByRoutineNameAndSymbolName
+from optparse import OptionParser
+import sys
+import time
+import resource
+import logging
+
+#specifications the synthetic symbols are distributed over - as they are typically found in a physical model
+syntheticSpecifications = [
+    "domName(i,j,k) domSize(nx,ny,nz)",
+    "domName(i,j) domSize(nx,ny)",
+    "attribute(autoDom) domName(i,j) domSize(nx,ny)",
+    "attribute(autoDom, present) domName(i,j) domSize(nx,ny) declarationPrefix(real(8), intent(in))"
+]
+
+def peakMemoryInMB():
+    #ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def syntheticCallGraph(numOfSymbols, symbolsPerRoutine, routinesPerModule):
+    doc = Document()
+    doc.appendChild(doc.createElement("callGraph"))
+    routines = createOrGetFirstNodeWithName("routines", doc)
+    modules = createOrGetFirstNodeWithName("modules", doc)
+    moduleNode = None
+    routineNum = 0
+    while routineNum * symbolsPerRoutine < numOfSymbols:
+        moduleName = "module_%i" %(routineNum / routinesPerModule)
+        if routineNum % routinesPerModule == 0:
+            moduleNode = doc.createElement("module")
+            moduleNode.setAttribute("name", moduleName)
+            modules.appendChild(moduleNode)
+            setDomainDependants(doc, moduleNode, syntheticSpecifications[0], ",".join(
+                "module_symbol_%i" %(symbolNum) for symbolNum in range(10)
+            ))
+        routine = doc.createElement("routine")
+        routine.setAttribute("name", "routine_%i" %(routineNum))
+        routine.setAttribute("source", "source_%i" %(routineNum / routinesPerModule))
+        routine.setAttribute("module", moduleName)
+        routine.setAttribute("implementationTemplate", "")
+        #every second routine contains a kernel, the others call one
+        routine.setAttribute("parallelRegionPosition", "within" if routineNum % 2 == 0 else "inside")
+        routines.appendChild(routine)
+        setTemplateInfos(doc, routine, "domName(i,j,k) domSize(nx,ny,nz)", "parallelRegionTemplates", "parallelRegionTemplate", "activeParallelRegions")
+        numOfRoutineSymbols = min(symbolsPerRoutine, numOfSymbols - routineNum * symbolsPerRoutine)
+        for specificationNum, specification in enumerate(syntheticSpecifications):
+            symbolNames = [
+                "symbol_%i" %(symbolNum)
+                for symbolNum in range(numOfRoutineSymbols)
+                if symbolNum % len(syntheticSpecifications) == specificationNum
+            ]
+            if len(symbolNames) > 0:
+                setDomainDependants(doc, routine, specification, ",".join(symbolNames))
+        routineNum += 1
+    return doc
+
+def buildSymbolTables(cgDoc):
+    callGraph = CallGraph(cgDoc)
+    symbolsByModuleNameAndSymbolName = getSymbolsByModuleNameAndSymbolName(cgDoc, callGraph.moduleNodesByName)
+    symbolsByRoutineNameAndSymbolName = getSymbolsByRoutineNameAndSymbolName(
+        cgDoc,
+        callGraph.routineNodesByName,
+        callGraph.parallelRegionTemplatesByRoutineName
+    )
+    return symbolsByModuleNameAndSymbolName, symbolsByRoutineNameAndSymbolName
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser()
+parser.add_option("-i", "--callgraph", dest="callgraph",
+                  help="callgraph to build the symbol tables for, either in XML or binary format. If not given, a synthetic codebase is used", metavar="XML")
+parser.add_option("-s", "--symbols", dest="symbols", type="int", default=50000,
+                  help="number of symbols in the synthetic codebase (default: 50000)")
+parser.add_option("-r", "--symbolsPerRoutine", dest="symbolsPerRoutine", type="int", default=100,
+                  help="number of symbols in each routine of the synthetic codebase (default: 100)")
+(options, args) = parser.parse_args()
+
+setupDeferredLogging('preprocessor.log', logging.INFO)
+
+if options.callgraph:
+    cgDoc = parseString(getDataFromFile(options.callgraph))
+else:
+    cgDoc = syntheticCallGraph(options.symbols, options.symbolsPerRoutine, routinesPerModule=10)
+memoryBeforeSymbols = peakMemoryInMB()
+startTime = time.time()
+symbolsByModuleNameAndSymbolName, symbolsByRoutineNameAndSymbolName = buildSymbolTables(cgDoc)
+elapsed = time.time() - startTime
+numOfSymbols = sum(len(symbolsByName) for symbolsByName in symbolsByModuleNameAndSymbolName.values()) \
+    + sum(len(symbolsByName) for symbolsByName in symbolsByRoutineNameAndSymbolName.values())
+memoryForSymbols = peakMemoryInMB() - memoryBeforeSymbols
+sys.stdout.write("%i symbols loaded in %.2fs; peak memory %.1f MB, %.1f MB of it for symbols (%.0f bytes per symbol)\n" %(
+    numOfSymbols,
+    elapsed,
+    peakMemoryInMB(),
+    memoryForSymbols,
+    memoryForSymbols * 1024 * 1024 / numOfSymbols if numOfSymbols > 0 else 0.0
+))
@@ -18,26 +18,162 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
-import pstats, sys
+#**********************************************************************#
+#  Procedure        combineStats.py                                    #
+#  Comment          Combines cProfile statistics and reports the stage #
+#                   reports written by the preprocessor scripts with   #
+#                   --stageReport: the latest run of every report is   #
+#                   compared against earlier runs and regressions are  #
+#                   flagged.                                           #
+#**********************************************************************#
+
+import pstats, sys, os, time
 from optparse import OptionParser
 from tools.commons import setupDeferredLogging
 from tools.filesystem import dirEntries
+from tools.instrumentation import readStageReport, getStageKey, getMetricsByStageKey, getBaselineMetricsByStageKey, getRegressions
 import logging
 
+minimumRSSDifferenceInMB = 5.0
+
+def formatChange(value, baselineValue):
+	if baselineValue == None:
+		return ""
+	if baselineValue == 0:
+		return "(+inf%)" if value > 0 else "(+0%)"
+	return "(%+.0f%%)" %((value - baselineValue) * 100.0 / baselineValue)
+
+def getStageKeysInRunOrder(run):
+	stageKeys = []
+	for stage in run["stages"]:
+		if not getStageKey(stage) in stageKeys:
+			stageKeys.append(getStageKey(stage))
+	return stageKeys
+
+def printStageReport(reportPath, runs, baselineRuns, regressions):
+	latestRun = runs[-1]
+	if isFailedRun(latestRun):
+		comparison = " - failed with exit status %i, not compared" %(latestRun["exitStatus"])
+	elif len(baselineRuns) > 0:
+		comparison = " compared to the median of %i earlier run(s)" %(len(baselineRuns))
+	else:
+		comparison = " - no earlier runs to compare to"
+	sys.stdout.write("%s: %s, run of %s%s\n" %(
+		os.path.basename(reportPath),
+		latestRun["script"],
+		time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(latestRun["startTime"])),
+		comparison
+	))
+	metricsByStageKey = getMetricsByStageKey(latestRun)
+	baselineMetricsByStageKey = getBaselineMetricsByStageKey(baselineRuns)
+	regressedStageKeys = set(stageKey for stageKey, _, _, _ in regressions)
+	fileStageKeys = set(getStageKey(stage) for stage in latestRun["stages"] if stage.get("file"))
+	#per file stages are only listed if they have regressed
+	for stageKey in ["total"] + getStageKeysInRunOrder(latestRun):
+		if stageKey in fileStageKeys and not stageKey in regressedStageKeys:
+			continue
+		metrics = metricsByStageKey[stageKey]
+		baselineMetrics = baselineMetricsByStageKey.get(stageKey, {})
+		sys.stdout.write("  %-60s %9.3fs %-8s %9.3fs CPU %-8s %8.1f MB %-8s%s\n" %(
+			stageKey,
+			metrics["wallTime"], formatChange(metrics["wallTime"], baselineMetrics.get("wallTime")),
+			metrics["cpuTime"], formatChange(metrics["cpuTime"], baselineMetrics.get("cpuTime")),
+			metrics["peakRSS"], formatChange(metrics["peakRSS"], baselineMetrics.get("peakRSS")),
+			" REGRESSION" if stageKey in regressedStageKeys else ""
+		))
+	if len(fileStageKeys) > 0:
+		sys.stdout.write("  %i of %i per file stages regressed\n" %(len(fileStageKeys & regressedStageKeys), len(fileStageKeys)))
+	profile = latestRun.get("profile")
+	if profile and options.profileEntries > 0:
+		sys.stdout.write("  most sampled functions (CPU time in the function itself / including its callees):\n")
+		for entry in profile["functions"][:options.profileEntries]:
+			sys.stdout.write("    %-70s %8.2fs %8.2fs\n" %(
+				entry["function"],
+				entry["selfSamples"] * profile["interval"],
+				entry["totalSamples"] * profile["interval"]
+			))
+
+def isFailedRun(run):
+	#reports written before the exit status has been recorded only contain successful runs
+	return run.get("exitStatus", 0) != 0
+
+def getBaselineRuns(reportPath, runs):
+	'''successful earlier runs with the same arguments, or all successful runs of the same report in the baseline directory -
+	failed runs stop early and would make the baseline look faster than it is'''
+	if options.baseline:
+		baselinePath = os.path.join(options.baseline, os.path.basename(reportPath))
+		if not os.path.isfile(baselinePath):
+			return []
+		return [run for run in readStageReport(baselinePath) if not isFailedRun(run)][-options.numOfRuns:]
+	latestRun = runs[-1]
+	return [
+		run for run in runs[:-1]
+		if run["arguments"] == latestRun["arguments"] and not isFailedRun(run)
+	][-options.numOfRuns:]
+
+##################### MAIN ##############################
+#get all program arguments
 parser = OptionParser()
 parser.add_option("-i", "--inputDirectory", dest="inputDir",
-                  help="read files from DIR", metavar="DIR")
+                  help="read files from DIR: cProfile statistics (.cprof) and stage reports (.json)", metavar="DIR")
 parser.add_option("-o", "--output", dest="output",
-                  help="output combined statistics to FILENAME", metavar="FILENAME")
+                  help="output combined cProfile statistics to FILENAME", metavar="FILENAME")
+parser.add_option("-b", "--baseline", dest="baseline",
+                  help="compare against the stage reports in DIR (e.g. of a reference build) instead of the earlier runs in the input directory", metavar="DIR")
+parser.add_option("-n", "--numOfRuns", dest="numOfRuns", type="int", default=5,
+                  help="number of earlier runs whose median is used as baseline (default: 5)", metavar="N")
+parser.add_option("-t", "--threshold", dest="threshold", type="float", default=10.0,
+                  help="flag stages as regressed whose wall time, CPU time or peak memory has grown by more than PERCENT (default: 10)", metavar="PERCENT")
+parser.add_option("--minimumDifference", dest="minimumDifference", type="float", default=0.05,
+                  help="time differences up to SECONDS are considered noise (default: 0.05). For the peak memory this is %.0f MB" %(minimumRSSDifferenceInMB), metavar="SECONDS")
+parser.add_option("--profileEntries", dest="profileEntries", type="int", default=10,
+                  help="number of most sampled functions to show for runs with a profile (default: 10)", metavar="N")
 (options, args) = parser.parse_args()
 
 setupDeferredLogging('preprocessor.log', logging.INFO)
 
-if not options.inputDir or not options.output:
+if not options.inputDir:
 	logging.error("please see --help on how to use this program")
 	sys.exit(1)
 
-statFiles = dirEntries(str(options.inputDir), False, 'cprof')
-logging.debug("combining %s" %(str(statFiles)))
-statistics = pstats.Stats(*statFiles)
-statistics.dump_stats(options.output)
\ No newline at end of file
+if options.numOfRuns < 1:
+	logging.error("numOfRuns option needs to be at least 1")
+	sys.exit(1)
+
+if options.output:
+	statFiles = dirEntries(str(options.inputDir), False, 'cprof')
+	if len(statFiles) == 0:
+		logging.error("no cProfile statistics found in %s" %(options.inputDir))
+		sys.exit(1)
+	logging.debug("combining %s" %(str(statFiles)))
+	statistics = pstats.Stats(*statFiles)
+	statistics.dump_stats(options.output)
+
+reportPaths = sorted(dirEntries(str(options.inputDir), False, 'json'))
+if len(reportPaths) == 0:
+	if not options.output:
+		logging.error("no stage reports found in %s" %(options.inputDir))
+		sys.exit(1)
+	sys.exit(0)
+
+numOfRegressions = 0
+for reportPath in reportPaths:
+	runs = readStageReport(reportPath)
+	if len(runs) == 0:
+		continue
+	baselineRuns = getBaselineRuns(reportPath, runs)
+	regressions = []
+	if not isFailedRun(runs[-1]):
+		regressions = getRegressions(
+			getMetricsByStageKey(runs[-1]),
+			getBaselineMetricsByStageKey(baselineRuns),
+			options.threshold / 100.0,
+			options.minimumDifference,
+			minimumRSSDifferenceInMB
+		)
+	printStageReport(reportPath, runs, baselineRuns, regressions)
+	numOfRegressions += len(regressions)
+
+if numOfRegressions > 0:
+	logging.error("%i regression(s) found" %(numOfRegressions))
+	sys.exit(1)
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        generateModuleDependencies.py                      #
+#  Comment          Writes the module dependencies between the         #
+#                   generated sources as a Makefile include, such      #
+#                   that they can be compiled with make -j. Optionally #
+#                   reports the longest module dependency chain.       #
+#**********************************************************************#
+
+from optparse import OptionParser
+from tools.metadata import parseCallGraphFile
+from tools.commons import UsageError, setupDeferredLogging
+from tools.dependencies import ModuleDependencyGraph
+from tools.instrumentation import StageReport, addStageReportOptions
+import sys
+import logging
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser()
+parser.add_option("-c", "--callgraph", dest="callgraph",
+                  help="callgraph to read the modules and their imports from, either in XML or binary format", metavar="XML")
+parser.add_option("-s", "--objectSuffix", dest="objectSuffix", default=".o",
+                  help="suffix of the compiled objects used in the make rules (default: .o)")
+parser.add_option("-r", "--criticalPath", action="store_true", dest="criticalPath",
+                  help="instead of the make rules, print the longest module dependency chain and the sources that can be compiled in parallel at each step")
+parser.add_option("-d", "--debug", action="store_true", dest="debug",
+                  help="show debug print in standard error output")
+addStageReportOptions(parser)
+(options, args) = parser.parse_args()
+
+setupDeferredLogging('preprocessor.log', logging.DEBUG if options.debug else logging.INFO)
+stageReport = StageReport(options.stageReport, options.profile)
+with stageReport:
+    if (not options.callgraph):
+        logging.error("callgraph option is mandatory. Use '--help' for informations on how to use this module")
+        sys.exit(1)
+
+    try:
+        timer = stageReport.startStage("Reading the callgraph")
+        cgDoc = parseCallGraphFile(options.callgraph)
+        stageReport.endStage(timer)
+        timer = stageReport.startStage("Module dependency analysis")
+        dependencyGraph = ModuleDependencyGraph(cgDoc)
+        if not options.criticalPath:
+            rules = dependencyGraph.makeRules(options.objectSuffix)
+            stageReport.endStage(timer)
+            sys.stdout.write("# module dependencies generated by generateModuleDependencies.py from %s - do not edit\n" %(options.callgraph))
+            for rule in rules:
+                sys.stdout.write(rule + "\n")
+            sys.exit(0)
+        criticalPath = dependencyGraph.criticalPath()
+        sourcesByLevel = dependencyGraph.sourcesByLevel()
+        stageReport.endStage(timer)
+        sys.stdout.write("Longest module dependency chain (%i of %i sources): %s\n" %(
+            len(criticalPath),
+            len(dependencyGraph.prerequisitesBySource),
+            " -> ".join(criticalPath)
+        ))
+        for levelNum, sources in enumerate(sourcesByLevel):
+            sys.stdout.write("Step %i, %i source(s) in parallel: %s\n" %(levelNum + 1, len(sources), " ".join(sources)))
+    except UsageError as e:
+        logging.error('Error: %s' %(str(e)))
+        sys.exit(1)
@@ -19,182 +19,434 @@
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
 from xml.dom.minidom import Document
-from tools.metadata import parseString, ImmutableDOMDocument, getClonedDocument
+from tools.metadata import parseCallGraphFile, ImmutableDOMDocument, getClonedDocument
 from optparse import OptionParser
-from machinery.parser import H90XMLSymbolDeclarationExtractor, getSymbolsByName, getModuleNodesByName, getParallelRegionData
-from machinery.converter import H90toF90Converter, getSymbolsByRoutineNameAndSymbolName, getSymbolsByModuleNameAndSymbolName
+from machinery.parser import H90XMLSymbolDeclarationExtractor, getSymbolsByName
+from machinery.converter import H90toF90Converter, getSymbolsByRoutineNameAndSymbolName, getSymbolsByModuleNameAndSymbolName, LazyModuleSymbolTable
 from machinery.commons import ConversionOptions
+from machinery.intermediate import H90FileIntermediate, getLineClassificationPath
 from tools.commons import UsageError, openFile, getDataFromFile, setupDeferredLogging, printProgressIndicator, progressIndicatorReset
-from tools.filesystem import dirEntries
+from tools.filesystem import dirEntries, writeIfChanged
 from tools.analysis import SymbolDependencyAnalyzer
+from tools.cache import ConversionCache, CallGraphSlicer, getGeneratorFingerprint
+from tools.dependencies import ConversionDependencyGraph
+from tools.callgraph import CallGraph
+from tools.instrumentation import StageReport, addStageReportOptions
+from tools.patterns import RegExPatterns
 import implementations.fortran
 from io import FileIO
-import os, errno, sys, json, traceback, logging
+from cStringIO import StringIO
+import os, errno, sys, json, traceback, logging, multiprocessing, multiprocessing.util
+
+def flushLogging():
+	for handler in logging.getLogger().handlers:
+		handler.flush()
+
+def logStatistics():
+	RegExPatterns.Instance().logStatistics()
+	symbolsByModuleNameAndSymbolName.logStatistics()
+
+def initConversionWorker():
+	#pool workers leave through os._exit, so the deferred log records would otherwise be lost
+	multiprocessing.util.Finalize(None, logStatistics, exitpriority=11)
+	multiprocessing.util.Finalize(None, flushLogging, exitpriority=10)
+	stageReport.initWorker()
+
+def getOutputPath(fileInDir):
+	return os.path.join(os.path.normpath(outputDir), os.path.splitext(os.path.basename(fileInDir))[0] + ".P90.temp")
+
+def convertFile(fileInDir):
+	#returns (fileInDir, exit code, whether the output is unchanged). Relies on the codebase-wide metadata below having been built before we're called -
+	#in a process pool the workers get it by forking the main process.
+	outputPath = getOutputPath(fileInDir)
+	outputStream = None
+	try:
+		#with writeIfChanged the output is kept in memory until we know whether it differs from the existing file
+		outputStream = StringIO() if options.writeIfChanged else FileIO(outputPath, mode="wb")
+		converter = H90toF90Converter(
+			ImmutableDOMDocument(cgDoc), #using our immutable version we can speed up ALL THE THINGS through caching
+			implementationsByTemplateName,
+			outputStream,
+			moduleNodesByName,
+			parallelRegionData,
+			symbolAnalysisByRoutineNameAndSymbolName,
+			symbolsByModuleNameAndSymbolName,
+			symbolsByRoutineNameAndSymbolName,
+		)
+		converter.processFile(fileInDir, intermediatesByFile[fileInDir])
+	except UsageError as e:
+		logging.error('Error in %s: %s' %(str(fileInDir), str(e)))
+		return fileInDir, 1, False
+	except SystemExit as e:
+		#the parser has already logged the reason
+		return fileInDir, e.code if e.code not in [None, 0] else 1, False
+	except Exception as e:
+		logging.critical('Error when generating P90.temp from h90 file %s: %s%s\n' \
+			%(str(fileInDir), str(e), traceback.format_exc())
+		)
+		logging.info(traceback.format_exc())
+		if os.path.isfile(outputPath):
+			os.unlink(outputPath)
+		return fileInDir, 1, False
+	finally:
+		outputText = None
+		if outputStream:
+			outputText = outputStream.getvalue() if options.writeIfChanged else None
+			outputStream.close()
+	isUnchanged = False
+	if options.writeIfChanged:
+		isUnchanged = not writeIfChanged(outputPath, outputText)
+	if conversionCache:
+		conversionCache.store(cacheKeysByFile[fileInDir], outputPath)
+	return fileInDir, 0, isUnchanged
+
+def getStageDetails():
+	return {"target": outputDir} if len(targets) > 1 else {}
+
+def convertAndMeasureFile(fileInDir):
+	#returns the result of convertFile together with the stage record of this conversion
+	timer = stageReport.startStage("Converting to Standard Fortran", file=fileInDir, **getStageDetails())
+	return convertFile(fileInDir) + (timer.getRecord(),)
+
+def recordConversion(fileInDir, exitCode):
+	if not dependencyGraph:
+		return
+	if exitCode == 0:
+		dependencyGraph.update(getOutputPath(fileInDir), dependencyFingerprintsByFile[fileInDir])
+	else:
+		dependencyGraph.remove(getOutputPath(fileInDir))
+
+def getSymbolAnalysisByRoutine(symbolAnalyzer):
+	symbolAnalysisByRoutine = symbolAnalyzer.getSymbolAnalysisByRoutine()
+	if not options.validateSymbolAnalysis:
+		return symbolAnalysisByRoutine
+	differences = symbolAnalyzer.getDifferencesToExhaustiveAnalysis(symbolAnalysisByRoutine)
+	if len(differences) > 0:
+		logging.critical('Memoized symbol analysis differs from exhaustive analysis:\n%s' %("\n".join(differences)))
+		sys.exit(1)
+	logging.info('Memoized symbol analysis matches exhaustive analysis')
+	return symbolAnalysisByRoutine
 
 ##################### MAIN ##############################
 #get all program arguments
 parser = OptionParser()
 parser.add_option("-i", "--sourceDir", dest="sourceDir",
 									help="Source directory containing all h90 files for this implementation")
-parser.add_option("-o", "--outputDir", dest="outputDir",
-									help="Output directory to store all the P90 files generated by this script")
-parser.add_option("-c", "--callgraph", dest="callgraph",
+parser.add_option("-o", "--outputDir", dest="outputDir", action="append",
+									help="Output directory to store all the P90 files generated by this script. -c, -m and -o can be given once per target (e.g. CPU and GPU) - the h90 files are then only read once for all targets")
+parser.add_option("-c", "--callgraph", dest="callgraph", action="append",
 									help="analyzed callgraph XML file to read", metavar="XML")
 parser.add_option("-d", "--debug", action="store_true", dest="debug",
 									help="show debug print in standard error output")
-parser.add_option("-m", "--implementation", dest="implementation",
+parser.add_option("-m", "--implementation", dest="implementation", action="append",
 									help="specify either a FortranImplementation classname or a JSON containing classnames by template name and a 'default' entry", metavar="IMP")
 parser.add_option("--optionFlags", dest="optionFlags",
 									help="can be used to switch on or off the following flags (comma separated): DO_NOT_TOUCH_GPU_CACHE_SETTINGS")
+parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+									help="number of processes used to convert the h90 files in parallel (default: 1)", metavar="N")
+parser.add_option("--cacheDir", dest="cacheDir",
+									help="directory for caching converted files. Files whose source, implementation, option flags and relevant callgraph information are unchanged are then taken from the cache", metavar="DIR")
+parser.add_option("--cacheSizeLimit", dest="cacheSizeLimit", type="int", default=512,
+									help="size limit of the conversion cache in MB. Least recently used entries are evicted beyond that (default: 512)", metavar="MB")
+parser.add_option("--cacheStats", action="store_true", dest="cacheStats",
+									help="print conversion cache statistics to standard error output")
+parser.add_option("--validateSymbolAnalysis", action="store_true", dest="validateSymbolAnalysis",
+									help="compare the memoized symbol analysis against an exhaustive walk through the callgraph and abort on differences")
+parser.add_option("--dependencyFile", dest="dependencyFile", action="append",
+									help="file to record the callgraph information each converted file depends on. Only files with changed dependencies (or missing output) are then converted again. Given once per target", metavar="JSON")
+parser.add_option("--dryRun", action="store_true", dest="dryRun",
+									help="together with --dependencyFile: print which files would be converted and why, without converting anything")
+parser.add_option("--classifyLines", action="store_true", dest="classifyLines",
+									help="keep the pattern matches of every line in a .classification file next to each h90 file, such that later runs skip the pattern matching for unchanged files")
+parser.add_option("--writeIfChanged", action="store_true", dest="writeIfChanged",
+									help="only write output files whose content has changed, such that the timestamps of unchanged files are kept and they don't get compiled again")
+addStageReportOptions(parser)
 (options, args) = parser.parse_args()
 
 setupDeferredLogging('preprocessor.log', logging.DEBUG if options.debug else logging.INFO, showDeferredLogging=not options.debug)
+stageReport = StageReport(options.stageReport, options.profile)
+with stageReport:
+	optionFlags = [flag for flag in options.optionFlags.split(',') if flag not in ['', None]] if options.optionFlags != None else []
+	logging.debug('Option Flags: %s' %(optionFlags))
+	if options.debug and 'DEBUG_PRINT' not in optionFlags:
+		optionFlags.append('DEBUG_PRINT')
+
+	if (not options.sourceDir):
+			logging.error("sourceDir option is mandatory. Use '--help' for informations on how to use this module")
+			sys.exit(1)
 
-optionFlags = [flag for flag in options.optionFlags.split(',') if flag not in ['', None]] if options.optionFlags != None else []
-logging.debug('Option Flags: %s' %(optionFlags))
-if options.debug and 'DEBUG_PRINT' not in optionFlags:
-	optionFlags.append('DEBUG_PRINT')
+	if (not options.outputDir):
+			logging.error("outputDir option is mandatory. Use '--help' for informations on how to use this module")
+			sys.exit(1)
 
-if (not options.sourceDir):
-		logging.error("sourceDir option is mandatory. Use '--help' for informations on how to use this module")
+	if (not options.callgraph):
+			logging.error("callgraph option is mandatory. Use '--help' for informations on how to use this module")
+			sys.exit(1)
+
+	if (not options.implementation):
+		logging.error("implementation option is mandatory. Use '--help' for informations on how to use this module")
 		sys.exit(1)
 
-if (not options.outputDir):
-		logging.error("outputDir option is mandatory. Use '--help' for informations on how to use this module")
+	if options.jobs < 1:
+		logging.error("jobs option needs to be at least 1")
 		sys.exit(1)
 
-if (not options.callgraph):
-		logging.error("callgraph option is mandatory. Use '--help' for informations on how to use this module")
+	if len(options.callgraph) != len(options.outputDir) or len(options.implementation) != len(options.outputDir):
+		logging.error("callgraph, implementation and outputDir options need to be given once per target")
 		sys.exit(1)
 
-if (not options.implementation):
-	logging.error("implementation option is mandatory. Use '--help' for informations on how to use this module")
-	sys.exit(1)
-
-ConversionOptions.Instance().debugPrint = options.debug
-filesInDir = dirEntries(str(options.sourceDir), True, 'h90')
-
-try:
-	os.mkdir(options.outputDir)
-except OSError as e:
-	#we want to handle if a directory exists. every other exception at this point is thrown again.
-	if e.errno != errno.EEXIST:
-		raise e
-	pass
-
-#   get the callgraph information
-cgDoc = parseString(getDataFromFile(options.callgraph), immutable=False)
-
-#   build up implementationNamesByTemplateName
-implementationNamesByTemplateName = None
-try:
-	implementationNamesByTemplateName = json.loads(getDataFromFile(options.implementation))
-except ValueError as e:
-	logging.critical('Error decoding implementation json (%s): %s' \
-		%(str(options.implementation), str(e))
-	)
-	sys.exit(1)
-except Exception as e:
-	logging.critical('Could not interpret implementation parameter as json file to read. Trying to use it as an implementation name directly')
-	implementationNamesByTemplateName = {'default':options.implementation}
-logging.debug('Initializing H90toF90Converter with the following implementations: %s' %(json.dumps(implementationNamesByTemplateName)))
-implementationsByTemplateName = {
-	templateName:getattr(implementations.fortran, implementationNamesByTemplateName[templateName])(optionFlags)
-	for templateName in implementationNamesByTemplateName.keys()
-}
-
-#   parse the @domainDependant symbol declarations flags in all h90 files
-#   -> update the callgraph document with this information.
-#   note: We do this, since for simplicity reasons, the declaration parser relies on the symbol names that
-#   have been declared in @domainDependant directives. Since these directives come *after* the declaration,
-#   we need this pass
-# cgDoc = getClonedDocument(cgDoc)
-for fileNum, fileInDir in enumerate(filesInDir):
-	parser = H90XMLSymbolDeclarationExtractor(cgDoc, implementationsByTemplateName=implementationsByTemplateName)
-	parser.processFile(fileInDir)
-	logging.debug("Symbol declarations extracted for " + fileInDir + "")
-	printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesInDir), "Symbol parsing, excluding imports")
-progressIndicatorReset(sys.stderr)
-
-#   build up symbol table indexed by module name
-moduleNodesByNameWithoutImplicitImports = getModuleNodesByName(cgDoc)
-symbolAnalyzer = SymbolDependencyAnalyzer(cgDoc)
-symbolAnalysisByRoutineNameAndSymbolNameWithoutImplicitImports = symbolAnalyzer.getSymbolAnalysisByRoutine()
-symbolsByModuleNameAndSymbolNameWithoutImplicitImports = getSymbolsByModuleNameAndSymbolName(
-	ImmutableDOMDocument(cgDoc),
-	moduleNodesByNameWithoutImplicitImports,
-	symbolAnalysisByRoutineNameAndSymbolName=symbolAnalysisByRoutineNameAndSymbolNameWithoutImplicitImports
-)
-
-#   parse the symbols again, this time know about all informations in the sourced modules in import
-#   -> update the callgraph document with this information.
-for fileNum, fileInDir in enumerate(filesInDir):
-	parser = H90XMLSymbolDeclarationExtractor(
-		cgDoc,
-		symbolsByModuleNameAndSymbolNameWithoutImplicitImports,
-		implementationsByTemplateName=implementationsByTemplateName
-	)
-	parser.processFile(fileInDir)
-	logging.debug("Symbol imports and declarations extracted for " + fileInDir + "")
-	printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesInDir), "Symbol parsing, including imports")
-progressIndicatorReset(sys.stderr)
-
-#   build up meta informations about the whole codebase
-try:
-	sys.stderr.write('Processing informations about the whole codebase\n')
-	moduleNodesByName = getModuleNodesByName(cgDoc)
-	parallelRegionData = getParallelRegionData(cgDoc)
-	symbolAnalyzer = SymbolDependencyAnalyzer(cgDoc)
-	#next line writes some information to cgDoc as a sideeffect. $$$ clean this up, ideally make cgDoc immutable everywhere for better performance
-	symbolAnalysisByRoutineNameAndSymbolName = symbolAnalyzer.getSymbolAnalysisByRoutine()
-	symbolsByModuleNameAndSymbolName = getSymbolsByModuleNameAndSymbolName(
-		ImmutableDOMDocument(cgDoc),
-		moduleNodesByName,
-		symbolAnalysisByRoutineNameAndSymbolName=symbolAnalysisByRoutineNameAndSymbolName
-	)
-	symbolsByRoutineNameAndSymbolName = getSymbolsByRoutineNameAndSymbolName(
-		ImmutableDOMDocument(cgDoc),
-		parallelRegionData[2],
-		parallelRegionData[1],
-		symbolAnalysisByRoutineNameAndSymbolName=symbolAnalysisByRoutineNameAndSymbolName
+	if options.dependencyFile and len(options.dependencyFile) != len(options.outputDir):
+		logging.error("dependencyFile option needs to be given once per target")
+		sys.exit(1)
+
+	if options.dryRun and not options.dependencyFile:
+		logging.error("dryRun option requires a dependencyFile")
+		sys.exit(1)
+
+	ConversionOptions.Instance().debugPrint = options.debug
+	filesInDir = dirEntries(str(options.sourceDir), True, 'h90')
+
+	#   read every h90 file only once - the parsed declarations and line classifications are shared between all passes over a file,
+	#   also between the targets, since they don't depend on the callgraph or the implementation
+	timer = stageReport.startStage("Reading h90 files")
+	intermediatesByFile = dict(
+		(fileInDir, H90FileIntermediate(fileInDir, getLineClassificationPath(fileInDir) if options.classifyLines else None))
+		for fileInDir in filesInDir
 	)
-except UsageError as e:
-	logging.error('Error: %s' %(str(e)))
-	sys.exit(1)
-except Exception as e:
-	logging.critical('Error when processing meta information about the codebase: %s' %(str(e)))
-	logging.info(traceback.format_exc())
-	sys.exit(1)
+	stageReport.endStage(timer)
 
+	conversionCache = None
+	if options.cacheDir:
+		conversionCache = ConversionCache(options.cacheDir, options.cacheSizeLimit * 1024 * 1024)
 
+	#   everything from here on depends on the target's callgraph and implementation - most importantly the symbols,
+	#   since branches in the h90 files are taken depending on the implementation's architecture
+	failedFiles = []
+	targets = zip(options.callgraph, options.implementation, options.outputDir, options.dependencyFile or [None] * len(options.outputDir))
+	for callGraphPath, implementationParameter, outputDir, dependencyFilePath in targets:
+		if len(targets) > 1:
+			progressIndicatorReset(sys.stderr)
+			sys.stderr.write("Converting for %s\n" %(outputDir))
 
-#   Finally, do the conversion based on all the information above.
-for fileNum, fileInDir in enumerate(filesInDir):
-	outputPath = os.path.join(os.path.normpath(options.outputDir), os.path.splitext(os.path.basename(fileInDir))[0] + ".P90.temp")
-	printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesInDir), "Converting to Standard Fortran")
-	outputStream = FileIO(outputPath, mode="wb")
-	try:
-		converter = H90toF90Converter(
-			ImmutableDOMDocument(cgDoc), #using our immutable version we can speed up ALL THE THINGS through caching
-			implementationsByTemplateName,
-			outputStream,
-			moduleNodesByName,
-			parallelRegionData,
-			symbolAnalysisByRoutineNameAndSymbolName,
-			symbolsByModuleNameAndSymbolName,
-			symbolsByRoutineNameAndSymbolName,
-		)
-		converter.processFile(fileInDir)
-	except UsageError as e:
-		logging.error('Error: %s' %(str(e)))
-		sys.exit(1)
-	except Exception as e:
-		logging.critical('Error when generating P90.temp from h90 file %s: %s%s\n' \
-			%(str(fileInDir), str(e), traceback.format_exc())
+		try:
+			os.mkdir(outputDir)
+		except OSError as e:
+			#we want to handle if a directory exists. every other exception at this point is thrown again.
+			if e.errno != errno.EEXIST:
+				raise e
+			pass
+
+		#   get the callgraph information
+		timer = stageReport.startStage("Reading the callgraph", **getStageDetails())
+		cgDoc = parseCallGraphFile(callGraphPath, immutable=False)
+		#   routines, calls, modules and parallel regions are not changed by the symbol passes -> index them only once
+		try:
+			callGraph = CallGraph(cgDoc)
+		except Exception as e:
+			logging.critical('Error when indexing the callgraph: %s' %(str(e)))
+			sys.exit(1)
+		stageReport.endStage(timer)
+
+		#   build up implementationNamesByTemplateName
+		implementationNamesByTemplateName = None
+		try:
+			implementationNamesByTemplateName = json.loads(getDataFromFile(implementationParameter))
+		except ValueError as e:
+			logging.critical('Error decoding implementation json (%s): %s' \
+				%(str(implementationParameter), str(e))
+			)
+			sys.exit(1)
+		except Exception as e:
+			logging.critical('Could not interpret implementation parameter as json file to read. Trying to use it as an implementation name directly')
+			implementationNamesByTemplateName = {'default':implementationParameter}
+		logging.debug('Initializing H90toF90Converter with the following implementations: %s' %(json.dumps(implementationNamesByTemplateName)))
+		implementationsByTemplateName = {
+			templateName:getattr(implementations.fortran, implementationNamesByTemplateName[templateName])(optionFlags)
+			for templateName in implementationNamesByTemplateName.keys()
+		}
+
+		#   parse the @domainDependant symbol declarations flags in all h90 files
+		#   -> update the callgraph document with this information.
+		#   note: We do this, since for simplicity reasons, the declaration parser relies on the symbol names that
+		#   have been declared in @domainDependant directives. Since these directives come *after* the declaration,
+		#   we need this pass
+		# cgDoc = getClonedDocument(cgDoc)
+		timer = stageReport.startStage("Symbol parsing, excluding imports", **getStageDetails())
+		for fileNum, fileInDir in enumerate(filesInDir):
+			parser = H90XMLSymbolDeclarationExtractor(
+				cgDoc,
+				implementationsByTemplateName=implementationsByTemplateName,
+				moduleNodesByName=callGraph.moduleNodesByName,
+				parallelRegionData=callGraph.parallelRegionData
+			)
+			parser.processFile(fileInDir, intermediatesByFile[fileInDir])
+			logging.debug("Symbol declarations extracted for " + fileInDir + "")
+			printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesInDir), "Symbol parsing, excluding imports")
+		progressIndicatorReset(sys.stderr)
+		stageReport.endStage(timer)
+
+		#   build up symbol table indexed by module name
+		timer = stageReport.startStage("Symbol analysis, excluding imports", **getStageDetails())
+		symbolAnalyzer = SymbolDependencyAnalyzer(cgDoc, callGraph)
+		symbolAnalysisByRoutineNameAndSymbolNameWithoutImplicitImports = getSymbolAnalysisByRoutine(symbolAnalyzer)
+		symbolsByModuleNameAndSymbolNameWithoutImplicitImports = getSymbolsByModuleNameAndSymbolName(
+			ImmutableDOMDocument(cgDoc),
+			callGraph.moduleNodesByName,
+			symbolAnalysisByRoutineNameAndSymbolName=symbolAnalysisByRoutineNameAndSymbolNameWithoutImplicitImports
 		)
-		logging.info(traceback.format_exc())
-		os.unlink(outputPath)
+		stageReport.endStage(timer)
+
+		#   parse the symbols again, this time know about all informations in the sourced modules in import
+		#   -> update the callgraph document with this information.
+		timer = stageReport.startStage("Symbol parsing, including imports", **getStageDetails())
+		for fileNum, fileInDir in enumerate(filesInDir):
+			parser = H90XMLSymbolDeclarationExtractor(
+				cgDoc,
+				symbolsByModuleNameAndSymbolNameWithoutImplicitImports,
+				implementationsByTemplateName=implementationsByTemplateName,
+				moduleNodesByName=callGraph.moduleNodesByName,
+				parallelRegionData=callGraph.parallelRegionData
+			)
+			parser.processFile(fileInDir, intermediatesByFile[fileInDir])
+			logging.debug("Symbol imports and declarations extracted for " + fileInDir + "")
+			printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesInDir), "Symbol parsing, including imports")
+		progressIndicatorReset(sys.stderr)
+		stageReport.endStage(timer)
+
+		#   build up meta informations about the whole codebase
+		timer = stageReport.startStage("Processing informations about the whole codebase", **getStageDetails())
+		try:
+			sys.stderr.write('Processing informations about the whole codebase\n')
+			moduleNodesByName = callGraph.moduleNodesByName
+			parallelRegionData = callGraph.parallelRegionData
+			symbolAnalyzer = SymbolDependencyAnalyzer(cgDoc, callGraph)
+			#next line writes some information to cgDoc as a sideeffect. $$$ clean this up, ideally make cgDoc immutable everywhere for better performance
+			symbolAnalysisByRoutineNameAndSymbolName = getSymbolAnalysisByRoutine(symbolAnalyzer)
+			#the callgraph doesn't change from here on, so module symbols can be created once a routine uses them
+			symbolsByModuleNameAndSymbolName = LazyModuleSymbolTable(
+				ImmutableDOMDocument(cgDoc),
+				moduleNodesByName,
+				symbolAnalysisByRoutineNameAndSymbolName=symbolAnalysisByRoutineNameAndSymbolName
+			)
+			symbolsByRoutineNameAndSymbolName = getSymbolsByRoutineNameAndSymbolName(
+				ImmutableDOMDocument(cgDoc),
+				parallelRegionData[2],
+				parallelRegionData[1],
+				symbolAnalysisByRoutineNameAndSymbolName=symbolAnalysisByRoutineNameAndSymbolName
+			)
+		except UsageError as e:
+			logging.error('Error: %s' %(str(e)))
+			sys.exit(1)
+		except Exception as e:
+			logging.critical('Error when processing meta information about the codebase: %s' %(str(e)))
+			logging.info(traceback.format_exc())
+			sys.exit(1)
+		stageReport.endStage(timer)
+
+
+
+		timer = stageReport.startStage("Checking dependencies and cache", **getStageDetails())
+		callGraphSlicer = None
+		if conversionCache or dependencyFilePath:
+			callGraphSlicer = CallGraphSlicer(cgDoc, symbolAnalysisByRoutineNameAndSymbolName)
+
+		#   Skip the files whose dependencies haven't changed since they have last been converted.
+		dependencyGraph = None
+		dependencyFingerprintsByFile = {}
+		filesToConvert = filesInDir
+		if dependencyFilePath:
+			dependencyGraph = ConversionDependencyGraph(dependencyFilePath)
+			generatorFingerprint = getGeneratorFingerprint()
+			filesToConvert = []
+			for fileInDir in filesInDir:
+				dependencyFingerprintsByFile[fileInDir] = dependencyGraph.getDependencyFingerprints(
+					fileInDir,
+					callGraphSlicer,
+					implementationNamesByTemplateName,
+					optionFlags,
+					generatorFingerprint
+				)
+				rebuildReasons = dependencyGraph.getRebuildReasons(getOutputPath(fileInDir), dependencyFingerprintsByFile[fileInDir])
+				if len(rebuildReasons) == 0:
+					logging.debug("%s is up to date" %(fileInDir))
+					continue
+				if options.dryRun:
+					sys.stdout.write("%s: %s\n" %(fileInDir, "; ".join(rebuildReasons)))
+				filesToConvert.append(fileInDir)
+			if options.dryRun:
+				stageReport.endStage(timer)
+				continue
+
+		#   Look up the files whose conversion result is already known.
+		cacheKeysByFile = {}
+		if conversionCache:
+			numOfCacheHitsBefore = conversionCache.hits
+			numOfUnchangedOutputsBefore = conversionCache.unchangedOutputs
+			filesFetchedFromCache = []
+			for fileInDir in filesToConvert:
+				cacheKeysByFile[fileInDir] = conversionCache.keyForFile(fileInDir, callGraphSlicer, implementationNamesByTemplateName, optionFlags)
+				if conversionCache.fetch(cacheKeysByFile[fileInDir], getOutputPath(fileInDir), onlyIfChanged=options.writeIfChanged):
+					logging.debug("Conversion of %s taken from cache" %(fileInDir))
+					filesFetchedFromCache.append(fileInDir)
+					recordConversion(fileInDir, 0)
+			filesToConvert = [fileInDir for fileInDir in filesToConvert if not fileInDir in filesFetchedFromCache]
+		stageReport.endStage(timer)
+
+		#   Finally, do the conversion based on all the information above.
+		#   With more than one job we fork only now, such that the workers share the metadata copy-on-write.
+		#   Every worker converts a single file and is then replaced, so each file is converted against the same state
+		#   of the symbol tables, independent of how files are distributed among the workers.
+		numOfUnchangedFiles = 0
+		numOfFailedFilesBefore = len(failedFiles)
+		timer = stageReport.startStage("Converting to Standard Fortran", **getStageDetails())
+		try:
+			if options.jobs == 1 or len(filesToConvert) < 2:
+				for fileNum, fileInDir in enumerate(filesToConvert):
+					printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesToConvert), "Converting to Standard Fortran")
+					_, exitCode, isUnchanged, stageRecord = convertAndMeasureFile(fileInDir)
+					stageReport.addStage(stageRecord)
+					recordConversion(fileInDir, exitCode)
+					numOfUnchangedFiles += 1 if isUnchanged else 0
+					if exitCode != 0:
+						sys.exit(exitCode)
+			else:
+				pool = multiprocessing.Pool(min(options.jobs, len(filesToConvert)), initializer=initConversionWorker, maxtasksperchild=1)
+				try:
+					#imap hands back the results in file order, so the progress and error summary are deterministic
+					for fileNum, (fileInDir, exitCode, isUnchanged, stageRecord) in enumerate(pool.imap(convertAndMeasureFile, filesToConvert)):
+						printProgressIndicator(sys.stderr, fileInDir, fileNum + 1, len(filesToConvert), "Converting to Standard Fortran")
+						stageReport.addStage(stageRecord)
+						recordConversion(fileInDir, exitCode)
+						numOfUnchangedFiles += 1 if isUnchanged else 0
+						if exitCode != 0:
+							failedFiles.append(fileInDir if len(targets) == 1 else getOutputPath(fileInDir))
+					pool.close()
+				except KeyboardInterrupt:
+					pool.terminate()
+					raise
+				finally:
+					pool.join()
+		finally:
+			#also record the files converted so far if we abort
+			if dependencyGraph:
+				dependencyGraph.write()
+		stageReport.endStage(timer)
+		progressIndicatorReset(sys.stderr)
+
+		logStatistics()
+		if options.writeIfChanged:
+			numOfGeneratedFiles = len(filesToConvert) - (len(failedFiles) - numOfFailedFilesBefore)
+			if conversionCache:
+				numOfGeneratedFiles += conversionCache.hits - numOfCacheHitsBefore
+				numOfUnchangedFiles += conversionCache.unchangedOutputs - numOfUnchangedOutputsBefore
+			sys.stderr.write("%i of %i generated files unchanged, their timestamps have been kept\n" %(numOfUnchangedFiles, numOfGeneratedFiles))
+
+	if options.dryRun:
+		sys.exit(0)
+	if conversionCache:
+		conversionCache.evict()
+		if options.cacheStats:
+			conversionCache.printStatistics(sys.stderr)
+	if len(failedFiles) > 0:
+		logging.error('Conversion failed for %i file(s): %s' %(len(failedFiles), ", ".join(failedFiles)))
 		sys.exit(1)
-	finally:
-		outputStream.close()
-progressIndicatorReset(sys.stderr)
\ No newline at end of file
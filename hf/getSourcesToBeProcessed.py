@@ -3,7 +3,7 @@ import sys
 import logging
 from optparse import OptionParser
 from xml.dom.minidom import Document
-from tools.metadata import getDomainDependantTemplatesAndEntries, parseString
+from tools.metadata import getDomainDependantTemplatesAndEntries, parseString, parseCallGraphFile
 from tools.commons import setupDeferredLogging
 
 def isEqualElement(a, b, ignoreAttributes):
@@ -186,10 +186,7 @@ if (not options.reference or not options.input):
 inputXML = None
 referenceXML = None
 
-inputXMLFile = open(str(options.input),'r')
-inputXMLData = inputXMLFile.read()
-inputXMLFile.close()
-inputXML = parseString(inputXMLData)
+inputXML = parseCallGraphFile(str(options.input))
 referenceXMLFile = None
 try:
   referenceXMLFile = open(str(options.reference),'r')
@@ -28,11 +28,13 @@
 
 
 from xml.dom.minidom import Document
-from tools.metadata import parseString
+from tools.metadata import parseCallGraphFile, binaryFromDocument
 from xml.dom import NotFoundErr
 from tools.analysis import SymbolDependencyAnalyzer
-from tools.metadata import firstDuplicateChild, getNodeValue, getCalleesByCallerName, getCallersByCalleeName
-from tools.commons import openFile, printProgressIndicator, progressIndicatorReset, setupDeferredLogging
+from tools.metadata import getNodeValue, getCalleesByCallerName, getCallersByCalleeName, getRoutineNodesByName, \
+	addAttributeToAllCallGraphAncestors, addAttributeToAllCallGraphHeirs
+from tools.commons import UsageError, printProgressIndicator, progressIndicatorReset, setupDeferredLogging
+from tools.instrumentation import StageReport, addStageReportOptions
 from optparse import OptionParser
 import logging
 import os
@@ -41,81 +43,6 @@ import pdb
 import traceback
 import logging
 
-def getTemplateRelations(routineNode):
-	templateRelations = []
-	parallelRegionParents = routineNode.getElementsByTagName("parallelRegions")
-	if not parallelRegionParents or len(parallelRegionParents) == 0:
-		parallelRegionParents = routineNode.getElementsByTagName("activeParallelRegions")
-	if parallelRegionParents and len(parallelRegionParents) > 0:
-		templateRelations = parallelRegionParents[0].getElementsByTagName("templateRelation")
-	return templateRelations
-
-def addTemplateRelation(routineNode, templateRelation):
-	parallelRegionsNodes = routineNode.getElementsByTagName("activeParallelRegions")
-	parallelRegionNode = None
-	if len(parallelRegionsNodes) == 0:
-		parallelRegionNode = doc.createElement("activeParallelRegions")
-		routineNode.appendChild(parallelRegionNode)
-	else:
-		parallelRegionNode = parallelRegionsNodes[0]
-	templateID = templateRelation.getAttribute("id")
-	newTemplateRelationNode = doc.createElement("templateRelation")
-	newTemplateRelationNode.setAttribute("id", templateID)
-	if not firstDuplicateChild(parallelRegionNode, newTemplateRelationNode, ignoreIDs=False):
-		parallelRegionNode.appendChild(newTemplateRelationNode)
-
-def addAttributeToAllCallGraphAncestors(routines, callNodesByCalleeName, routineNode, attributeName, attributeValue):
-	routineName = routineNode.getAttribute("name")
-	templateRelations = getTemplateRelations(routineNode)
-	calls = callNodesByCalleeName.get(routineName)
-	if not calls:
-		return
-	for call in calls:
-		if call.getAttribute("callee") != routineName:
-			raise Exception("Wrong initialisation of caller-by-callee index.")
-		#we got a match. search the caller routine
-		callerName = call.getAttribute("caller")
-		for routine in routines:
-			if routine.getAttribute("name") != callerName:
-				continue
-			if attributeName == 'parallelRegionPosition' and not routine.getAttribute(attributeName) in [None, '', attributeValue]:
-				raise Exception("Routine %s contains one or more kernels and at the same time has one or more kernels in its inner callgraph. \
-This is not allowed in Hybrid Fortran. Please turn this subroutine into a kernel wrapper, putting its own parallel regions into seperate subroutines." %(callerName))
-			callerNode = routine
-			routine.setAttribute(attributeName, attributeValue)
-			for templateRelation in templateRelations:
-				addTemplateRelation(routine, templateRelation)
-			addAttributeToAllCallGraphAncestors(routines, callNodesByCalleeName, callerNode, attributeName, attributeValue)
-			break
-
-def addAttributeToAllCallGraphHeirs(routines, callNodesByCallerName, routineNode, attributeName, attributeValue):
-	routineName = routineNode.getAttribute("name")
-	parallelRegionPosition = routineNode.getAttribute("parallelRegionPosition")
-	templateRelations = getTemplateRelations(routineNode)
-	calls = callNodesByCallerName.get(routineName)
-	if not calls:
-		return
-	for call in calls:
-		if call.getAttribute("caller") != routineName:
-			raise Exception("Wrong initialisation of callee-by-caller index.")
-		#check whether this call is within a parallel region. Only take into consideration those that are.
-		if parallelRegionPosition == "within" and call.getAttribute("parallelRegionPosition") != "surround":
-			continue
-		#we got a match. search the caller routine
-		calleeName = call.getAttribute("callee")
-		for routine in routines:
-			if routine.getAttribute("name") != calleeName:
-				continue
-			if attributeName == 'parallelRegionPosition' and not routine.getAttribute(attributeName) in [None, '', attributeValue]:
-				raise Exception("Routine %s contains one or more kernels and at the same time is being called inside a kernel. \
-This is not allowed in Hybrid Fortran. Please call this subroutine in a wrapper function instead, moving the other kernel into its own subroutine." %(callerName))
-			calleeNode = routine
-			routine.setAttribute(attributeName, attributeValue)
-			for templateRelation in templateRelations:
-				addTemplateRelation(routine, templateRelation)
-			addAttributeToAllCallGraphHeirs(routines, callNodesByCallerName, calleeNode, attributeName, attributeValue)
-			break
-
 #returns the first kernel caller that's being found in the calls by routine with name 'routineName'
 def getFirstKernelCallerInCalleesOf(routineName, callNodesByCallerName, parallelRegionNodesByRoutineName):
 	calls = callNodesByCallerName.get(routineName)
@@ -137,7 +64,7 @@ def getFirstKernelCallerInCalleesOf(routineName, callNodesByCallerName, parallel
 			return call
 	return None
 
-def filterParallelRegionNodes(doc, routineNode, appliesTo, templates):
+def filterParallelRegionNodes(doc, routineNode, appliesTo, templatesByID):
 	def purgeTemplateRelation(routineNode, regionsNode, templateRelation):
 		regionsNode.removeChild(templateRelation)
 		remainingTemplateRelations = regionsNode.getElementsByTagName("templateRelation")
@@ -158,11 +85,7 @@ def filterParallelRegionNodes(doc, routineNode, appliesTo, templates):
 	templateRelations = regionsNode.getElementsByTagName("templateRelation")
 	for templateRelation in templateRelations:
 		templateID = templateRelation.getAttribute("id")
-		matchedTemplate = None
-		for template in templates:
-			if template.getAttribute("id") == templateID:
-				matchedTemplate = template
-				break
+		matchedTemplate = templatesByID.get(templateID)
 		if matchedTemplate == None:
 			raise Exception("Parallel region template id %s cannot be matched\n" %(templateID))
 		appliesToNodes = matchedTemplate.getElementsByTagName("appliesTo")
@@ -180,11 +103,14 @@ def filterParallelRegionNodes(doc, routineNode, appliesTo, templates):
 				continue
 
 def analyseParallelRegions(doc, appliesTo):
+	timer = stageReport.startStage("Filtering parallel regions")
 	callNodes = doc.getElementsByTagName("call")
 	routineNodes = doc.getElementsByTagName("routine")
-	templates = doc.getElementsByTagName("parallelRegionTemplate")
+	templatesByID = {}
+	for template in doc.getElementsByTagName("parallelRegionTemplate"):
+		templatesByID.setdefault(template.getAttribute("id"), template)
 	for routineNum, routineNode in enumerate(routineNodes):
-		filterParallelRegionNodes(doc, routineNode, appliesTo, templates)
+		filterParallelRegionNodes(doc, routineNode, appliesTo, templatesByID)
 		printProgressIndicator(
 			sys.stderr,
 			"",
@@ -193,8 +119,12 @@ def analyseParallelRegions(doc, appliesTo):
 			"Filtering parallel regions for %s" %(appliesTo) if appliesTo != "" else "Filtering parallel regions"
 		)
 	progressIndicatorReset(sys.stderr)
+	stageReport.endStage(timer)
+	timer = stageReport.startStage("Populating parallel region cache")
 	callNodesByCallerName = getCalleesByCallerName(callNodes)
 	callNodesByCalleeName = getCallersByCalleeName(callNodes)
+	routineNodesByName = getRoutineNodesByName(routineNodes)
+	templateIDsByRoutineNode = {}
 
 	parallelRegionNodes = doc.getElementsByTagName("parallelRegions")
 	parallelRegionNodesByRoutineName = {}
@@ -205,6 +135,8 @@ def analyseParallelRegions(doc, appliesTo):
 		if appliesTo == "GPU" and parallelRegionNodesByRoutineName.get(routineName) != None:
 			raise Exception("Multiple GPU parallel regions in subroutine %s" %(routineName))
 		parallelRegionNodesByRoutineName[routineName] = parallelRegionNode
+	stageReport.endStage(timer)
+	timer = stageReport.startStage("Parallel region analysis")
 
 	kernelCallerProblemFound = False
 	messagesPresentedFor = []
@@ -222,8 +154,8 @@ This is not allowed in Hybrid Fortran. Please separate kernel routines from wrap
 		routineName = routine.getAttribute("name")
 		if routineName == None:
 			raise Exception("Kernel routine without name")
-		addAttributeToAllCallGraphAncestors(routineNodes, callNodesByCalleeName, routine, "parallelRegionPosition", "inside")
-		addAttributeToAllCallGraphHeirs(routineNodes, callNodesByCallerName, routine, "parallelRegionPosition", "outside")
+		addAttributeToAllCallGraphAncestors(routineNodesByName, callNodesByCalleeName, routine, "parallelRegionPosition", "inside", templateIDsByRoutineNode)
+		addAttributeToAllCallGraphHeirs(routineNodesByName, callNodesByCallerName, routine, "parallelRegionPosition", "outside", templateIDsByRoutineNode)
 
 		#rename this parallelRegion node to 'activeParallelRegion'
 		children = parallelRegionNode.childNodes
@@ -264,12 +196,13 @@ This may cause device attribute mismatch compiler errors. In this case please wr
 				elif kernelCallerName not in messagesPresentedFor:
 					messagesPresentedFor.append(kernelCallerName)
 					logging.warning("...same for %s: calls kernel %s, kernel wrapper %s" %(kernelCallerName, routineName, kernelWrapperName))
+	stageReport.endStage(timer)
 
 ##################### MAIN ##############################
 #get all program arguments
 parser = OptionParser()
 parser.add_option("-i", "--sourceXML", dest="source",
-                  help="read callgraph from this XML file", metavar="XML")
+                  help="read callgraph from this XML or binary file", metavar="XML")
 parser.add_option("-a", "--appliesTo", dest="appliesTo",
                   help="specify the framework for which the loopstructure shall be extracted (as specified in the appliesTo section in parallelRegion definitions)")
 parser.add_option("-d", "--debug", action="store_true", dest="debug",
@@ -277,38 +210,45 @@ parser.add_option("-d", "--debug", action="store_true", dest="debug",
                   )
 parser.add_option("-p", "--pretty", action="store_true", dest="pretty",
                   help="make xml output pretty")
+parser.add_option("-b", "--binary", action="store_true", dest="binary",
+                  help="write the callgraph in binary format instead of xml (faster to load for the following stages - use pretty.py to export it as xml)")
+addStageReportOptions(parser)
 (options, args) = parser.parse_args()
 
 setupDeferredLogging('preprocessor.log', logging.DEBUG if options.debug else logging.INFO)
-
-if (not options.source):
-    logging.error("sourceXML option is mandatory. Use '--help' for informations on how to use this module")
-    sys.exit(1)
-
-appliesTo = ""
-if options.appliesTo and options.appliesTo.upper() != "CPU":
-	appliesTo = options.appliesTo
-
-#read in working xml
-sys.stderr.write("Reading codebase meta information\n")
-srcFile = openFile(str(options.source),'r')
-data = srcFile.read()
-srcFile.close()
-doc = parseString(data)
-
-try:
-	analyseParallelRegions(doc, appliesTo)
-except UsageError as e:
-    logging.error('Error: %s' %(str(e)))
-    sys.exit(1)
-except Exception as e:
-	logging.critical('Error when analysing callgraph file %s: %s'
-		%(str(options.source), str(e))
-	)
-	logging.info(traceback.format_exc())
-	sys.exit(1)
-
-if (options.pretty):
-	sys.stdout.write(doc.toprettyxml())
-else:
-	sys.stdout.write(doc.toxml())
\ No newline at end of file
+stageReport = StageReport(options.stageReport, options.profile, logLevel=logging.INFO)
+with stageReport:
+	if (not options.source):
+		logging.error("sourceXML option is mandatory. Use '--help' for informations on how to use this module")
+		sys.exit(1)
+
+	appliesTo = ""
+	if options.appliesTo and options.appliesTo.upper() != "CPU":
+		appliesTo = options.appliesTo
+
+	#read in working xml
+	sys.stderr.write("Reading codebase meta information\n")
+	timer = stageReport.startStage("Reading codebase meta information")
+	doc = parseCallGraphFile(str(options.source))
+	stageReport.endStage(timer)
+
+	try:
+		analyseParallelRegions(doc, appliesTo)
+	except UsageError as e:
+		logging.error('Error: %s' %(str(e)))
+		sys.exit(1)
+	except Exception as e:
+		logging.critical('Error when analysing callgraph file %s: %s'
+			%(str(options.source), str(e))
+		)
+		logging.info(traceback.format_exc())
+		sys.exit(1)
+
+	timer = stageReport.startStage("Writing the analysed callgraph")
+	if (options.binary):
+		sys.stdout.write(binaryFromDocument(doc))
+	elif (options.pretty):
+		sys.stdout.write(doc.toprettyxml())
+	else:
+		sys.stdout.write(doc.toxml())
+	stageReport.endStage(timer)
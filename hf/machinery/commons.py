@@ -19,16 +19,15 @@
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
 import re, logging
-from tools.commons import BracketAnalyzer, Singleton, UsageError, findRightMostOccurrenceNotInsideQuotes, \
-    splitIntoComponentsAndRemainder, getComponentNameAndBracketContent
+from tools.commons import Singleton, UsageError, QuoteMask, splitIntoComponentsAndRemainder, getComponentNameAndBracketContent
+from tools.tokenizer import getArgumentsInOpenedBracketsAndRemainder
 from tools.patterns import RegExPatterns
 
 def getAccessorsAndRemainder(accessorString):
     symbolAccessString_match = RegExPatterns.Instance().symbolAccessPattern.match(accessorString)
     if not symbolAccessString_match:
         return [], accessorString
-    currBracketAnalyzer = BracketAnalyzer()
-    return currBracketAnalyzer.getListOfArgumentsInOpenedBracketsAndRemainder(symbolAccessString_match.group(1))
+    return getArgumentsInOpenedBracketsAndRemainder(symbolAccessString_match.group(1))
 
 def updateTypeParameterProperties(symbolToCheckAsTypeParameter, symbolsToUpdate):
     matchedSymbols = symbolIsTypeParameterFor(symbolToCheckAsTypeParameter, symbolsToUpdate)
@@ -48,11 +47,28 @@ def symbolIsTypeParameterFor(symbol, symbolsToCheck):
     for symbolToCheck in symbolsToCheck:
         if type(symbolToCheck.declarationPrefix) not in [str, unicode]:
             raise Exception("cannot check type dependencies against %s, declaration has not been loaded at this point" %(symbolToCheck.declarationPrefix))
-        if symbol.typeDependencyPattern.match(symbolToCheck.declarationPrefix):
+        if symbol.patterns.isTypeDependency(symbolToCheck.declarationPrefix, symbol.name):
             symbolsMatched.append(symbolToCheck)
     return symbolsMatched
 
+#results of parseSpecification by line for the file currently being processed - see machinery.intermediate
+currSpecificationTuplesByLine = None
+
 def parseSpecification(line):
+    if currSpecificationTuplesByLine == None:
+        return parseSpecificationUncached(line)
+    specTupleOrError = currSpecificationTuplesByLine.get(line)
+    if specTupleOrError == None:
+        try:
+            specTupleOrError = parseSpecificationUncached(line)
+        except Exception as e:
+            specTupleOrError = e
+        currSpecificationTuplesByLine[line] = specTupleOrError
+    if isinstance(specTupleOrError, Exception):
+        raise specTupleOrError
+    return specTupleOrError
+
+def parseSpecificationUncached(line):
     def parseDataObjectsAndRemainder(specRightHandSide):
         dataObjects, remainder = splitIntoComponentsAndRemainder(specRightHandSide)
         if len(dataObjects) == 0:
@@ -122,7 +138,120 @@ def getSymbolAccessStringAndRemainder(
     )
     return symbolAccessString, remainder
 
+identifierPattern = re.compile(r'\w+')
+
+class UnlocatedRemainderError(Exception):
+    pass
+
+def implementIdentifiers(text, line, symbolIndexAndSymbolByName, minSymbolIndex, maxSymbolIndex, implementedSymbolIndexes, symbolImplementationFunction, implementationArguments):
+    #rewrites the accesses in text to the symbols with an index in [minSymbolIndex, maxSymbolIndex), returns the rewritten text and whether anything has been rewritten
+    lineSections = []
+    sectionStart = 0
+    workStartBySymbolIndex = {}
+    strippedTextLength = len(text.rstrip())
+    quoteMask = None
+    searchStart = 0
+    while True:
+        identifierMatch = identifierPattern.search(text, searchStart)
+        if not identifierMatch:
+            break
+        searchStart = identifierMatch.end()
+        symbolIndexAndSymbol = symbolIndexAndSymbolByName.get(identifierMatch.group(0))
+        if symbolIndexAndSymbol == None:
+            continue
+        symbolIndex, symbol = symbolIndexAndSymbol
+        if symbolIndex < minSymbolIndex or symbolIndex >= maxSymbolIndex:
+            continue
+        #like splitTextAtLeftMostOccurrence, quotes are determined on the part of the text following the previous access to this symbol
+        workStart = workStartBySymbolIndex.get(symbolIndex, 0)
+        if quoteMask == None:
+            quoteMask = QuoteMask(text)
+        if quoteMask.isIndexWithinQuotes(identifierMatch.start(), workStart):
+            continue
+        #the first access to a symbol sees the whole line, the following ones what comes after the previous access
+        work = line
+        if symbolIndex in workStartBySymbolIndex:
+            work = text[workStart:strippedTextLength]
+        elif symbolIndex in implementedSymbolIndexes:
+            work = text
+        suffix = text[identifierMatch.end():]
+        symbolAccessString, remainder = symbolImplementationFunction(work, suffix, symbol, *implementationArguments)
+        #the remainder may have been stripped - find where it starts
+        accessEnd = len(text) - len(remainder)
+        if text[accessEnd:] != remainder:
+            accessEnd = strippedTextLength - len(remainder)
+        if accessEnd < identifierMatch.end() or text[accessEnd:accessEnd + len(remainder)] != remainder:
+            raise UnlocatedRemainderError()
+        #symbols coming before this one have already been rewritten within its accessors when it is being rewritten
+        accessors, accessorsImplemented = implementIdentifiers(
+            text[identifierMatch.end():accessEnd],
+            line,
+            symbolIndexAndSymbolByName,
+            minSymbolIndex,
+            symbolIndex,
+            implementedSymbolIndexes,
+            symbolImplementationFunction,
+            implementationArguments
+        )
+        if accessorsImplemented:
+            symbolAccessString, implementedRemainder = symbolImplementationFunction(work, accessors + text[accessEnd:], symbol, *implementationArguments)
+            if implementedRemainder != remainder:
+                raise UnlocatedRemainderError()
+        #symbols coming after this one on the other hand are rewritten within its access string
+        symbolAccessString, _ = implementIdentifiers(
+            symbolAccessString,
+            line,
+            symbolIndexAndSymbolByName,
+            symbolIndex + 1,
+            maxSymbolIndex,
+            implementedSymbolIndexes,
+            symbolImplementationFunction,
+            implementationArguments
+        )
+        lineSections.append(text[sectionStart:identifierMatch.start()])
+        lineSections.append(symbolAccessString)
+        sectionStart = accessEnd
+        searchStart = accessEnd
+        workStartBySymbolIndex[symbolIndex] = accessEnd
+        implementedSymbolIndexes.add(symbolIndex)
+    if len(lineSections) == 0:
+        return text, False
+    #whatever is left now is the unmatched trailer of the text
+    lineSections.append(text[sectionStart:])
+    return "".join(lineSections), True
+
 def implement(line, symbols, symbolImplementationFunction, iterators=[], parallelRegionTemplate=None, callee=None):
+    '''Rewrites all accesses to the given symbols on a line in one left to right pass over its identifiers.
+    The result is the same as rewriting one symbol after the other (see implementSymbolBySymbol), where every symbol
+    sees what the symbols before it have rewritten: Accessors are rewritten with the symbols before the accessed one,
+    access strings with the symbols after it. In case of symbols sharing a name, or accessors that can't be located on the line,
+    we fall back to rewriting symbol by symbol.'''
+    if len(symbols) == 0:
+        return line
+    symbolIndexAndSymbolByName = {}
+    for symbolIndex, symbol in enumerate(symbols):
+        symbolIndexAndSymbolByName.setdefault(symbol.name, (symbolIndex, symbol))
+    if len(symbolIndexAndSymbolByName) != len(symbols):
+        return implementSymbolBySymbol(line, symbols, symbolImplementationFunction, iterators, parallelRegionTemplate, callee)
+    try:
+        adjustedLine, isImplemented = implementIdentifiers(
+            line,
+            line,
+            symbolIndexAndSymbolByName,
+            0,
+            len(symbols),
+            set(),
+            symbolImplementationFunction,
+            (iterators, parallelRegionTemplate, callee)
+        )
+    except UnlocatedRemainderError:
+        #accessors that can't be located on the line
+        return implementSymbolBySymbol(line, symbols, symbolImplementationFunction, iterators, parallelRegionTemplate, callee)
+    if not isImplemented:
+        return line
+    return adjustedLine.strip()
+
+def implementSymbolBySymbol(line, symbols, symbolImplementationFunction, iterators=[], parallelRegionTemplate=None, callee=None):
     adjustedLine = line
     for symbol in symbols:
         lineSections = []
@@ -170,8 +299,7 @@ class FortranRoutineArgumentParser:
         argumentMatch = patterns.argumentPattern.match(string)
         if not argumentMatch:
             return
-        currBracketAnalyzer = BracketAnalyzer()
-        arguments, _ = currBracketAnalyzer.getListOfArgumentsInOpenedBracketsAndRemainder(argumentMatch.group(1))
+        arguments, _ = getArgumentsInOpenedBracketsAndRemainder(argumentMatch.group(1))
         self.arguments = arguments
 
 class FortranCodeSanitizer:
@@ -185,6 +313,80 @@ class FortranCodeSanitizer:
         self.currNumOfTabs = 0
         self.emptyLinesInARow = 0
 
+    def breakUpCodeLine(self, codeLine, sanitizedCodeLines, howManyCharsPerLine, commentChar, lineSep):
+        '''Appends the broken up parts of codeLine to sanitizedCodeLines, except for the remainder that could not be broken up further.
+        Returns the last line appended together with that remainder.
+        The line is processed in one pass: The remainder is always a continuation prefix followed by a suffix of codeLine,
+        so we only keep track of where that suffix starts, and the quote mask is computed once for the whole line.'''
+        quoteMask = QuoteMask(codeLine)
+        isOpenMPDirectiveLine = self.openMPLinePattern.match(codeLine) != None
+        isOpenACCDirectiveLine = self.openACCLinePattern.match(codeLine) != None
+        maxLineLength = howManyCharsPerLine - len(lineSep)
+        suffixStart = 0
+        prevLineContinuation = ""
+        previousLineLength = len(codeLine)
+        blankPos = -1
+        currLine = None
+        isRemainderEmpty = False
+        while len(prevLineContinuation) + len(codeLine) - suffixStart > maxLineLength:
+            if not isOpenMPDirectiveLine and not isOpenACCDirectiveLine:
+                #only the beginning of the remainder can decide whether the comment is near enough
+                commentPos = (prevLineContinuation + codeLine[suffixStart:suffixStart + howManyCharsPerLine + len(commentChar)]).find(commentChar)
+                if commentPos >= 0 and commentPos <= howManyCharsPerLine:
+                    break
+            #find a blank that's NOT within a quoted string
+            startOffset = 0
+            while len(codeLine) - suffixStart + len(prevLineContinuation) > maxLineLength + startOffset:
+                blankPos = self.findRightMostBlankNotInsideQuotes(codeLine, quoteMask, suffixStart, maxLineLength + startOffset)
+                startOffset += 5 #if nothing is possible to break up it's better to go a little bit over the limit, often the compiler will still cope
+                if blankPos >= 1:
+                    break
+            if blankPos < 1:
+                currLine = prevLineContinuation + codeLine[suffixStart:]
+                isRemainderEmpty = True
+            else:
+                currLine = prevLineContinuation + codeLine[suffixStart:suffixStart + blankPos] + lineSep
+                if isOpenMPDirectiveLine:
+                    prevLineContinuation = '!$OMP& '
+                elif isOpenACCDirectiveLine:
+                    prevLineContinuation = '!$acc& '
+                else:
+                    prevLineContinuation = '& '
+                suffixStart += blankPos
+            sanitizedCodeLines.append(currLine)
+            remainderLength = 0 if isRemainderEmpty else len(prevLineContinuation) + len(codeLine) - suffixStart
+            if blankPos < 1 or remainderLength >= previousLineLength:
+                #blank not found or at beginning of line
+                #-> bail out in order to avoid infinite loop - just keep the line as it was.
+                logging.warning(
+                    "The following line could not be broken up for Fortran compatibility - no suitable spaces found: %s (remainder: %s)\n" %(
+                        currLine,
+                        "" if isRemainderEmpty else prevLineContinuation + codeLine[suffixStart:]
+                    ),
+                    extra={"hfLineNo":currLineNo, "hfFile":currFile}
+                )
+                break
+            previousLineLength = remainderLength
+        if isRemainderEmpty:
+            return currLine, ""
+        return currLine, prevLineContinuation + codeLine[suffixStart:]
+
+    def findRightMostBlankNotInsideQuotes(self, codeLine, quoteMask, suffixStart, rightStartAt):
+        #same as findRightMostOccurrenceNotInsideQuotes(' ', codeLine[suffixStart:], rightStartAt), without copying the suffix
+        nextRightStart = rightStartAt
+        blankPos = -1
+        for numOfTrys in range(1,101):
+            blankPos = codeLine.rfind(' ', suffixStart, suffixStart + nextRightStart) - suffixStart
+            if blankPos < 0:
+                return -1
+            if blankPos == 0 or not quoteMask.isIndexWithinQuotes(suffixStart + blankPos, suffixStart):
+                break
+            nextRightStart = blankPos
+            blankPos = -1
+            if numOfTrys >= 100:
+                raise Exception("Could not find the string even after 100 tries.")
+        return blankPos
+
     def sanitizeLines(self, line, toBeCommented=False, howManyCharsPerLine=132, commentChar="!"):
         strippedRawLine = line.strip()
         if strippedRawLine == "" and self.emptyLinesInARow > 1:
@@ -194,7 +396,16 @@ class FortranCodeSanitizer:
             return "\n"
 
         self.emptyLinesInARow = 0
-        codeLines = strippedRawLine.split("\n")
+        return "\n".join(self.sanitizeCodeLines(
+            strippedRawLine.split("\n"),
+            toBeCommented=toBeCommented,
+            howManyCharsPerLine=howManyCharsPerLine,
+            commentChar=commentChar
+        )) + "\n"
+
+    def sanitizeCodeLines(self, codeLines, toBeCommented=False, howManyCharsPerLine=132, commentChar="!"):
+        '''Breaks up and re-indents a list of code lines, continuing with the indentation state of the previous calls.
+        Returns the list of sanitized lines.'''
         sanitizedCodeLines = []
         lineSep = " &"
 
@@ -203,59 +414,7 @@ class FortranCodeSanitizer:
             if len(codeLine) <= howManyCharsPerLine:
                 sanitizedCodeLines.append(codeLine)
                 continue
-            remainder = codeLine
-            previousLineLength = len(remainder)
-            blankPos = -1
-            remainderContainsLineContinuation = False
-            while len(remainder) > howManyCharsPerLine - len(lineSep):
-                isOpenMPDirectiveLine = self.openMPLinePattern.match(remainder) != None
-                isOpenACCDirectiveLine = self.openACCLinePattern.match(remainder) != None
-                if commentChar in remainder and not isOpenMPDirectiveLine and not isOpenACCDirectiveLine:
-                    commentPos = remainder.find(commentChar)
-                    if commentPos <= howManyCharsPerLine:
-                        break
-                #find a blank that's NOT within a quoted string
-                searchString = remainder
-                prevLineContinuation = ""
-                if remainderContainsLineContinuation and (isOpenMPDirectiveLine or isOpenACCDirectiveLine):
-                    searchString = remainder[7:]
-                    prevLineContinuation = remainder[:7]
-                elif remainderContainsLineContinuation:
-                    searchString = remainder[2:]
-                    prevLineContinuation = remainder[:2]
-                startOffset = 0
-                while len(searchString) + len(prevLineContinuation) > howManyCharsPerLine - len(lineSep) + startOffset:
-                    blankPos = findRightMostOccurrenceNotInsideQuotes(' ', searchString, rightStartAt=howManyCharsPerLine - len(lineSep) + startOffset)
-                    startOffset += 5 #if nothing is possible to break up it's better to go a little bit over the limit, often the compiler will still cope
-                    if blankPos >= 1:
-                        break
-                if blankPos < 1:
-                    currLine = remainder
-                    remainder = ""
-                else:
-                    currLine = prevLineContinuation + searchString[:blankPos] + lineSep
-                    if blankPos >= 1 and isOpenMPDirectiveLine:
-                        remainder = '!$OMP& ' + searchString[blankPos:]
-                        remainderContainsLineContinuation = True
-                    elif blankPos >= 1 and isOpenACCDirectiveLine:
-                        remainder = '!$acc& ' + searchString[blankPos:]
-                        remainderContainsLineContinuation = True
-                    elif blankPos >= 1:
-                        remainder = '& ' + searchString[blankPos:]
-                        remainderContainsLineContinuation = True
-                sanitizedCodeLines.append(currLine)
-                if blankPos < 1 or len(remainder) >= previousLineLength:
-                    #blank not found or at beginning of line
-                    #-> bail out in order to avoid infinite loop - just keep the line as it was.
-                    logging.warning(
-                        "The following line could not be broken up for Fortran compatibility - no suitable spaces found: %s (remainder: %s)\n" %(
-                            currLine,
-                            remainder
-                        ),
-                        extra={"hfLineNo":currLineNo, "hfFile":currFile}
-                    )
-                    break
-                previousLineLength = len(remainder)
+            currLine, remainder = self.breakUpCodeLine(codeLine, sanitizedCodeLines, howManyCharsPerLine, commentChar, lineSep)
             if toBeCommented:
                 currLine = commentChar + " " + currLine
             if remainder != "":
@@ -267,8 +426,6 @@ class FortranCodeSanitizer:
         tabbedCodeLines = []
         for codeLine in sanitizedCodeLines:
             strippedLine = codeLine.strip()
-            if strippedRawLine == "" and self.emptyLinesInARow > 1:
-                continue
             if strippedLine == "":
                 self.emptyLinesInARow += 1
                 tabbedCodeLines.append("")
@@ -288,5 +445,75 @@ class FortranCodeSanitizer:
                 self.currNumOfTabs = min(5, self.currNumOfTabs + 1)
             else:
                 tabbedCodeLines.append(self.currNumOfTabs * "\t" + strippedLine)
+        return tabbedCodeLines
+
+class SanitizedOutputWriter(object):
+    '''Buffered writer that sanitizes code as it is written and passes it on to an output stream.
+    The result is the same as writing codeSanitizer.sanitizeLines(text) for the concatenation of all written text,
+    but only the current line and the output since the last flush are kept in memory.
+    Whitespace is held back until the next non-whitespace text is written, such that leading and trailing whitespace
+    of the whole text - as well as of elements enclosed in beginStrippedElement / endStrippedElement - can be dropped.'''
+
+    def __init__(self, outputStream, codeSanitizer, bufferSize=65536):
+        self.outputStream = outputStream
+        self.codeSanitizer = codeSanitizer
+        self.bufferSize = bufferSize
+        self._buffer = []
+        self._bufferedLength = 0
+        self._currLine = ""
+        self._pendingWhitespace = ""
+        self._isSkippingWhitespace = True
+        self._hasContent = False
+        self._elementHasContent = False
 
-        return "\n".join(tabbedCodeLines) + "\n"
\ No newline at end of file
+    def _bufferLines(self, codeLines):
+        sanitizedText = "\n".join(self.codeSanitizer.sanitizeCodeLines(codeLines)) + "\n"
+        self._buffer.append(sanitizedText)
+        self._bufferedLength += len(sanitizedText)
+        if self._bufferedLength >= self.bufferSize:
+            self.flush()
+
+    def write(self, text):
+        if self._isSkippingWhitespace:
+            text = text.lstrip()
+            if text == "":
+                return
+            self._isSkippingWhitespace = False
+        content = text.rstrip()
+        if content == "":
+            self._pendingWhitespace += text
+            return
+        if not self._hasContent:
+            self.codeSanitizer.emptyLinesInARow = 0
+        self._hasContent = True
+        self._elementHasContent = True
+        codeLines = (self._currLine + self._pendingWhitespace + content).split("\n")
+        self._pendingWhitespace = text[len(content):]
+        self._currLine = codeLines.pop()
+        if len(codeLines) > 0:
+            self._bufferLines(codeLines)
+
+    def beginStrippedElement(self):
+        self._isSkippingWhitespace = True
+        self._elementHasContent = False
+
+    def endStrippedElement(self):
+        '''returns whether the element had any content'''
+        self._isSkippingWhitespace = False
+        if self._elementHasContent:
+            self._pendingWhitespace = ""
+        return self._elementHasContent
+
+    def flush(self):
+        self.outputStream.write("".join(self._buffer))
+        self._buffer = []
+        self._bufferedLength = 0
+
+    def close(self):
+        if self._hasContent:
+            self._bufferLines([self._currLine])
+        else:
+            self._buffer.append(self.codeSanitizer.sanitizeLines(""))
+        self._currLine = ""
+        self._pendingWhitespace = ""
+        self.flush()
@@ -26,8 +26,8 @@ from models.region import RegionType, RoutineSpecificationRegion
 from tools.metadata import *
 from tools.commons import UsageError, BracketAnalyzer, stacktrace
 from tools.analysis import SymbolDependencyAnalyzer, getAnalysisForSymbol, getArguments
-from machinery.parser import H90CallGraphAndSymbolDeclarationsParser, getSymbolsByName, currFile, currLineNo
-from machinery.commons import FortranCodeSanitizer, ConversionOptions, parseSpecification
+from machinery.parser import H90CallGraphAndSymbolDeclarationsParser, getSymbolsByName, getSymbolForEntry, currFile, currLineNo
+from machinery.commons import FortranCodeSanitizer, SanitizedOutputWriter, ConversionOptions, parseSpecification
 
 def getSymbolsByModuleNameAndSymbolName(cgDoc, moduleNodesByName, symbolAnalysisByRoutineNameAndSymbolName={}):
     symbolsByModuleNameAndSymbolName = {}
@@ -46,6 +46,122 @@ def getSymbolsByModuleNameAndSymbolName(cgDoc, moduleNodesByName, symbolAnalysis
             symbol.sourceModule = moduleName
     return symbolsByModuleNameAndSymbolName
 
+class LazyModuleSymbolsByName(object):
+    '''The symbols of one module by unique identifier. The domain dependant entries are indexed upfront,
+    but a symbol is only created once it is looked up - routines typically import only a few symbols of a module.'''
+
+    def __init__(self, cgDoc, moduleName, moduleNode, symbolAnalysisByRoutineNameAndSymbolName={}):
+        self.moduleName = moduleName
+        self.moduleNode = moduleNode
+        self.symbolAnalysisByRoutineNameAndSymbolName = symbolAnalysisByRoutineNameAndSymbolName
+        self.symbolsByName = {}
+        self.templatesAndEntriesByName = {}
+        parentName = moduleNode.getAttribute('name')
+        if parentName in [None, '']:
+            raise Exception("parent node without identifier")
+        for template, entry in getDomainDependantTemplatesAndEntries(cgDoc, moduleNode):
+            #like in getSymbolsByName, the last entry for a symbol name wins
+            self.templatesAndEntriesByName[uniqueIdentifier(entry.firstChild.nodeValue, parentName)] = (template, entry)
+
+    def get(self, symbolName, default=None):
+        symbol = self.symbolsByName.get(symbolName)
+        if symbol != None:
+            return symbol
+        templateAndEntry = self.templatesAndEntriesByName.get(symbolName)
+        if templateAndEntry == None:
+            return default
+        template, entry = templateAndEntry
+        symbol = getSymbolForEntry(
+            template,
+            entry,
+            self.moduleNode,
+            symbolAnalysisByRoutineNameAndSymbolName=self.symbolAnalysisByRoutineNameAndSymbolName
+        )
+        symbol.sourceModule = self.moduleName
+        self.symbolsByName[symbolName] = symbol
+        return symbol
+
+    def __getitem__(self, symbolName):
+        symbol = self.get(symbolName)
+        if symbol == None:
+            raise KeyError(symbolName)
+        return symbol
+
+    def __contains__(self, symbolName):
+        return symbolName in self.templatesAndEntriesByName
+
+    def __len__(self):
+        return len(self.templatesAndEntriesByName)
+
+    def __iter__(self):
+        return iter(self.templatesAndEntriesByName)
+
+    def keys(self):
+        return self.templatesAndEntriesByName.keys()
+
+    def values(self):
+        return [self.get(symbolName) for symbolName in self.templatesAndEntriesByName]
+
+    def items(self):
+        return [(symbolName, self.get(symbolName)) for symbolName in self.templatesAndEntriesByName]
+
+    @property
+    def numOfMaterializedSymbols(self):
+        return len(self.symbolsByName)
+
+class LazyModuleSymbolTable(object):
+    '''Drop-in for the result of getSymbolsByModuleNameAndSymbolName that only creates the module symbols that are looked up.
+    Symbols are loaded from the callgraph at the time of their first lookup, so the callgraph must not change anymore
+    after this table has been created.'''
+
+    def __init__(self, cgDoc, moduleNodesByName, symbolAnalysisByRoutineNameAndSymbolName={}):
+        self.symbolsByNameByModuleName = {}
+        for moduleName in moduleNodesByName.keys():
+            moduleNode = moduleNodesByName.get(moduleName)
+            if not moduleNode:
+                continue
+            self.symbolsByNameByModuleName[moduleName] = LazyModuleSymbolsByName(
+                cgDoc,
+                moduleName,
+                moduleNode,
+                symbolAnalysisByRoutineNameAndSymbolName
+            )
+
+    def get(self, moduleName, default=None):
+        return self.symbolsByNameByModuleName.get(moduleName, default)
+
+    def __getitem__(self, moduleName):
+        return self.symbolsByNameByModuleName[moduleName]
+
+    def __contains__(self, moduleName):
+        return moduleName in self.symbolsByNameByModuleName
+
+    def __len__(self):
+        return len(self.symbolsByNameByModuleName)
+
+    def __iter__(self):
+        return iter(self.symbolsByNameByModuleName)
+
+    def keys(self):
+        return self.symbolsByNameByModuleName.keys()
+
+    def values(self):
+        return self.symbolsByNameByModuleName.values()
+
+    def items(self):
+        return self.symbolsByNameByModuleName.items()
+
+    @property
+    def numOfSymbols(self):
+        return sum(len(symbolsByName) for symbolsByName in self.symbolsByNameByModuleName.values())
+
+    @property
+    def numOfMaterializedSymbols(self):
+        return sum(symbolsByName.numOfMaterializedSymbols for symbolsByName in self.symbolsByNameByModuleName.values())
+
+    def logStatistics(self):
+        logging.debug("Module symbols: %i of %i materialized" %(self.numOfMaterializedSymbols, self.numOfSymbols))
+
 def getSymbolsByRoutineNameAndSymbolName(cgDoc, routineNodesByProcName, parallelRegionTemplatesByProcName, symbolAnalysisByRoutineNameAndSymbolName={}):
     symbolsByRoutineNameAndSymbolName = {}
     for procName in routineNodesByProcName:
@@ -95,6 +211,19 @@ class H90toF90Converter(H90CallGraphAndSymbolDeclarationsParser):
         self.currParallelRegionTemplateNode = None
         self.prepareLineCalledForCurrentLine = False
         self.preparedBy = None
+        #the conversion handles the matches of these states in its own order, see the corresponding methods
+        self.declarationsConversionClassifier = self.patterns.getLineClassifier([
+            'dataStatementPattern', 'branchPattern', 'subprocCallPattern', 'subprocEndPattern', 'parallelRegionPattern',
+            'subprocBeginPattern', 'templatePattern', 'templateEndPattern', 'domainDependantPattern'
+        ])
+        self.subroutineBodyConversionClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'branchEndPattern', 'subprocCallPattern', 'subprocEndPattern', 'earlyReturnPattern',
+            'parallelRegionPattern', 'parallelRegionEndPattern', 'domainDependantPattern', 'subprocBeginPattern'
+        ])
+        self.parallelRegionConversionClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'subprocCallPattern', 'parallelRegionEndPattern', 'parallelRegionPattern', 'subprocEndPattern',
+            'subprocBeginPattern', 'whileLoopPattern', 'loopPattern'
+        ])
         try:
             if symbolAnalysisByRoutineNameAndSymbolName != None:
                 self.symbolAnalysisByRoutineNameAndSymbolName = symbolAnalysisByRoutineNameAndSymbolName
@@ -104,7 +233,7 @@ class H90toF90Converter(H90CallGraphAndSymbolDeclarationsParser):
             if symbolsByModuleNameAndSymbolName != None:
                 self.symbolsByModuleNameAndSymbolName = symbolsByModuleNameAndSymbolName
             else:
-                self.symbolsByModuleNameAndSymbolName = getSymbolsByModuleNameAndSymbolName(self.cgDoc, self.moduleNodesByName, self.symbolAnalysisByRoutineNameAndSymbolName)
+                self.symbolsByModuleNameAndSymbolName = LazyModuleSymbolTable(self.cgDoc, self.moduleNodesByName, self.symbolAnalysisByRoutineNameAndSymbolName)
 
             if symbolsByRoutineNameAndSymbolName != None:
                 self.symbolsByRoutineNameAndSymbolName = symbolsByRoutineNameAndSymbolName
@@ -248,7 +377,9 @@ This is not allowed for implementations using %s.\
 
     def processModuleEndMatch(self, moduleEndMatch):
         self.prepareLine(moduleEndMatch.group(0), self.tab_outsideSub)
-        self.outputStream.write(self.codeSanitizer.sanitizeLines(self.currModule.implemented() + "\n\n"))
+        writer = SanitizedOutputWriter(self.outputStream, self.codeSanitizer)
+        self.currModule.writeImplementation(writer)
+        writer.close()
         self.currModule = None
         self.implementation.processModuleEnd()
         super(H90toF90Converter, self).processModuleEndMatch(moduleEndMatch)
@@ -343,6 +474,9 @@ This is not allowed for implementations using %s.\
 
     def processNoMatch(self, line):
         super(H90toF90Converter, self).processNoMatch(line)
+        if self.state == 'inside_module' or (self.state == 'inside_branch' and self.stateBeforeBranch == 'inside_module'):
+            #module declarations are prepared once their symbols have been analysed, see processInsideModuleState
+            return
         self.prepareLine(line, "")
 
     def processInsideModuleState(self, line):
@@ -355,63 +489,49 @@ This is not allowed for implementations using %s.\
 
     def processInsideDeclarationsState(self, line):
         '''process everything that happens per h90 declaration line'''
-        subProcCallMatch = self.patterns.subprocCallPattern.match(line)
-        parallelRegionMatch = self.patterns.parallelRegionPattern.match(line)
-        domainDependantMatch = self.patterns.domainDependantPattern.match(line)
-        subProcEndMatch = self.patterns.subprocEndPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-        dataStatementMatch = self.patterns.dataStatementPattern.match(line)
-
-        if dataStatementMatch:
-            self.processDataStatementMatch(dataStatementMatch)
+        patternName, match = self.declarationsConversionClassifier.classify(line)
+        if patternName == 'dataStatementPattern':
+            self.processDataStatementMatch(match)
             return
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
             return
-        if subProcCallMatch:
+        if patternName == 'subprocCallPattern':
             self.switchToNewRegion("CallRegion")
-            self.processCallMatch(subProcCallMatch)
+            self.processCallMatch(match)
             self.switchToNewRegion()
             return
-        if subProcEndMatch:
-            self.processProcEndMatch(subProcEndMatch)
+        if patternName == 'subprocEndPattern':
+            self.processProcEndMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_module_body'
             else:
                 self.state = 'inside_module_body'
             return
-        if parallelRegionMatch:
+        if patternName == 'parallelRegionPattern':
             raise UsageError("parallel region without parallel dependants")
-        if self.patterns.subprocBeginPattern.match(line):
+        if patternName == 'subprocBeginPattern':
             raise UsageError("subprocedure within subprocedure not allowed")
-        if templateMatch:
+        if patternName == 'templatePattern':
             raise UsageError("template directives are only allowed outside of subroutines")
-        if templateEndMatch:
+        if patternName == 'templateEndPattern':
             raise UsageError("template directives are only allowed outside of subroutines")
 
-        if domainDependantMatch:
+        if patternName == 'domainDependantPattern':
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_domainDependantRegion'
             else:
                 self.state = 'inside_domainDependantRegion'
             self.switchToNewRegion()
-            self.processDomainDependantMatch(domainDependantMatch)
+            self.processDomainDependantMatch(match)
             return
 
-        importMatch1 = self.patterns.importPattern.match(line)
-        importMatch2 = self.patterns.singleMappedImportPattern.match(line)
-        importMatch3 = self.patterns.importAllPattern.match(line)
+        declarationPatternName, _ = self.declarationClassifier.classify(line)
         specTuple = parseSpecification(line)
-        specificationStatementMatch = self.patterns.specificationStatementPattern.match(line)
         if not ( \
             line.strip() == "" \
-            or importMatch1 \
-            or importMatch2 \
-            or importMatch3 \
+            or declarationPatternName \
             or specTuple[0] \
-            or specificationStatementMatch \
         ):
             if self.state == "inside_branch":
                 self.stateBeforeBranch = "inside_subroutine_body"
@@ -428,32 +548,30 @@ This is not allowed for implementations using %s.\
 
     def processInsideSubroutineBodyState(self, line):
         '''process everything that happens per h90 subroutine body line'''
-        branchMatch = self.patterns.branchPattern.match(line)
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
+        patternName, match = self.subroutineBodyConversionClassifier.classify(line)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
             return
 
-        if self.patterns.branchEndPattern.match(line):
+        if patternName == 'branchEndPattern':
             self.prepareLine("","")
             return
 
-        subProcCallMatch = self.patterns.subprocCallPattern.match(line)
-        if subProcCallMatch:
+        if patternName == 'subprocCallPattern':
             self.switchToNewRegion("CallRegion")
-            self.processCallMatch(subProcCallMatch)
+            self.processCallMatch(match)
             self.switchToNewRegion()
             return
 
-        subProcEndMatch = self.patterns.subprocEndPattern.match(line)
-        if subProcEndMatch:
-            self.processProcEndMatch(subProcEndMatch)
+        if patternName == 'subprocEndPattern':
+            self.processProcEndMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = "inside_module_body"
             else:
                 self.state = 'inside_module_body'
             return
 
-        if self.patterns.earlyReturnPattern.match(line):
+        if patternName == 'earlyReturnPattern':
             self.processProcExitPoint(line, isSubroutineEnd=False)
             return
 
@@ -461,8 +579,7 @@ This is not allowed for implementations using %s.\
             self.prepareLine("! " + line, "")
             return
 
-        parallelRegionMatch = self.patterns.parallelRegionPattern.match(line)
-        if (parallelRegionMatch) \
+        if patternName == 'parallelRegionPattern' \
         and self.currRoutine.node.getAttribute('parallelRegionPosition') == "within":
             templateRelations = self.parallelRegionTemplateRelationsByProcName.get(self.currRoutine.name)
             if templateRelations == None or len(templateRelations) == 0:
@@ -501,7 +618,7 @@ This is not allowed for implementations using %s.\
                 raise Exception("No parallel region template has matched the active template ID.")
             self.currParallelIterators = self.implementation.getIterators(self.currParallelRegionTemplateNode)
             if len(self.currParallelIterators) > 0:
-                self.processParallelRegionMatch(parallelRegionMatch)
+                self.processParallelRegionMatch(match)
                 if self.state == "inside_branch":
                     self.stateBeforeBranch = "inside_parallelRegion"
                 else:
@@ -509,55 +626,52 @@ This is not allowed for implementations using %s.\
             else:
                 self.prepareLine("","")
             return
-        elif parallelRegionMatch:
+        elif patternName == 'parallelRegionPattern':
             #this parallel region does not apply to us
             self.prepareLine("","")
             return
 
-        if (self.patterns.parallelRegionEndPattern.match(line)):
+        if patternName == 'parallelRegionEndPattern':
             #note: this may occur when a parallel region is discarded because it doesn't apply
             #-> state stays within body and the region end line will trap here
             self.prepareLine("","")
             return
 
-        domainDependantMatch = self.patterns.domainDependantPattern.match(line)
-        if (domainDependantMatch):
+        if patternName == 'domainDependantPattern':
             if self.state == "inside_branch":
                 self.stateBeforeBranch = "inside_domainDependantRegion"
             else:
                 self.state = 'inside_domainDependantRegion'
-            self.processDomainDependantMatch(domainDependantMatch)
+            self.processDomainDependantMatch(match)
             return
 
-        if (self.patterns.subprocBeginPattern.match(line)):
+        if patternName == 'subprocBeginPattern':
             raise Exception("subprocedure within subprocedure not allowed")
 
         self.analyseSymbolInformationOnCurrentLine(line, isInSubroutineBody=True)
         self.prepareLine(line, self.tab_insideSub)
 
     def processInsideParallelRegionState(self, line):
-        branchMatch = self.patterns.branchPattern.match(line)
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
+        patternName, match = self.parallelRegionConversionClassifier.classify(line)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
             return
 
-        subProcCallMatch = self.patterns.subprocCallPattern.match(line)
-        if subProcCallMatch:
-            if subProcCallMatch.group(1) not in self.routineNodesByProcName.keys():
+        if patternName == 'subprocCallPattern':
+            if match.group(1) not in self.routineNodesByProcName.keys():
                 message = self.implementation.warningOnUnrecognizedSubroutineCallInParallelRegion(
                     self.currRoutine.name,
-                    subProcCallMatch.group(1)
+                    match.group(1)
                 )
                 if message != "":
                     logging.warning(message, extra={"hfLineNo":currLineNo, "hfFile":currFile})
             self.switchToNewRegion("CallRegion")
-            self.processCallMatch(subProcCallMatch)
+            self.processCallMatch(match)
             self.switchToNewRegion()
             return
 
-        parallelRegionEndMatch = self.patterns.parallelRegionEndPattern.match(line)
-        if (parallelRegionEndMatch):
-            self.processParallelRegionEndMatch(parallelRegionEndMatch)
+        if patternName == 'parallelRegionEndPattern':
+            self.processParallelRegionEndMatch(match)
             self.state = "inside_subroutine_body"
             if self.state == "inside_branch":
                 self.stateBeforeBranch = "inside_subroutine_body"
@@ -565,17 +679,16 @@ This is not allowed for implementations using %s.\
                 self.state = 'inside_subroutine_body'
             return
 
-        if (self.patterns.parallelRegionPattern.match(line)):
+        if patternName == 'parallelRegionPattern':
             raise Exception("parallelRegion within parallelRegion not allowed")
-        if (self.patterns.subprocEndPattern.match(line)):
+        if patternName == 'subprocEndPattern':
             raise Exception("subprocedure end before @end parallelRegion")
-        if (self.patterns.subprocBeginPattern.match(line)):
+        if patternName == 'subprocBeginPattern':
             raise Exception("subprocedure within subprocedure not allowed")
 
         adjustedLine = ""
-        whileLoopMatch = self.patterns.whileLoopPattern.match(line)
-        loopMatch = self.patterns.loopPattern.match(line)
-        if whileLoopMatch == None and loopMatch != None:
+        #a while loop also matches the loop pattern - the classifier reports it first
+        if patternName == 'loopPattern':
             adjustedLine += self.implementation.loopPreparation().strip() + '\n'
         adjustedLine += line
         self.analyseSymbolInformationOnCurrentLine(line, isInSubroutineBody=True)
@@ -612,9 +725,9 @@ This is not allowed for implementations using %s.\
                 )
             )
 
-    def processFile(self, fileName):
+    def processFile(self, fileName, intermediate=None):
         self.outputStream.write(self.implementation.filePreparation(fileName))
-        super(H90toF90Converter, self).processFile(fileName)
+        super(H90toF90Converter, self).processFile(fileName, intermediate)
 
     def putLine(self, line):
         if line == "":
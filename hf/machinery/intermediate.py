@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+import os, hashlib, marshal, tempfile, logging
+import machinery.commons
+from tools.patterns import RegExPatterns, getStaticPatternsFingerprint
+
+lineClassificationHeader = "HFLC1"
+
+def getLineClassificationPath(fileName):
+    return fileName + ".classification"
+
+class H90FileIntermediate(object):
+    '''The parts of parsing a h90 file that don't depend on the callgraph or on other files: its lines, the declaration
+    specification of each line (computed on first use), as well as its line classification, i.e. the matches of the static
+    patterns on each line. One intermediate can be passed to every parser pass over the same file (callgraph, symbol extraction
+    with and without imports, conversion), such that the file is read once and each line is only parsed once.
+    With a classification path the line classification is also kept on disk, such that the passes of later preprocessor runs
+    skip the pattern matching for an unchanged file.'''
+
+    def __init__(self, fileName, classificationPath=None):
+        self.fileName = fileName
+        with open(fileName, 'r') as sourceFile:
+            self.lines = sourceFile.readlines()
+        self.specificationTuplesByLine = {}
+        self.classificationPath = classificationPath
+        self.classificationFingerprint = None
+        self.matchGroupsByPatternNameAndLine = {}
+        if classificationPath != None:
+            self.classificationFingerprint = hashlib.sha1(getStaticPatternsFingerprint() + "".join(self.lines)).hexdigest()
+            self.matchGroupsByPatternNameAndLine = self.loadClassification()
+        self.numOfPersistedMatches = self.numOfMatches()
+
+    def numOfMatches(self):
+        return sum(len(matchGroupsByLine) for matchGroupsByLine in self.matchGroupsByPatternNameAndLine.itervalues())
+
+    def loadClassification(self):
+        try:
+            with open(self.classificationPath, 'rb') as classificationFile:
+                data = classificationFile.read()
+        except IOError:
+            return {}
+        header = "%s:%s:" %(lineClassificationHeader, self.classificationFingerprint)
+        if not data.startswith(header):
+            logging.debug("line classification %s is outdated" %(self.classificationPath))
+            return {}
+        try:
+            return marshal.loads(data[len(header):])
+        except (EOFError, ValueError, TypeError) as e:
+            logging.warning("Could not read line classification %s: %s" %(self.classificationPath, str(e)))
+            return {}
+
+    def writeClassification(self):
+        #write to a temporary file first - the CPU and GPU preprocessing may run in parallel on the same sources
+        temporaryFile, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.classificationPath)))
+        with os.fdopen(temporaryFile, 'wb') as classificationFile:
+            classificationFile.write("%s:%s:" %(lineClassificationHeader, self.classificationFingerprint))
+            marshal.dump(self.matchGroupsByPatternNameAndLine, classificationFile, 2)
+        os.rename(temporaryPath, self.classificationPath)
+
+    def __enter__(self):
+        #makes machinery.commons.parseSpecification and the static patterns use our results while the file is being processed
+        self.previousSpecificationTuplesByLine = machinery.commons.currSpecificationTuplesByLine
+        machinery.commons.currSpecificationTuplesByLine = self.specificationTuplesByLine
+        RegExPatterns.Instance().setLineClassification(self.matchGroupsByPatternNameAndLine)
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        machinery.commons.currSpecificationTuplesByLine = self.previousSpecificationTuplesByLine
+        del self.previousSpecificationTuplesByLine
+        RegExPatterns.Instance().setLineClassification(None)
+        if exceptionType != None or self.classificationPath == None:
+            return
+        numOfMatches = self.numOfMatches()
+        if numOfMatches == self.numOfPersistedMatches:
+            return
+        try:
+            self.writeClassification()
+        except (IOError, OSError) as e:
+            logging.warning("Could not store line classification %s: %s" %(self.classificationPath, str(e)))
+            return
+        self.numOfPersistedMatches = numOfMatches
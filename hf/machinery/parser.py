@@ -23,6 +23,7 @@ from tools.metadata import *
 from models.symbol import *
 from tools.commons import UsageError, BracketAnalyzer
 from tools.analysis import SymbolDependencyAnalyzer, getAnalysisForSymbol, getArguments
+from tools.callgraph import CallGraph
 from tools.patterns import RegExPatterns
 from machinery.commons import FortranRoutineArgumentParser, FortranCodeSanitizer, parseSpecification, updateTypeParameterProperties
 
@@ -45,9 +46,44 @@ class CallGraphParser(object):
     stateSwitch = None
     currSymbolsByName = None
     stateBeforeBranch = None
+    noneStateClassifier = None
+    moduleStateClassifier = None
+    moduleBodyStateClassifier = None
+    declarationsStateClassifier = None
+    declarationClassifier = None
+    subroutineBodyStateClassifier = None
+    parallelRegionStateClassifier = None
+    domainDependantRegionStateClassifier = None
 
     def __init__(self):
         self.patterns = RegExPatterns.Instance()
+        #one classifier per parser state. The pattern order is the order in which the state handles the matches.
+        self.noneStateClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'templatePattern', 'templateEndPattern', 'moduleBeginPattern', 'subprocBeginPattern'
+        ])
+        self.moduleStateClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'interfacePattern', 'typePattern', 'templatePattern', 'templateEndPattern',
+            'domainDependantPattern', 'moduleEndPattern', 'containsPattern'
+        ])
+        self.moduleBodyStateClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'templatePattern', 'templateEndPattern', 'moduleEndPattern', 'subprocBeginPattern', 'subprocEndPattern'
+        ])
+        self.declarationsStateClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'domainDependantPattern', 'subprocCallPattern', 'subprocEndPattern', 'parallelRegionPattern',
+            'subprocBeginPattern', 'templatePattern', 'templateEndPattern'
+        ])
+        self.declarationClassifier = self.patterns.getLineClassifier([
+            'importPattern', 'singleMappedImportPattern', 'importAllPattern', 'specificationStatementPattern'
+        ])
+        self.subroutineBodyStateClassifier = self.declarationsStateClassifier
+        self.parallelRegionStateClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'subprocCallPattern', 'parallelRegionEndPattern', 'parallelRegionPattern', 'subprocEndPattern',
+            'subprocBeginPattern', 'templatePattern', 'templateEndPattern'
+        ])
+        self.domainDependantRegionStateClassifier = self.patterns.getLineClassifier([
+            'branchPattern', 'domainDependantEndPattern', 'earlyReturnPattern', 'subprocCallPattern', 'parallelRegionEndPattern',
+            'parallelRegionPattern', 'subprocEndPattern', 'subprocBeginPattern', 'templatePattern', 'templateEndPattern'
+        ])
         self.state = "none"
         self.currCalleeName = None
         self.currArguments = None
@@ -161,22 +197,18 @@ class CallGraphParser(object):
         return
 
     def processNoneState(self, line):
-        moduleBeginMatch = self.patterns.moduleBeginPattern.match(line)
-        subProcBeginMatch = self.patterns.subprocBeginPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif templateMatch:
-            self.processTemplateMatch(templateMatch)
-        elif templateEndMatch:
-            self.processTemplateEndMatch(templateEndMatch)
-        elif moduleBeginMatch:
-            self.currModuleName = moduleBeginMatch.group(1)
+        patternName, match = self.noneStateClassifier.classify(line)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'templatePattern':
+            self.processTemplateMatch(match)
+        elif patternName == 'templateEndPattern':
+            self.processTemplateEndMatch(match)
+        elif patternName == 'moduleBeginPattern':
+            self.currModuleName = match.group(1)
             self.state = 'inside_module'
-            self.processModuleBeginMatch(moduleBeginMatch)
-        elif subProcBeginMatch:
+            self.processModuleBeginMatch(match)
+        elif patternName == 'subprocBeginPattern':
             raise UsageError("please put this Hybrid Fortran subroutine into a module")
         else:
             self.processNoMatch(line)
@@ -188,55 +220,46 @@ class CallGraphParser(object):
         return
 
     def processInsideModuleState(self, line):
-        moduleEndMatch = self.patterns.moduleEndPattern.match(line)
-        domainDependantMatch = self.patterns.domainDependantPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-        containsMatch = self.patterns.containsPattern.match(line)
-        interfaceMatch = self.patterns.interfacePattern.match(line)
-        typeMatch = self.patterns.typePattern.match(line)
-
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif interfaceMatch:
-            self.processInterfaceMatch(interfaceMatch)
+        patternName, match = self.moduleStateClassifier.classify(line)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'interfacePattern':
+            self.processInterfaceMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_interface'
             else:
                 self.state = 'inside_interface'
-        elif typeMatch:
-            self.processTypeMatch(typeMatch)
+        elif patternName == 'typePattern':
+            self.processTypeMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_type'
             else:
                 self.state = 'inside_type'
-        elif templateMatch:
-            self.processTemplateMatch(templateMatch)
-        elif templateEndMatch:
-            self.processTemplateEndMatch(templateEndMatch)
-        elif domainDependantMatch:
+        elif patternName == 'templatePattern':
+            self.processTemplateMatch(match)
+        elif patternName == 'templateEndPattern':
+            self.processTemplateEndMatch(match)
+        elif patternName == 'domainDependantPattern':
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_moduleDomainDependantRegion'
             else:
                 self.state = 'inside_moduleDomainDependantRegion'
-            self.processDomainDependantMatch(domainDependantMatch)
-        elif moduleEndMatch:
-            self.processModuleEndMatch(moduleEndMatch)
+            self.processDomainDependantMatch(match)
+        elif patternName == 'moduleEndPattern':
+            self.processModuleEndMatch(match)
             self.currModuleName = None
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'none'
             else:
                 self.state = 'none'
-        elif containsMatch:
-            self.processContainsMatch(containsMatch)
+        elif patternName == 'containsPattern':
+            self.processContainsMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_module_body'
             else:
                 self.state = 'inside_module_body'
         else:
-            #let the child implementation decide what to do here.
-            pass
+            self.processNoMatch(line)
 
     def processInsideInterface(self, line):
         interfaceEndMatch = self.patterns.interfaceEndPattern.match(line)
@@ -261,35 +284,30 @@ class CallGraphParser(object):
             self.processNoMatch(line)
 
     def processInsideModuleBodyState(self, line):
-        subProcBeginMatch = self.patterns.subprocBeginPattern.match(line)
-        moduleEndMatch = self.patterns.moduleEndPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif templateMatch:
-            self.processTemplateMatch(templateMatch)
-        elif templateEndMatch:
-            self.processTemplateEndMatch(templateEndMatch)
-        elif moduleEndMatch:
-            self.processModuleEndMatch(moduleEndMatch)
+        patternName, match = self.moduleBodyStateClassifier.classify(line)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'templatePattern':
+            self.processTemplateMatch(match)
+        elif patternName == 'templateEndPattern':
+            self.processTemplateEndMatch(match)
+        elif patternName == 'moduleEndPattern':
+            self.processModuleEndMatch(match)
             self.currModuleName = None
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'none'
             else:
                 self.state = 'none'
-        elif subProcBeginMatch:
-            if (not subProcBeginMatch.group(1) or subProcBeginMatch.group(1) == ''):
+        elif patternName == 'subprocBeginPattern':
+            if (not match.group(1) or match.group(1) == ''):
                 raise UsageError("subprocedure begin without matching subprocedure name")
-            self.processProcBeginMatch(subProcBeginMatch)
+            self.processProcBeginMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_declarations'
             else:
                 self.state = 'inside_declarations'
             self.processSubprocStartPost()
-        elif (self.patterns.subprocEndPattern.match(line)):
+        elif patternName == 'subprocEndPattern':
             raise UsageError("end subprocedure without matching begin subprocedure")
         else:
             self.processNoMatch(line)
@@ -298,51 +316,40 @@ class CallGraphParser(object):
         return
 
     def processInsideDeclarationsState(self, line):
-        subProcCallMatch = self.patterns.subprocCallPattern.match(line)
-        parallelRegionMatch = self.patterns.parallelRegionPattern.match(line)
-        domainDependantMatch = self.patterns.domainDependantPattern.match(line)
-        subProcEndMatch = self.patterns.subprocEndPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif (domainDependantMatch):
+        patternName, match = self.declarationsStateClassifier.classify(line)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'domainDependantPattern':
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_domainDependantRegion'
             else:
                 self.state = 'inside_domainDependantRegion'
-            self.processDomainDependantMatch(domainDependantMatch)
-        elif subProcCallMatch:
-            self.processCallMatch(subProcCallMatch)
+            self.processDomainDependantMatch(match)
+        elif patternName == 'subprocCallPattern':
+            self.processCallMatch(match)
             if (self.state == "inside_branch" and self.stateBeforeBranch != 'inside_subroutine_call') or (self.state != "inside_branch" and self.state != 'inside_subroutine_call'):
                 self.processCallPost()
-        elif subProcEndMatch:
-            self.processProcEndMatch(subProcEndMatch)
+        elif patternName == 'subprocEndPattern':
+            self.processProcEndMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_module_body'
             else:
                 self.state = 'inside_module_body'
-        elif parallelRegionMatch:
+        elif patternName == 'parallelRegionPattern':
             raise UsageError("parallel region without parallel dependants")
-        elif (self.patterns.subprocBeginPattern.match(line)):
+        elif patternName == 'subprocBeginPattern':
             raise UsageError("subprocedure within subprocedure not allowed")
-        elif templateMatch:
+        elif patternName == 'templatePattern':
             raise UsageError("template directives are only allowed outside of subroutines")
-        elif templateEndMatch:
+        elif patternName == 'templateEndPattern':
             raise UsageError("template directives are only allowed outside of subroutines")
         else:
-            importMatch1 = self.patterns.importPattern.match(line)
-            importMatch2 = self.patterns.singleMappedImportPattern.match(line)
-            importMatch3 = self.patterns.importAllPattern.match(line)
+            declarationPatternName, _ = self.declarationClassifier.classify(line)
             specTuple = parseSpecification(line)
-            specificationStatementMatch = self.patterns.specificationStatementPattern.match(line)
             if not ( \
                 line.strip() == "" \
-                or importMatch1 or importMatch2 or importMatch3 \
+                or declarationPatternName \
                 or specTuple[0]
-                or specificationStatementMatch
             ):
                 if self.state == "inside_branch":
                     self.stateBeforeBranch = "inside_subroutine_body"
@@ -358,71 +365,58 @@ class CallGraphParser(object):
 
     def processInsideSubroutineBodyState(self, line):
         #note: Branches (@if statements) are ignored here, we want to keep analyzing their statements for callgraphs.
-        domainDependantMatch = self.patterns.domainDependantPattern.match(line)
-        subProcCallMatch = self.patterns.subprocCallPattern.match(line)
-        parallelRegionMatch = self.patterns.parallelRegionPattern.match(line)
-        domainDependantMatch = self.patterns.domainDependantPattern.match(line)
-        subProcEndMatch = self.patterns.subprocEndPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif domainDependantMatch:
+        patternName, match = self.subroutineBodyStateClassifier.classify(line)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'domainDependantPattern':
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_domainDependantRegion'
             else:
                 self.state = 'inside_domainDependantRegion'
-            self.processDomainDependantMatch(domainDependantMatch)
-        elif subProcCallMatch:
-            self.processCallMatch(subProcCallMatch)
+            self.processDomainDependantMatch(match)
+        elif patternName == 'subprocCallPattern':
+            self.processCallMatch(match)
             if (self.state == "inside_branch" and self.stateBeforeBranch != 'inside_subroutine_call') or (self.state != "inside_branch" and self.state != 'inside_subroutine_call'):
                 self.processCallPost()
-        elif subProcEndMatch:
-            self.processProcEndMatch(subProcEndMatch)
+        elif patternName == 'subprocEndPattern':
+            self.processProcEndMatch(match)
             if self.state == "inside_branch":
                 self.stateBeforeBranch = 'inside_module_body'
             else:
                 self.state = 'inside_module_body'
-        elif parallelRegionMatch:
-            self.processParallelRegionMatch(parallelRegionMatch)
+        elif patternName == 'parallelRegionPattern':
+            self.processParallelRegionMatch(match)
             self.state = 'inside_parallelRegion'
-        elif self.patterns.subprocBeginPattern.match(line):
+        elif patternName == 'subprocBeginPattern':
             raise UsageError("subprocedure within subprocedure not allowed")
-        elif templateMatch:
+        elif patternName == 'templatePattern':
             raise UsageError("template directives are only allowed outside of subroutines")
-        elif templateEndMatch:
+        elif patternName == 'templateEndPattern':
             raise UsageError("template directives are only allowed outside of subroutines")
 
     def processInsideParallelRegionState(self, line):
-        subProcCallMatch = self.patterns.subprocCallPattern.match(line)
-        parallelRegionEndMatch = self.patterns.parallelRegionEndPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-
+        patternName, match = self.parallelRegionStateClassifier.classify(line)
         newState = None
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif subProcCallMatch:
-            self.processCallMatch(subProcCallMatch)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'subprocCallPattern':
+            self.processCallMatch(match)
             if (self.state == "inside_branch" and self.stateBeforeBranch != 'inside_subroutine_call') or (self.state != "inside_branch" and self.state != 'inside_subroutine_call'):
                 self.processCallPost()
-        elif (parallelRegionEndMatch):
-            self.processParallelRegionEndMatch(parallelRegionEndMatch)
+        elif patternName == 'parallelRegionEndPattern':
+            self.processParallelRegionEndMatch(match)
             newState = "inside_subroutine_body"
         # elif (self.patterns.earlyReturnPattern.match(line)):
         #     raise UsageError("early return in the same subroutine within parallelRegion not allowed")
-        elif (self.patterns.parallelRegionPattern.match(line)):
+        elif patternName == 'parallelRegionPattern':
             raise UsageError("parallelRegion within parallelRegion not allowed")
-        elif (self.patterns.subprocEndPattern.match(line)):
+        elif patternName == 'subprocEndPattern':
             raise UsageError("subprocedure end before @end parallelRegion")
-        elif (self.patterns.subprocBeginPattern.match(line)):
+        elif patternName == 'subprocBeginPattern':
             raise UsageError("subprocedure within subprocedure not allowed")
-        elif templateMatch:
+        elif patternName == 'templatePattern':
             raise UsageError("template directives are only allowed outside of subroutines")
-        elif templateEndMatch:
+        elif patternName == 'templateEndPattern':
             raise UsageError("template directives are only allowed outside of subroutines")
         else:
             self.processNoMatch(line)
@@ -434,30 +428,26 @@ class CallGraphParser(object):
             self.state = newState
 
     def processInsideModuleDomainDependantRegionState(self, line):
-        domainDependantEndMatch = self.patterns.domainDependantEndPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-
+        patternName, match = self.domainDependantRegionStateClassifier.classify(line)
         newState = None
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif domainDependantEndMatch:
-            self.processDomainDependantEndMatch(domainDependantEndMatch)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'domainDependantEndPattern':
+            self.processDomainDependantEndMatch(match)
             newState = "inside_module"
-        elif (self.patterns.earlyReturnPattern.match(line)):
+        elif patternName == 'earlyReturnPattern':
             raise UsageError("early return not allowed here")
-        elif self.patterns.subprocCallPattern.match(line):
+        elif patternName == 'subprocCallPattern':
             raise UsageError("subprocedure call within domainDependants not allowed")
-        elif (self.patterns.parallelRegionEndPattern.match(line) or self.patterns.parallelRegionPattern.match(line)):
+        elif patternName in ['parallelRegionEndPattern', 'parallelRegionPattern']:
             raise UsageError("parallelRegion within domainDependants not allowed")
-        elif (self.patterns.subprocEndPattern.match(line)):
+        elif patternName == 'subprocEndPattern':
             raise UsageError("subprocedure end before @end domainDependant")
-        elif (self.patterns.subprocBeginPattern.match(line)):
+        elif patternName == 'subprocBeginPattern':
             raise UsageError("subprocedure within subprocedure not allowed")
-        elif templateMatch:
+        elif patternName == 'templatePattern':
             raise UsageError("template directives not allowed here")
-        elif templateEndMatch:
+        elif patternName == 'templateEndPattern':
             raise UsageError("template directives not allowed here")
         if newState == None:
             return
@@ -467,30 +457,26 @@ class CallGraphParser(object):
             self.state = newState
 
     def processInsideDomainDependantRegionState(self, line):
-        domainDependantEndMatch = self.patterns.domainDependantEndPattern.match(line)
-        templateMatch = self.patterns.templatePattern.match(line)
-        templateEndMatch = self.patterns.templateEndPattern.match(line)
-        branchMatch = self.patterns.branchPattern.match(line)
-
+        patternName, match = self.domainDependantRegionStateClassifier.classify(line)
         newState = None
-        if branchMatch:
-            self.processBranchMatch(branchMatch)
-        elif domainDependantEndMatch:
-            self.processDomainDependantEndMatch(domainDependantEndMatch)
+        if patternName == 'branchPattern':
+            self.processBranchMatch(match)
+        elif patternName == 'domainDependantEndPattern':
+            self.processDomainDependantEndMatch(match)
             newState = "inside_subroutine_body"
-        elif (self.patterns.earlyReturnPattern.match(line)):
+        elif patternName == 'earlyReturnPattern':
             raise UsageError("early return not allowed here")
-        elif self.patterns.subprocCallPattern.match(line):
+        elif patternName == 'subprocCallPattern':
             raise UsageError("subprocedure call within domainDependants not allowed")
-        elif (self.patterns.parallelRegionEndPattern.match(line) or self.patterns.parallelRegionPattern.match(line)):
+        elif patternName in ['parallelRegionEndPattern', 'parallelRegionPattern']:
             raise UsageError("parallelRegion within domainDependants not allowed")
-        elif (self.patterns.subprocEndPattern.match(line)):
+        elif patternName == 'subprocEndPattern':
             raise UsageError("subprocedure end before @end domainDependant")
-        elif (self.patterns.subprocBeginPattern.match(line)):
+        elif patternName == 'subprocBeginPattern':
             raise UsageError("subprocedure within subprocedure not allowed")
-        elif templateMatch:
+        elif patternName == 'templatePattern':
             raise UsageError("template directives not allowed here")
-        elif templateEndMatch:
+        elif patternName == 'templateEndPattern':
             raise UsageError("template directives not allowed here")
         if newState == None:
             return
@@ -514,12 +500,19 @@ class CallGraphParser(object):
 
         logging.debug("line processed. parser in '%s' state. active symbols: %s" %(self.state, self.currSymbolsByName.keys()), extra={"hfLineNo":currLineNo, "hfFile":currFile})
 
-    def processFile(self, fileName):
+    def processFile(self, fileName, intermediate=None):
+        if intermediate != None:
+            with intermediate:
+                self.processLines(fileName, intermediate.lines)
+        else:
+            self.processLines(fileName, fileinput.input([fileName]))
+
+    def processLines(self, fileName, lines):
         self.lineNo = 1
         self.fileName = fileName
         global currFile
         currFile = os.path.basename(fileName)
-        for line in fileinput.input([fileName]):
+        for line in lines:
             try:
                 self.processLine(line)
             except UsageError as e:
@@ -558,6 +551,7 @@ class H90XMLCallGraphGenerator(CallGraphParser):
     currCallNode = None
     currSubprocNode = None
     currModuleNode = None
+    currModuleImportsNode = None
     currDomainDependantRelationNode = None
     currParallelRegionTemplateNode = None
     currParallelRegionRelationNode = None
@@ -606,8 +600,23 @@ class H90XMLCallGraphGenerator(CallGraphParser):
         super(H90XMLCallGraphGenerator, self).processModuleBeginMatch(moduleBeginMatch)
         module = self.doc.createElement('module')
         module.setAttribute('name', self.currModuleName)
+        module.setAttribute('source', os.path.basename(self.fileName).split('.')[0])
         self.modules.appendChild(module)
         self.currModuleNode = module
+        self.currModuleImportsNode = None
+
+    def processModuleImport(self, line):
+        #every module used within a module is recorded, such that the compilation order of the sources can be derived
+        importMatch = self.patterns.importPattern.match(line) or self.patterns.importAllPattern.match(line)
+        if not importMatch or importMatch.group(1) in [None, ''] or not self.currModuleNode:
+            return
+        if not self.currModuleImportsNode:
+            self.currModuleImportsNode = self.doc.createElement('imports')
+            self.currModuleNode.appendChild(self.currModuleImportsNode)
+        moduleImport = self.doc.createElement('import')
+        moduleImport.setAttribute('module', importMatch.group(1))
+        if not firstDuplicateChild(self.currModuleImportsNode, moduleImport):
+            self.currModuleImportsNode.appendChild(moduleImport)
 
     def processProcBeginMatch(self, subProcBeginMatch):
         super(H90XMLCallGraphGenerator, self).processProcBeginMatch(subProcBeginMatch)
@@ -660,6 +669,11 @@ class H90XMLCallGraphGenerator(CallGraphParser):
     def processModuleEndMatch(self, moduleEndMatch):
         super(H90XMLCallGraphGenerator, self).processModuleEndMatch(moduleEndMatch)
         self.currModuleNode = None
+        self.currModuleImportsNode = None
+
+    def processNoMatch(self, line):
+        super(H90XMLCallGraphGenerator, self).processNoMatch(line)
+        self.processModuleImport(line)
 
     def processInsideModuleDomainDependantRegionState(self, line):
         super(H90XMLCallGraphGenerator, self).processInsideModuleDomainDependantRegionState(line)
@@ -673,8 +687,23 @@ class H90XMLCallGraphGenerator(CallGraphParser):
             return
         addAndGetEntries(self.doc, self.currDomainDependantRelationNode, line)
 
+def getSymbolForEntry(template, entry, parentNode, parallelRegionTemplates=[], symbolAnalysisByRoutineNameAndSymbolName={}, existingSymbol=None):
+    dependantName = entry.firstChild.nodeValue
+    symbol = Symbol(
+        dependantName,
+        template,
+        symbolEntry=entry,
+        scopeNode=parentNode,
+        analysis=getAnalysisForSymbol(symbolAnalysisByRoutineNameAndSymbolName, parentNode.getAttribute('name'), dependantName),
+        parallelRegionTemplates=parallelRegionTemplates
+    )
+    if existingSymbol != None:
+        symbol.merge(existingSymbol)
+        #overspecifying module symbol in a subroutine domain dependant specification
+        symbol.isModuleSymbol = existingSymbol.isModuleSymbol
+    return symbol
+
 def getSymbolsByName(cgDoc, parentNode, parallelRegionTemplates=[], currentModuleName=None, currentSymbolsByName={}, symbolAnalysisByRoutineNameAndSymbolName={}, isModuleSymbols=False):
-    patterns = RegExPatterns.Instance()
     templatesAndEntries = getDomainDependantTemplatesAndEntries(cgDoc, parentNode)
     symbolsByName = {}
     parentName = parentNode.getAttribute('name')
@@ -682,71 +711,27 @@ def getSymbolsByName(cgDoc, parentNode, parallelRegionTemplates=[], currentModul
         raise Exception("parent node without identifier")
     for template, entry in templatesAndEntries:
         dependantName = entry.firstChild.nodeValue
-        symbol = Symbol(
-            dependantName,
-            template,
-            symbolEntry=entry,
-            scopeNode=parentNode,
-            analysis=getAnalysisForSymbol(symbolAnalysisByRoutineNameAndSymbolName, parentName, dependantName),
-            parallelRegionTemplates=parallelRegionTemplates
-        )
-        nameOfScope = entry.getAttribute("nameOfScope")
         existingSymbol = symbolsByName.get(uniqueIdentifier(dependantName, entry.getAttribute("nameOfScope")))
         if existingSymbol == None:
             existingSymbol = currentSymbolsByName.get(uniqueIdentifier(dependantName, entry.getAttribute("nameOfScope")))
         if existingSymbol == None and entry.getAttribute("isDeclaredExplicitely") != "yes" and currentModuleName not in [None, ""]:
             existingSymbol = currentSymbolsByName.get(uniqueIdentifier(dependantName, currentModuleName))
-        if existingSymbol != None:
-            symbol.merge(existingSymbol)
-            #overspecifying module symbol in a subroutine domain dependant specification
-            symbol.isModuleSymbol = existingSymbol.isModuleSymbol
+        symbol = getSymbolForEntry(
+            template,
+            entry,
+            parentNode,
+            parallelRegionTemplates=parallelRegionTemplates,
+            symbolAnalysisByRoutineNameAndSymbolName=symbolAnalysisByRoutineNameAndSymbolName,
+            existingSymbol=existingSymbol
+        )
         symbolsByName[symbol.uniqueIdentifier] = symbol
     return symbolsByName
 
 def getModuleNodesByName(cgDoc):
-    moduleNodesByName = {}
-    modules = cgDoc.getElementsByTagName('module')
-    for module in modules:
-        moduleName = module.getAttribute('name')
-        if not moduleName or moduleName == '':
-            raise Exception("Module without name.")
-        moduleNodesByName[moduleName] = module
-    return moduleNodesByName
+    return CallGraph(cgDoc).moduleNodesByName
 
 def getParallelRegionData(cgDoc):
-    parallelRegionTemplateRelationsByProcName = {}
-    parallelRegionTemplatesByProcName = {}
-    routineNodesByProcName = {}
-    routineNodesByModule = {}
-    regionsByID = regionTemplatesByID(cgDoc, 'parallelRegionTemplate')
-    routines = cgDoc.getElementsByTagName('routine')
-    for routine in routines:
-        procName = routine.getAttribute('name')
-        if procName in [None, '']:
-            raise Exception("Procedure without name.")
-        routineNodesByProcName[procName] = routine
-        moduleName = routine.getAttribute('module')
-        if moduleName not in [None, '']:
-            routinesForModule = routineNodesByModule.get(moduleName, [])
-            routinesForModule.append(routine)
-            routineNodesByModule[moduleName] = routinesForModule
-        regionTemplates = []
-        parallelRegionsParents = routine.getElementsByTagName('activeParallelRegions')
-        if parallelRegionsParents and len(parallelRegionsParents) > 0:
-            templateRelations = parallelRegionsParents[0].getElementsByTagName('templateRelation')
-            for templateRelation in templateRelations:
-                idStr = templateRelation.getAttribute('id')
-                if not idStr or idStr == '':
-                    raise Exception("Template relation without id attribute.")
-                regionTemplate = regionsByID.get(idStr, None)
-                if not regionTemplate:
-                    raise Exception("Template relation id %s could not be matched in procedure '%s'" %(idStr, procName))
-                regionTemplates.append(regionTemplate)
-            if len(templateRelations) > 0:
-                parallelRegionTemplateRelationsByProcName[procName] = templateRelations
-            if len(regionTemplates) > 0:
-                parallelRegionTemplatesByProcName[procName] = regionTemplates
-    return parallelRegionTemplateRelationsByProcName, parallelRegionTemplatesByProcName, routineNodesByProcName, routineNodesByModule
+    return CallGraph(cgDoc).parallelRegionData
 
 class H90CallGraphAndSymbolDeclarationsParser(CallGraphParser):
     def __init__(self, cgDoc, moduleNodesByName=None, parallelRegionData=None, implementationsByTemplateName=None):
@@ -755,13 +740,11 @@ class H90CallGraphAndSymbolDeclarationsParser(CallGraphParser):
         self.importsOnCurrentLine = []
         #$$$ remove this in case we never enable routine domain dependant specifications for module symbols (likely)
         # self.tentativeModuleSymbolsByName = None
-        if moduleNodesByName != None:
-            self.moduleNodesByName = moduleNodesByName
-        else:
-            self.moduleNodesByName = getModuleNodesByName(cgDoc)
-
-        if parallelRegionData == None:
-            parallelRegionData = getParallelRegionData(cgDoc)
+        if moduleNodesByName == None or parallelRegionData == None:
+            callGraph = CallGraph(cgDoc)
+            moduleNodesByName = callGraph.moduleNodesByName if moduleNodesByName == None else moduleNodesByName
+            parallelRegionData = callGraph.parallelRegionData if parallelRegionData == None else parallelRegionData
+        self.moduleNodesByName = moduleNodesByName
         self.implementationsByTemplateName = implementationsByTemplateName
         self.parallelRegionTemplatesByProcName = parallelRegionData[1]
         self.parallelRegionTemplateRelationsByProcName = parallelRegionData[0]
@@ -909,7 +892,7 @@ class H90CallGraphAndSymbolDeclarationsParser(CallGraphParser):
                     matchesAndSymbolByScopeName[symbol.nameOfScope] = matchesAndSymbol
                     matchesAndSymbolBySymbolNameAndScopeName[symbol.name] = matchesAndSymbolByScopeName
                     continue
-                importMatch = symbol.importPattern.match(line)
+                importMatch = symbol.matchImport(line)
                 if importMatch:
                     matchesAndSymbol[1] = importMatch
                     matchesAndSymbolByScopeName[symbol.nameOfScope] = matchesAndSymbol
@@ -1185,8 +1168,13 @@ class H90CallGraphAndSymbolDeclarationsParser(CallGraphParser):
         self.importsOnCurrentLine = []
 
 class H90XMLSymbolDeclarationExtractor(H90CallGraphAndSymbolDeclarationsParser):
-    def __init__(self, cgDoc, symbolsByModuleNameAndSymbolName=None, implementationsByTemplateName=None):
-        super(H90XMLSymbolDeclarationExtractor, self).__init__(cgDoc, implementationsByTemplateName=implementationsByTemplateName)
+    def __init__(self, cgDoc, symbolsByModuleNameAndSymbolName=None, implementationsByTemplateName=None, moduleNodesByName=None, parallelRegionData=None):
+        super(H90XMLSymbolDeclarationExtractor, self).__init__(
+            cgDoc,
+            moduleNodesByName=moduleNodesByName,
+            parallelRegionData=parallelRegionData,
+            implementationsByTemplateName=implementationsByTemplateName
+        )
         self.symbolsByModuleNameAndSymbolName = symbolsByModuleNameAndSymbolName
         self.entryNodesBySymbolName = {}
         self.currSymbols = []
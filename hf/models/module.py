@@ -60,7 +60,8 @@ class Module(object):
 		self._postTextByRoutine[routine.name] = ""
 		return routine
 
-	def implemented(self):
+	def writeImplementation(self, writer):
+		'''writes the implemented module to a SanitizedOutputWriter, one routine (and region) at a time'''
 		self._footerText = self._undecidedText
 		self._undecidedText = ""
 
@@ -71,17 +72,16 @@ class Module(object):
 		], []):
 			routines += routine.implementation.splitIntoCompatibleRoutines(routine)
 
-		implementedModuleElements = \
-			[self._headerText.strip()] \
-			+ [
-				(
-					routine.implemented() + "\n" + self._postTextByRoutine.get(routine.name, "").strip()
-				).strip()
-				for routine in routines
-			] \
-			+ [self._footerText.strip()]
-		purgedModuleElements = [
-			text + "\n" for text in implementedModuleElements
-			if text != ""
-		]
-		return '\n'.join([text for text in purgedModuleElements])
\ No newline at end of file
+		writer.beginStrippedElement()
+		writer.write(self._headerText)
+		if writer.endStrippedElement():
+			writer.write("\n\n")
+		for routine in routines:
+			writer.beginStrippedElement()
+			routine.writeImplementation(writer)
+			writer.write("\n" + self._postTextByRoutine.get(routine.name, "").strip())
+			if writer.endStrippedElement():
+				writer.write("\n\n")
+		writer.beginStrippedElement()
+		writer.write(self._footerText)
+		writer.endStrippedElement()
@@ -378,9 +378,9 @@ class RoutineSpecificationRegion(Region):
 				if symbol.getSpecificationTuple(line)[0]:
 					declaredSymbolsByScopedName[symbol.nameInScope()] = symbol
 					continue
-				match = symbol.importPattern.match(line)
+				match = symbol.matchImport(line)
 				if not match:
-					match = symbol.importMapPattern.match(line)
+					match = symbol.matchImportMap(line)
 				if match:
 					importsFound = True
 					continue
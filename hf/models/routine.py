@@ -502,25 +502,25 @@ This is not allowed for implementations using %s.\
 	def loadLine(self, line, symbolsOnCurrentLine=None):
 		self._currRegion.loadLine(line, symbolsOnCurrentLine)
 
-	def implemented(self):
-		purgedRoutineElements = []
+	def writeImplementation(self, writer):
+		'''writes the implemented routine to a SanitizedOutputWriter - each region is passed on as soon as it is implemented'''
 		try:
 			self._checkParallelRegions()
 			self._prepareAdditionalContext()
 			self._updateSymbolReferences()
 			self._updateSymbolState()
-			implementedRoutineElements = [self._implementHeader(), self._implementAdditionalImports()]
-			implementedRoutineElements += [region.implemented() for region in self._regions]
-			implementedRoutineElements += [self._implementFooter()]
-			purgedRoutineElements = [
-				(index, text) for index, text in enumerate(implementedRoutineElements)
-				if text != ""
-			]
+			isFirstElement = True
+			for implementElement in [self._implementHeader, self._implementAdditionalImports] \
+			+ [region.implemented for region in self._regions] \
+			+ [self._implementFooter]:
+				text = implementElement()
+				if text == "":
+					continue
+				if not isFirstElement:
+					writer.write("\n")
+				writer.write(text)
+				isFirstElement = False
 		except UsageError as e:
 			raise UsageError("Error in %s: %s" %(self.name, str(e)))
 		except ScopeError as e:
 			raise ScopeError("Error in %s: %s;\nTraceback: %s" %(self.name, str(e), traceback.format_exc()))
-		return "\n".join([
-			text
-			for (index, text) in purgedRoutineElements
-		])
@@ -18,7 +18,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
-import re, sys, copy
+import sys, copy
 import logging
 import pdb
 from tools.metadata import *
@@ -256,6 +256,33 @@ class ScopeError(Exception):
     pass
 
 class Symbol(object):
+	#A symbol is created for every module and routine scope it's visible in, so we keep it free of an instance dictionary.
+	#Data loaded from the template is shared between all symbols of that template, see tools.metadata.getTemplateData.
+	__slots__ = (
+		"name",
+		"patterns",
+		"initLevel",
+		"routineNode",
+		"template",
+		"attributes",
+		"declarationSuffix",
+		"createdBy",
+		"intent",
+		"isConstant",
+		"isModuleSymbol",
+		"isOnDevice",
+		"parallelRegionPosition",
+		"isEmulatingSymbolThatWasActiveInCurrentScope",
+		"_entryNode",
+		"_isUsingDevicePostfix",
+		"_isArgumentOverride",
+		"_nameOfScopeOverride",
+		"_nameInScope",
+		"_isPresent",
+		"_isToBeTransfered"
+	) + tuple(MERGEABLE_DEFAULT_SYMBOL_INSTANCE_ATTRIBUTES.keys()) \
+	  + tuple(MERGEABLE_DEFAULT_SYMBOL_INSTANCE_DOMAIN_ATTRIBUTES.keys())
+
 	def __init__(self, name, template=None, patterns=None, symbolEntry=None, scopeNode=None, analysis=None, parallelRegionTemplates=[]):
 		if not name or name == "":
 			raise Exception("Name required for initializing symbol")
@@ -267,10 +294,6 @@ class Symbol(object):
 		else:
 			self.patterns = RegExPatterns.Instance()
 		self.analysis = analysis
-		self.importPattern = self.patterns.get(r'^\s*use\s*(\w*)\s*,\s*only\s*.*?\W\s*' + re.escape(name) + r'(?:\W|$).*')
-		self.importMapPattern = self.patterns.get(r'.*?\W' + re.escape(name) + r'\s*\=\>\s*(\w*).*')
-		self.pointerOrAllocatablePattern = self.patterns.get(r'\s*(?:double\s+precision|real|integer|character|logical|complex).*?(?:pointer|allocatable).*?[\s,:]+' + re.escape(name))
-		self.typeDependencyPattern = self.patterns.get(r'.*?\W' + re.escape(name) + r'\W.*')
 		self.initLevel = Init.NOTHING_LOADED
 		self.routineNode = None
 		self.declarationSuffix = None
@@ -587,6 +610,12 @@ EXAMPLE:\n\
 			return limitLength(deviceVersionIdentifier(self._nameInScope))
 		return limitLength(self._nameInScope)
 
+	def matchImport(self, line):
+		return self.patterns.matchSymbolImport(line, self.name)
+
+	def matchImportMap(self, line):
+		return self.patterns.matchSymbolImportMap(line, self.name)
+
 	def splitTextAtLeftMostOccurrence(self, text):
 		return splitTextAtLeftMostOccurrence([self.name], text)
 
@@ -715,7 +744,7 @@ EXAMPLE:\n\
 		self.isPresent = self.isPresent or otherSymbol.isPresent
 		#isToBeTransfered shall be kept from curr symbol
 		if self.isAutoDom and not otherSymbol.isAutoDom and self.parallelRegionTemplates:
-			self.loadDomains(getDomNameAndSize(otherSymbol.template), self.parallelRegionTemplates)
+			self.loadDomains(getTemplateData(otherSymbol.template).domains, self.parallelRegionTemplates)
 		self.initLevel = max(self.initLevel, otherSymbol.initLevel)
 		self.checkIntegrityOfDomains()
 
@@ -728,7 +757,7 @@ EXAMPLE:\n\
 				)
 			)
 		self.template = template
-		self.attributes = getAttributes(self.template)
+		self.attributes = getTemplateData(self.template).attributes
 		self.setOptionsFromAttributes(self.attributes)
 		self.initLevel = max(self.initLevel, Init.TEMPLATE_LOADED)
 
@@ -873,8 +902,9 @@ EXAMPLE:\n\
 					self.initLevel
 				)
 			)
-		templateDomains = getDomNameAndSize(self.template)
-		declarationPrefixFromTemplate = getDeclarationPrefix(self.template)
+		templateData = getTemplateData(self.template)
+		templateDomains = templateData.domains
+		declarationPrefixFromTemplate = templateData.declarationPrefix
 		self.loadDeclarationPrefixFromString(declarationPrefixFromTemplate)
 		self.loadDomains(templateDomains, parallelRegionTemplates)
 		self.adjustDomainsToKernelPosition()
@@ -922,7 +952,7 @@ EXAMPLE:\n\
 		#   -> build up index of domain sizes and and names and put them in the 'parallelActive' set, .....
 		parallelRegionDomNamesBySize = {}
 		for parallelRegionTemplate in parallelRegionTemplates:
-			regionDomNameAndSize = getDomNameAndSize(parallelRegionTemplate)
+			regionDomNameAndSize = getTemplateData(parallelRegionTemplate).domains
 			logging.debug("[" + self.name + ".init " + str(self.initLevel) + "] analyzing domains for parallel region: %s; dependant domsize by name: %s" %(
 				str(regionDomNameAndSize),
 				str(dependantDomSizeByName)
@@ -1063,7 +1093,7 @@ EXAMPLE:\n\
 
 		#   check whether the symbol has undecided domains
 		dimensionStr = dimensionStringFromSpecification(self.name, specTuple)
-		self.hasUndecidedDomainSizes = self.pointerOrAllocatablePattern.match(declarationLine) != None and ":" in dimensionStr
+		self.hasUndecidedDomainSizes = self.patterns.isPointerOrAllocatableDeclaration(declarationLine, self.name) and ":" in dimensionStr
 
 		#   look at declaration of symbol and get its                 #
 		#   dimensions.                                               #
@@ -1116,7 +1146,7 @@ Parallel region position: %s, Current template: %s"
 		sourceModuleName = importMatch.group(1)
 		if sourceModuleName == "":
 			raise Exception("Invalid module in use statement for symbol %s" %(symbol.name))
-		mapMatch = self.importMapPattern.match(importMatch.group(0))
+		mapMatch = self.matchImportMap(importMatch.group(0))
 		sourceSymbolName = ""
 		if mapMatch:
 			sourceSymbolName = mapMatch.group(1)
@@ -1518,6 +1548,8 @@ Currently loaded template: %s\n" %(
 			return "", False
 
 class ImplicitForeignModuleSymbol(Symbol):
+	__slots__ = ()
+
 	def __init__(self, _sourceModuleIdentifier, nameInScope, sourceSymbol, template=None):
 		Symbol.__init__(self, nameInScope, template)
 		self._nameInScope = nameInScope
@@ -1525,6 +1557,8 @@ class ImplicitForeignModuleSymbol(Symbol):
 		self.sourceSymbol = sourceSymbol
 
 class FrameworkArray(Symbol):
+	__slots__ = ()
+
 	def __init__(self, calleeName, declarationPrefix, domains, isOnDevice):
 		if not calleeName or calleeName == "":
 			raise Exception("Name required for initializing framework array")
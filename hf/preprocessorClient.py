@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        preprocessorClient.py                              #
+#  Comment          Runs a preprocessor script in preprocessorDaemon.py #
+#                   (started on demand), such that the Python startup  #
+#                   and module imports are only paid once per build.   #
+#                   Falls back to running the script directly.         #
+#**********************************************************************#
+
+from optparse import OptionParser
+from tools.daemon import getDefaultSocketPath, ensurePrivateSocketDirectory, isSameUserPeer, getRequestEnvironment, receiveFrame, \
+    SocketAccessError, stdoutChannel, stderrChannel, exitChannel
+import os, sys, socket, json, time, subprocess
+
+hfDir = os.path.dirname(os.path.abspath(__file__))
+daemonStartupTimeout = 10.0
+
+def connect(socketPath):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socketPath)
+    except socket.error:
+        connection.close()
+        return None
+    if not isSameUserPeer(connection):
+        connection.close()
+        raise SocketAccessError("%s is served by a process of another user" %(socketPath))
+    return connection
+
+def startDaemon(socketPath):
+    with open(os.devnull, 'r+') as devnull:
+        subprocess.Popen(
+            [sys.executable, os.path.join(hfDir, "preprocessorDaemon.py"), "--socket=%s" %(socketPath)],
+            cwd=hfDir,
+            stdin=devnull,
+            stdout=devnull,
+            stderr=devnull,
+            close_fds=True,
+            preexec_fn=os.setsid
+        )
+
+def connectOrStartDaemon(socketPath):
+    connection = connect(socketPath)
+    if connection:
+        return connection
+    startDaemon(socketPath)
+    startTime = time.time()
+    while time.time() - startTime < daemonStartupTimeout:
+        time.sleep(0.05)
+        connection = connect(socketPath)
+        if connection:
+            return connection
+    return None
+
+def runInDaemon(socketPath, script, arguments, stdinData):
+    '''returns the exit code of the script, or None if the daemon has closed the connection without running it'''
+    connection = connectOrStartDaemon(socketPath)
+    if not connection:
+        return None
+    try:
+        request = {
+            "script": script,
+            "arguments": arguments,
+            "cwd": os.getcwd(),
+            "env": getRequestEnvironment(),
+            "stdin": stdinData != None
+        }
+        connection.sendall(json.dumps(request) + "\n")
+        if stdinData != None:
+            connection.sendall(stdinData)
+        connection.shutdown(socket.SHUT_WR)
+        hasReceivedOutput = False
+        while True:
+            try:
+                channel, payload = receiveFrame(connection)
+            except EOFError:
+                if not hasReceivedOutput:
+                    return None
+                sys.stderr.write("preprocessor daemon has closed the connection while running %s\n" %(script))
+                return 1
+            hasReceivedOutput = True
+            if channel == stdoutChannel:
+                sys.stdout.write(payload)
+            elif channel == stderrChannel:
+                sys.stderr.write(payload)
+            elif channel == exitChannel:
+                sys.stdout.flush()
+                return int(payload)
+    except socket.error:
+        return None
+    finally:
+        connection.close()
+
+def runLocally(script, arguments, stdinData):
+    command = [sys.executable, os.path.join(hfDir, os.path.basename(script))] + arguments
+    if stdinData == None:
+        return subprocess.call(command)
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    process.communicate(stdinData)
+    return process.returncode
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser(usage="usage: %prog [options] script.py [script arguments]")
+parser.disable_interspersed_args()
+parser.add_option("-s", "--socket", dest="socket", default=getDefaultSocketPath(),
+                  help="path of the daemon's Unix socket, in a directory only accessible to the current user (default: %default)")
+parser.add_option("--stdin", action="store_true", dest="stdin",
+                  help="pass the standard input on to the script")
+(options, args) = parser.parse_args()
+
+if len(args) < 1:
+    parser.print_help()
+    sys.exit(1)
+
+script = args[0]
+arguments = args[1:]
+stdinData = sys.stdin.read() if options.stdin else None
+exitCode = None
+try:
+    ensurePrivateSocketDirectory(options.socket)
+    #a daemon that has been started for outdated preprocessor sources closes the first connection and exits - retry once
+    for attempt in range(2):
+        exitCode = runInDaemon(options.socket, script, arguments, stdinData)
+        if exitCode != None:
+            break
+except SocketAccessError as e:
+    sys.stderr.write("%s\n" %(str(e)))
+if exitCode == None:
+    sys.stderr.write("preprocessor daemon not available - running %s directly\n" %(script))
+    exitCode = runLocally(script, arguments, stdinData)
+sys.exit(exitCode)
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        preprocessorDaemon.py                              #
+#  Comment          Long-lived server on a Unix socket that runs the   #
+#                   preprocessor scripts for preprocessorClient.py,    #
+#                   with all modules imported, the regular expressions #
+#                   compiled and recently used callgraphs parsed.      #
+#**********************************************************************#
+
+from optparse import OptionParser
+from StringIO import StringIO
+from tools.daemon import getDefaultSocketPath, ensurePrivateSocketDirectory, isSameUserPeer, sendFrame, receiveLine, receiveAll, \
+    FrameWriter, requestEnvironmentNames, stdoutChannel, stderrChannel, exitChannel
+from tools.filesystem import dirEntries
+from tools.metadata import warmCallGraphFile, binaryCallGraphHeader
+from tools.patterns import RegExPatterns
+#imported for every request to start from - not used here directly
+import machinery.parser, machinery.converter, machinery.intermediate, tools.analysis, tools.cache, tools.callgraph, \
+    tools.dependencies, implementations.fortran
+import os, sys, errno, socket, signal, json, atexit, traceback, imp, tempfile
+
+hfDir = os.path.dirname(os.path.abspath(__file__))
+
+def getSourcesStamp():
+    '''changes whenever the preprocessor itself is changed - the daemon then needs to be restarted'''
+    return max(os.path.getmtime(path) for path in dirEntries(hfDir, True, 'py'))
+
+def getCallGraphPaths(arguments, workingDirectory):
+    '''arguments (or values of --option=value arguments) that name callgraph files'''
+    for argument in arguments:
+        if argument.startswith("--") and "=" in argument:
+            argument = argument.split("=", 1)[1]
+        path = os.path.join(workingDirectory, argument)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as candidateFile:
+            start = candidateFile.read(256)
+        if start.startswith(binaryCallGraphHeader) or "<callGraph" in start:
+            yield path
+
+def runRequest(connection, request, stdinData):
+    '''runs a preprocessor script like "python script arguments" would, in a process forked off the daemon'''
+    exitCode = 0
+    sys.stdout = FrameWriter(connection, stdoutChannel, bufferSize=65536)
+    sys.stderr = FrameWriter(connection, stderrChannel)
+    sys.stdin = StringIO(stdinData)
+    try:
+        scriptPath = os.path.join(hfDir, os.path.basename(request["script"]))
+        if not os.path.isfile(scriptPath):
+            raise Exception("%s is not a preprocessor script in %s" %(request["script"], hfDir))
+        os.chdir(request["cwd"])
+        for name in requestEnvironmentNames:
+            if name in request["env"]:
+                os.environ[name] = request["env"][name]
+            else:
+                os.environ.pop(name, None)
+        #determined again from the client's environment
+        tempfile.tempdir = None
+        sys.argv = [scriptPath] + request["arguments"]
+        #scripts use multiprocessing, which needs to find their functions in the __main__ module
+        mainModule = imp.new_module("__main__")
+        mainModule.__file__ = scriptPath
+        sys.modules["__main__"] = mainModule
+        with open(scriptPath, 'r') as scriptFile:
+            code = compile(scriptFile.read(), scriptPath, 'exec')
+        exec code in mainModule.__dict__
+    except SystemExit as e:
+        if e.code in [None, 0]:
+            exitCode = 0
+        elif isinstance(e.code, int):
+            exitCode = e.code
+        else:
+            sys.stderr.write("%s\n" %(e.code))
+            exitCode = 1
+    except Exception:
+        sys.stderr.write(traceback.format_exc())
+        exitCode = 1
+    try:
+        atexit._run_exitfuncs()
+    except Exception:
+        exitCode = exitCode if exitCode != 0 else 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sendFrame(connection, exitChannel, str(exitCode))
+
+def removeSocket(server, socketPath):
+    server.close()
+    try:
+        os.unlink(socketPath)
+    except OSError:
+        pass
+
+def serve(socketPath, idleTimeout):
+    ensurePrivateSocketDirectory(socketPath)
+    try:
+        os.unlink(socketPath)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise e
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socketPath)
+    os.chmod(socketPath, 0600)
+    server.listen(64)
+    server.settimeout(idleTimeout)
+    sourcesStamp = getSourcesStamp()
+    #request processes are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                return
+            if not isSameUserPeer(connection):
+                connection.close()
+                continue
+            connection.settimeout(None)
+            try:
+                request = json.loads(receiveLine(connection))
+                stdinData = receiveAll(connection) if request.get("stdin") else ""
+            except (EOFError, ValueError, socket.error):
+                connection.close()
+                continue
+            if getSourcesStamp() != sourcesStamp:
+                #the client retries with a new daemon if we close the connection without an answer -
+                #the socket needs to be gone by then, such that the client doesn't reach this daemon again
+                removeSocket(server, socketPath)
+                connection.close()
+                return
+            for path in getCallGraphPaths(request["arguments"], request["cwd"]):
+                try:
+                    warmCallGraphFile(path)
+                except Exception:
+                    #not parsable now - the script will report this itself
+                    pass
+            if os.fork() == 0:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                server.close()
+                try:
+                    runRequest(connection, request, stdinData)
+                finally:
+                    os._exit(0)
+            connection.close()
+    finally:
+        removeSocket(server, socketPath)
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser()
+parser.add_option("-s", "--socket", dest="socket", default=getDefaultSocketPath(),
+                  help="path of the Unix socket to listen on (default: %default)")
+parser.add_option("-t", "--idleTimeout", dest="idleTimeout", type="int", default=60,
+                  help="minutes without requests after which the daemon exits (default: 60)")
+(options, args) = parser.parse_args()
+
+RegExPatterns.Instance()
+serve(options.socket, options.idleTimeout * 60)
@@ -36,7 +36,7 @@ import logging
 #get all program arguments
 parser = OptionParser()
 parser.add_option("-i", "--sourceXML", dest="source",
-                  help="read callgraph from this XML file", metavar="XML")
+                  help="read callgraph from this XML or binary file", metavar="XML")
 (options, args) = parser.parse_args()
 
 setupDeferredLogging('preprocessor.log', logging.INFO)
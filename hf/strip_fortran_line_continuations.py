@@ -1,54 +1,87 @@
 import sys, re, fileinput
 import logging
+from optparse import OptionParser
 from tools.commons import findLeftMostOccurrenceNotInsideQuotes, setupDeferredLogging
+from tools.instrumentation import StageReport, addStageReportOptions
 
 openMPLinePattern = re.compile(r'\s*\!\$OMP.*', re.IGNORECASE)
 openACCLinePattern = re.compile(r'\s*\!\$ACC.*', re.IGNORECASE)
-emptyLinePattern = re.compile(r'(.*?)(?:[\n\r\f\v]+[ \t]*)+(.*)', re.DOTALL)
-multiLineContinuationPattern = re.compile(r'(.*?)\s*\&\s+(?:\!?\$?(?:OMP|ACC)?\&)?\s*(.*)', re.DOTALL)
+emptyLinesPattern = re.compile(r'[\n\r\f\v][\n\r\f\v \t]*')
+leadingEmptyLinesPattern = re.compile(r'[\n\r\f\v \t]*')
+lineContinuationPattern = re.compile(r'\s*\&\s+(?:\!?\$?(?:OMP|ACC)?\&)?\s*')
+trailingWhitespacePattern = re.compile(r'\s*\Z')
 
-fileInputObject = None
-if len(sys.argv) > 1:
-	fileInputObject = fileinput.input(sys.argv[1])
-else:
-	fileInputObject = fileinput.input()
+#All passes work as generators on the stream of lines, so a file is processed in linear time,
+#with only the current logical line kept in memory.
 
-def pre_sanitize_fortran():
+def stripComments(lines):
 	#first pass: strip out commented code (otherwise we could get in trouble when removing line continuations, if there are comments in between)
-	noComments = ""
-	for line in fileInputObject:
+	for line in lines:
 		if openMPLinePattern.match(line) or openACCLinePattern.match(line):
-			noComments += line
+			yield line
 			continue
 		commentIndex = findLeftMostOccurrenceNotInsideQuotes("!", line)
 		if commentIndex < 0:
-			noComments += line
+			yield line
 			continue
-		noComments += line[:commentIndex] + "\n"
+		yield line[:commentIndex] + "\n"
 
-	#second pass: strip out empty lines (otherwise we could get in trouble when removing line continuations, if there are empty lines in between)
-	stripped = ""
-	remainder = noComments
-	while True:
-		emptyLineMatch = emptyLinePattern.match(remainder)
-		if not emptyLineMatch:
-			stripped += remainder
-			break
-		stripped += emptyLineMatch.group(1) + "\n"
-		remainder = emptyLineMatch.group(2)
+def stripEmptyLines(lines):
+	#second pass: strip out empty lines (otherwise we could get in trouble when removing line continuations, if there are empty lines in between).
+	#Every run of line breaks, together with the whitespace in between and the indentation following it, becomes a single line break.
+	#Such a run may continue into the next lines, so we remember whether the previous line has ended inside of one.
+	isInsideEmptyLines = False
+	for line in lines:
+		if isInsideEmptyLines:
+			line = line[leadingEmptyLinesPattern.match(line).end():]
+			if line == "":
+				continue
+		#only the last line can end without a line break
+		isInsideEmptyLines = line.endswith("\n")
+		yield emptyLinesPattern.sub("\n", line)
 
-	#third pass: remove line continuations
-	remainder = stripped
-	output = ""
-	while True:
-		lineContinuationMatch = multiLineContinuationPattern.match(remainder)
-		if not lineContinuationMatch:
-			output += remainder
-			break
-		output += lineContinuationMatch.group(1) + " "
-		remainder = lineContinuationMatch.group(2)
+def joinContinuedLines(lines):
+	#third pass: remove line continuations.
+	#A continuation may reach into the following lines, so everything from the start of the last one found
+	#(or the whitespace a continuation could start with) is kept back until the next line is known.
+	pending = ""
+	for line in lines:
+		pending += line
+		joined = []
+		position = 0
+		holdBackPosition = None
+		for lineContinuationMatch in lineContinuationPattern.finditer(pending):
+			if lineContinuationMatch.end() == len(pending):
+				holdBackPosition = lineContinuationMatch.start()
+				break
+			joined.append(pending[position:lineContinuationMatch.start()])
+			joined.append(" ")
+			position = lineContinuationMatch.end()
+		if holdBackPosition == None:
+			holdBackPosition = trailingWhitespacePattern.search(pending, position).start()
+		joined.append(pending[position:holdBackPosition])
+		pending = pending[holdBackPosition:]
+		yield "".join(joined)
+	yield lineContinuationPattern.sub(" ", pending)
 
-	print output
+def stripFortranLineContinuations(lines):
+	return joinContinuedLines(stripEmptyLines(stripComments(lines)))
 
-setupDeferredLogging('preprocessor.log', logging.INFO)
-pre_sanitize_fortran()
\ No newline at end of file
+if __name__ == '__main__':
+	parser = OptionParser(usage="usage: %prog [options] [file] - reads the standard input without file")
+	addStageReportOptions(parser)
+	(options, args) = parser.parse_args()
+	setupDeferredLogging('preprocessor.log', logging.INFO)
+	stageReport = StageReport(options.stageReport, options.profile)
+	with stageReport:
+		fileInputObject = None
+		if len(args) > 0:
+			fileInputObject = fileinput.input(args[0])
+		else:
+			#without files, fileinput would read the ones named in sys.argv - including the options
+			fileInputObject = fileinput.input("-")
+		timer = stageReport.startStage("Stripping line continuations", file=args[0] if len(args) > 0 else "stdin")
+		for text in stripFortranLineContinuations(fileInputObject):
+			sys.stdout.write(text)
+		sys.stdout.write("\n")
+		stageReport.endStage(timer)
@@ -21,6 +21,7 @@
 from xml.dom.minidom import Document
 from tools.metadata import addCallers, addCallees, createOrGetFirstNodeWithName, getDomainDependantTemplatesAndEntries, getArguments
 from tools.commons import enum, prettyprint, UsageError
+from tools.callgraph import CallGraph
 import sys
 import logging
 
@@ -52,6 +53,43 @@ def getAnalysisForSymbol(symbolAnalysisByRoutineNameAndSymbolName, parentName, s
         return symbolAnalysisPerCallee[0]
     return None
 
+def getAnalysisContent(analysis):
+    return (
+        analysis.name,
+        analysis.symbolType,
+        analysis.sourceModule,
+        analysis.sourceSymbol,
+        tuple(sorted(analysis.aliasNamesByRoutineName.items())),
+        tuple(sorted(analysis.argumentIndexByRoutineName.items()))
+    )
+
+def getSymbolAnalysisDifferences(expectedAnalysisByRoutine, actualAnalysisByRoutine):
+    '''Compares two results of SymbolDependencyAnalyzer.getSymbolAnalysisByRoutine by content,
+    ignoring analyses that are listed multiple times for the same symbol.'''
+    def getUniqueContents(analysisList):
+        contents = []
+        for analysis in analysisList:
+            content = getAnalysisContent(analysis)
+            if not content in contents:
+                contents.append(content)
+        return contents
+
+    differences = []
+    for routineName in sorted(set(expectedAnalysisByRoutine.keys() + actualAnalysisByRoutine.keys())):
+        expectedAnalysisBySymbolName = expectedAnalysisByRoutine.get(routineName, {})
+        actualAnalysisBySymbolName = actualAnalysisByRoutine.get(routineName, {})
+        for symbolName in sorted(set(expectedAnalysisBySymbolName.keys() + actualAnalysisBySymbolName.keys())):
+            expectedContents = getUniqueContents(expectedAnalysisBySymbolName.get(symbolName, []))
+            actualContents = getUniqueContents(actualAnalysisBySymbolName.get(symbolName, []))
+            if expectedContents != actualContents:
+                differences.append("%s in %s: expected %s, got %s" %(
+                    symbolName,
+                    routineName,
+                    str(expectedContents),
+                    str(actualContents)
+                ))
+    return differences
+
 class SymbolAnalysis:
     def __init__(self):
         self.aliasNamesByRoutineName = {}
@@ -125,29 +163,22 @@ class SymbolDependencyAnalyzer:
     callsByCallerName = None
     callsByCalleeName = None
 
-    def __init__(self, doc):
-        def getCallIndexByAttribute(attributeName):
-            index = {}
-            for call in doc.getElementsByTagName("call"):
-                identifier = call.getAttribute(attributeName)
-                callList = index.get(identifier, [])
-                callList.append(call)
-                index[identifier] = callList
-            return index
-
-        routinesByName = {}
-        for routine in doc.getElementsByTagName("routine"):
-            routineName = routine.getAttribute("name")
-            if routineName in routinesByName:
-                raise UsageError("Duplicate subroutines found with name %s. Subroutines need to have unique names in Hybrid Fortran." %(routineName))
-            routinesByName[routineName] = routine
-
-        callsByCalleeName = getCallIndexByAttribute("callee")
-        callsByCallerName = getCallIndexByAttribute("caller")
+    def __init__(self, doc, callGraph=None, memoize=True):
+        if callGraph == None:
+            callGraph = CallGraph(doc)
+        if len(callGraph.duplicateRoutineNames) > 0:
+            raise UsageError("Duplicate subroutines found with name %s. Subroutines need to have unique names in Hybrid Fortran." %(callGraph.duplicateRoutineNames[0]))
+        routinesByName = callGraph.routineNodesByName
+        callsByCalleeName = callGraph.callNodesByCalleeName
+        callsByCallerName = callGraph.callNodesByCallerName
         callGraphEdgesByCallerName = {}
         callGraphEdgesByCalleeName = {}
+        visitedRoutineNames = set()
 
         def addCallees(routineName):
+            if routineName in visitedRoutineNames:
+                return
+            visitedRoutineNames.add(routineName)
             for call in callsByCallerName.get(routineName, []):
                 callerName = call.getAttribute("caller")
                 if callerName != routineName:
@@ -174,23 +205,51 @@ class SymbolDependencyAnalyzer:
         self.routinesByName = routinesByName
         self.callsByCalleeName = callsByCalleeName
         self.callsByCallerName = callsByCallerName
+        self.callGraph = callGraph
+        self.memoize = memoize
+        self.templatesAndEntriesByRoutineName = {}
         self.doc = doc
         self.symbolsNode = createOrGetFirstNodeWithName('symbols', doc)
 
-    def getSymbolAnalysisFor(self, routineName, symbolAnalysis=None, symbolAnalysisByNameAndSource=None, call=None, analysisWarningsByCalleeName=None):
+    def getDomainDependantTemplatesAndEntries(self, routineName, routine):
+        templatesAndEntries = self.templatesAndEntriesByRoutineName.get(routineName)
+        if templatesAndEntries == None:
+            templatesAndEntries = getDomainDependantTemplatesAndEntries(self.doc, routine)
+            self.templatesAndEntriesByRoutineName[routineName] = templatesAndEntries
+        return templatesAndEntries
+
+    def getSymbolAnalysisFor(
+        self,
+        routineName,
+        symbolAnalysis=None,
+        symbolAnalysisByNameAndSource=None,
+        call=None,
+        analysisWarningsByCalleeName=None,
+        visitedArgumentBindings=None,
+        localAnalysisByRoutineAndSymbolName=None
+    ):
+        '''In memoized mode, a routine is only analysed once for every distinct combination of caller analyses
+        bound to its arguments (and local analyses are reused between visits) - visiting it again would only
+        repeat the same alias updates downstream. The exhaustive mode walks every path through the callgraph.
+        Both modes lead to the same analyses, except that the memoized mode doesn't list the same analysis
+        multiple times for one symbol.'''
         if symbolAnalysis == None:
             symbolAnalysis = {}
         if symbolAnalysisByNameAndSource == None:
             symbolAnalysisByNameAndSource = {}
         if analysisWarningsByCalleeName == None:
             analysisWarningsByCalleeName = {}
+        if visitedArgumentBindings == None:
+            visitedArgumentBindings = set()
+        if localAnalysisByRoutineAndSymbolName == None:
+            localAnalysisByRoutineAndSymbolName = {}
         routine = self.routinesByName.get(routineName)
         if not routine:
             return symbolAnalysis, symbolAnalysisByNameAndSource
-        routineArguments = getArguments(routine)
+        routineArguments = self.callGraph.getArguments(routine)
         callArguments = []
         if call != None:
-            callArguments = getArguments(call)
+            callArguments = self.callGraph.getArguments(call)
             if call.getAttribute("callee") != routineName:
                 raise Exception("call passed to analysis of %s is not a call to this routine: %s" %(
                     routineName,
@@ -201,11 +260,17 @@ class SymbolDependencyAnalyzer:
                 warnings.append((call.getAttribute("caller"), len(callArguments), len(routineArguments), str(callArguments)))
                 analysisWarningsByCalleeName[routineName] = warnings
                 return symbolAnalysis, symbolAnalysisByNameAndSource
+        if self.memoize:
+            callerName = call.getAttribute("caller") if call != None else None
+            argumentBinding = (routineName, tuple(
+                tuple(symbolAnalysis.get((callerName, callArgument), []))
+                for callArgument in callArguments
+            ))
+            if argumentBinding in visitedArgumentBindings:
+                return symbolAnalysis, symbolAnalysisByNameAndSource
+            visitedArgumentBindings.add(argumentBinding)
 
-        templates_and_entries = getDomainDependantTemplatesAndEntries(
-            self.doc,
-            routine
-        )
+        templates_and_entries = self.getDomainDependantTemplatesAndEntries(routineName, routine)
         analysisToAdd = {}
 
         #check arguments to this routine - temporarily remove previous calls from the analysis.
@@ -220,6 +285,10 @@ class SymbolDependencyAnalyzer:
 
         #Symbol Analysis based on local information
         for (_, entry) in templates_and_entries:
+            if self.memoize and (routineName, entry.firstChild.nodeValue) in localAnalysisByRoutineAndSymbolName:
+                analysis = localAnalysisByRoutineAndSymbolName[(routineName, entry.firstChild.nodeValue)]
+                analysisToAdd[analysis.name] = analysis
+                continue
             analysis = SymbolAnalysis()
             analysis.name = entry.firstChild.nodeValue
             analysis.sourceModule = entry.getAttribute("sourceModule")
@@ -238,6 +307,8 @@ class SymbolDependencyAnalyzer:
                 analysis.symbolType = SymbolType.MODULE_DATA_WITH_DOMAIN_DEPENDANT_SPEC
             else:
                 analysis.symbolType = SymbolType.DOMAIN_DEPENDANT
+            if self.memoize and argIndex < 0:
+                localAnalysisByRoutineAndSymbolName[(routineName, analysis.name)] = analysis
             analysisToAdd[analysis.name] = analysis
         for argIndex, argument in enumerate(routineArguments):
             if argument in analysisToAdd:
@@ -294,10 +365,19 @@ class SymbolDependencyAnalyzer:
                 symbolAnalysis=symbolAnalysis,
                 symbolAnalysisByNameAndSource=symbolAnalysisByNameAndSource,
                 call=call,
-                analysisWarningsByCalleeName=analysisWarningsByCalleeName
+                analysisWarningsByCalleeName=analysisWarningsByCalleeName,
+                visitedArgumentBindings=visitedArgumentBindings,
+                localAnalysisByRoutineAndSymbolName=localAnalysisByRoutineAndSymbolName
             )
         for argumentName in temporarilyStoredAnalysisByArgumentName.keys():
-            symbolAnalysis[(routineName, argumentName)] = temporarilyStoredAnalysisByArgumentName[argumentName] + symbolAnalysis.get((routineName, argumentName), [])
+            storedAnalysis = temporarilyStoredAnalysisByArgumentName[argumentName]
+            currentAnalysis = symbolAnalysis.get((routineName, argumentName), [])
+            if self.memoize:
+                currentAnalysis = [
+                    analysis for analysis in currentAnalysis
+                    if not any(analysis is previousAnalysis for previousAnalysis in storedAnalysis)
+                ]
+            symbolAnalysis[(routineName, argumentName)] = storedAnalysis + currentAnalysis
 
         return symbolAnalysis, symbolAnalysisByNameAndSource
 
@@ -344,6 +424,13 @@ class SymbolDependencyAnalyzer:
                 symbolAnalysisByRoutine[routineName] = {symbolName:symbolAnalysis[(routineName, symbolName)]}
         return symbolAnalysisByRoutine
 
+    def getDifferencesToExhaustiveAnalysis(self, symbolAnalysisByRoutine, startingFromRoutine=None):
+        exhaustiveAnalyzer = SymbolDependencyAnalyzer(self.doc, self.callGraph, memoize=False)
+        return getSymbolAnalysisDifferences(
+            exhaustiveAnalyzer.getSymbolAnalysisByRoutine(startingFromRoutine),
+            symbolAnalysisByRoutine
+        )
+
     def getAliasNamesByRoutineName(self, symbolName, routineName):
         aliasNamesByRoutineName = {routineName:symbolName}
 
@@ -0,0 +1,279 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+import os, errno, hashlib, json, shutil, tempfile, logging
+from xml.dom.minidom import Node
+from tools.filesystem import dirEntries, writeIfChanged
+from tools.patterns import RegExPatterns
+
+def getGeneratorFingerprint():
+    '''hash over the preprocessor sources themselves - a new Hybrid Fortran version invalidates all cache entries'''
+    hfDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fingerprint = hashlib.sha1()
+    for path in sorted(dirEntries(hfDir, True, 'py')):
+        fingerprint.update(os.path.relpath(path, hfDir))
+        with open(path, 'rb') as sourceFile:
+            fingerprint.update(sourceFile.read())
+    return fingerprint.hexdigest()
+
+def getReferencedModuleNames(sourceText):
+    '''names of all modules that are defined or imported in a h90 source text'''
+    patterns = RegExPatterns.Instance()
+    moduleNames = set()
+    for line in sourceText.splitlines():
+        for pattern in [patterns.moduleBeginPattern, patterns.importPattern, patterns.importAllPattern]:
+            match = pattern.match(line)
+            if match and match.group(1) not in [None, '']:
+                moduleNames.add(match.group(1).lower())
+                break
+    return moduleNames
+
+def getCanonicalNodeText(node, templatesByID):
+    '''Serializes a callgraph node such that it only changes if its content changes:
+    Attributes are sorted and template relations are replaced by the template they refer to,
+    since template IDs are regenerated on every callgraph build.'''
+    if node.nodeType == Node.TEXT_NODE:
+        return node.nodeValue.strip()
+    if node.nodeType != Node.ELEMENT_NODE:
+        return ""
+    attributeTexts = []
+    for attributeName, attributeValue in sorted(node.attributes.items()):
+        if attributeName == "id" and attributeValue in templatesByID:
+            attributeValue = getCanonicalNodeText(templatesByID[attributeValue], {})
+        elif attributeName == "id":
+            continue
+        attributeTexts.append("%s=%s" %(attributeName, attributeValue))
+    return "<%s %s>%s</%s>" %(
+        node.tagName,
+        " ".join(attributeTexts),
+        "".join(getCanonicalNodeText(child, templatesByID) for child in node.childNodes),
+        node.tagName
+    )
+
+class CallGraphSlicer(object):
+    '''Extracts the part of an analyzed callgraph that the conversion of one source file depends on:
+    Its routines and their direct callers and callees (including the symbol analysis for these),
+    the calls between them, as well as all modules the source defines or imports.'''
+
+    def __init__(self, cgDoc, symbolAnalysisByRoutineNameAndSymbolName):
+        self.symbolAnalysisByRoutineNameAndSymbolName = symbolAnalysisByRoutineNameAndSymbolName
+        self.templatesByID = {}
+        for templateParentName, templateName in [
+            ("implementationTemplates", "implementationTemplate"),
+            ("parallelRegionTemplates", "parallelRegionTemplate"),
+            ("domainDependantTemplates", "domainDependantTemplate")
+        ]:
+            for templateParent in cgDoc.getElementsByTagName(templateParentName):
+                for template in templateParent.getElementsByTagName(templateName):
+                    self.templatesByID[template.getAttribute("id")] = template
+        self.routineNodesByName = {}
+        self.routineNamesBySourceName = {}
+        for routine in cgDoc.getElementsByTagName("routine"):
+            routineName = routine.getAttribute("name")
+            self.routineNodesByName[routineName] = routine
+            self.routineNamesBySourceName.setdefault(routine.getAttribute("source"), []).append(routineName)
+        self.callNodesByRoutineName = {}
+        for call in cgDoc.getElementsByTagName("call"):
+            self.callNodesByRoutineName.setdefault(call.getAttribute("caller"), []).append(call)
+            self.callNodesByRoutineName.setdefault(call.getAttribute("callee"), []).append(call)
+        self.moduleNodesByName = {}
+        for module in cgDoc.getElementsByTagName("module"):
+            self.moduleNodesByName[module.getAttribute("name").lower()] = module
+
+    def getSliceComponents(self, sourceName, moduleNames):
+        '''returns the slice as a list of (dependency name, canonical text) tuples'''
+        routineNames = set(self.routineNamesBySourceName.get(sourceName, []))
+        callComponents = set()
+        for routineName in list(routineNames):
+            for call in self.callNodesByRoutineName.get(routineName, []):
+                callComponents.add((
+                    getCanonicalNodeText(call, self.templatesByID),
+                    "call:%s->%s" %(call.getAttribute("caller"), call.getAttribute("callee"))
+                ))
+                routineNames.add(call.getAttribute("caller"))
+                routineNames.add(call.getAttribute("callee"))
+        sliceComponents = [(dependencyName, text) for (text, dependencyName) in sorted(callComponents)]
+        for routineName in sorted(routineNames):
+            routine = self.routineNodesByName.get(routineName)
+            if routine == None:
+                continue #external routine
+            sliceComponents.append(("routine:%s" %(routineName), getCanonicalNodeText(routine, self.templatesByID)))
+            symbolAnalysisBySymbolName = self.symbolAnalysisByRoutineNameAndSymbolName.get(routineName, {})
+            for symbolName in sorted(symbolAnalysisBySymbolName.keys()):
+                for analysis in symbolAnalysisBySymbolName[symbolName]:
+                    sliceComponents.append(("symbolAnalysis:%s" %(routineName), "%s:%s:%s:%s:%s:%s" %(
+                        routineName,
+                        symbolName,
+                        analysis.symbolType,
+                        analysis.sourceModule,
+                        analysis.sourceSymbol,
+                        json.dumps([analysis.aliasNamesByRoutineName, analysis.argumentIndexByRoutineName], sort_keys=True)
+                    )))
+        for moduleName in sorted(moduleNames):
+            module = self.moduleNodesByName.get(moduleName)
+            if module == None:
+                continue #not a Hybrid Fortran module
+            sliceComponents.append(("module:%s" %(moduleName), getCanonicalNodeText(module, self.templatesByID)))
+        return sliceComponents
+
+    def sliceFor(self, sourceName, moduleNames):
+        return "\n".join(text for (_, text) in self.getSliceComponents(sourceName, moduleNames))
+
+class ConversionCache(object):
+    '''Content addressed store for converted files. Entries are evicted least recently used first
+    once the cache exceeds its size limit - a cache hit refreshes the entry's modification time.'''
+
+    def __init__(self, cacheDir, maxSizeInBytes=None):
+        self.cacheDir = cacheDir
+        self.maxSizeInBytes = maxSizeInBytes
+        self.generatorFingerprint = getGeneratorFingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.unchangedOutputs = 0
+        self.evictions = 0
+        try:
+            os.makedirs(cacheDir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+    def keyForComponents(self, components):
+        key = hashlib.sha1()
+        for component in [self.generatorFingerprint] + components:
+            if isinstance(component, unicode):
+                component = component.encode('utf-8')
+            key.update("%i:" %(len(component)))
+            key.update(component)
+        return key.hexdigest()
+
+    def keyForFile(self, path, callGraphSlicer, implementationNamesByTemplateName, optionFlags):
+        with open(path, 'rb') as sourceFile:
+            sourceText = sourceFile.read()
+        sourceName = os.path.basename(path).split('.')[0]
+        return self.keyForComponents([
+            os.path.basename(path),
+            sourceText,
+            json.dumps(implementationNamesByTemplateName, sort_keys=True),
+            ",".join(sorted(optionFlags)),
+            callGraphSlicer.sliceFor(sourceName, getReferencedModuleNames(sourceText))
+        ])
+
+    def keyForPartialCallGraph(self, path):
+        '''the callgraph generated from a single file only depends on the file's name and content'''
+        with open(path, 'rb') as sourceFile:
+            sourceText = sourceFile.read()
+        return self.keyForComponents(["partialCallGraph", os.path.basename(path), sourceText])
+
+    def entryPath(self, key):
+        return os.path.join(self.cacheDir, key[:2], key)
+
+    def fetch(self, key, outputPath, onlyIfChanged=False):
+        '''copies the cached output to outputPath - with onlyIfChanged, an output with the same content is left untouched'''
+        entryPath = self.entryPath(key)
+        try:
+            if onlyIfChanged:
+                with open(entryPath, 'rb') as entryFile:
+                    if not writeIfChanged(outputPath, entryFile.read()):
+                        self.unchangedOutputs += 1
+            else:
+                shutil.copyfile(entryPath, outputPath)
+            os.utime(entryPath, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def load(self, key):
+        '''returns the cached data, or None if there is no entry for key'''
+        entryPath = self.entryPath(key)
+        try:
+            with open(entryPath, 'rb') as entryFile:
+                data = entryFile.read()
+            os.utime(entryPath, None)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def storeEntry(self, key, description, writeEntry):
+        entryPath = self.entryPath(key)
+        try:
+            try:
+                os.mkdir(os.path.dirname(entryPath))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise e
+            #write to a temporary file first - parallel preprocessor runs may share the cache
+            temporaryFile, temporaryPath = tempfile.mkstemp(dir=os.path.dirname(entryPath))
+            os.close(temporaryFile)
+            writeEntry(temporaryPath)
+            os.rename(temporaryPath, entryPath)
+        except (IOError, OSError) as e:
+            logging.warning("Could not store %s in conversion cache: %s" %(description, str(e)))
+
+    def store(self, key, outputPath):
+        self.storeEntry(key, outputPath, lambda temporaryPath: shutil.copyfile(outputPath, temporaryPath))
+
+    def storeData(self, key, data, description):
+        def writeData(temporaryPath):
+            with open(temporaryPath, 'wb') as entryFile:
+                entryFile.write(data)
+        self.storeEntry(key, description, writeData)
+
+    def entries(self):
+        entries = []
+        for path in dirEntries(self.cacheDir, True):
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        return entries
+
+    def evict(self):
+        if self.maxSizeInBytes == None:
+            return
+        entries = sorted(self.entries())
+        totalSize = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if totalSize <= self.maxSizeInBytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            totalSize -= size
+            self.evictions += 1
+
+    def printStatistics(self, stream):
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        stream.write("Conversion cache %s: %i hits, %i misses (%.1f%% hit rate), %i evicted; %i entries, %.1f MB%s\n" %(
+            self.cacheDir,
+            self.hits,
+            self.misses,
+            self.hits * 100.0 / lookups if lookups > 0 else 0.0,
+            self.evictions,
+            len(entries),
+            sum(size for _, size, _ in entries) / (1024.0 * 1024.0),
+            " of %.1f MB" %(self.maxSizeInBytes / (1024.0 * 1024.0)) if self.maxSizeInBytes != None else ""
+        ))
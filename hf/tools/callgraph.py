@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+from tools.metadata import regionTemplatesByID, getArguments
+
+class CallGraph(object):
+    '''Index over a callgraph document, built in one pass over its routines, calls and modules.
+    The DOM nodes stay the storage for all information - this only replaces the repeated document queries.
+    Routines, calls, modules and parallel region relations are not changed by the symbol passes,
+    so one index can be used for the whole preprocessing of a codebase. Domain dependant entries on the other hand
+    are added during symbol parsing and are therefore not part of the index.'''
+
+    def __init__(self, cgDoc):
+        self.doc = cgDoc
+        self.routineNodesByName = {}
+        self.routineNodesByModuleName = {}
+        self.routineNodesBySourceName = {}
+        self.duplicateRoutineNames = []
+        self.callNodesByCallerName = {}
+        self.callNodesByCalleeName = {}
+        self.moduleNodesByName = {}
+        self.parallelRegionTemplateRelationsByRoutineName = {}
+        self.parallelRegionTemplatesByRoutineName = {}
+        self.argumentNamesByNode = {}
+
+        for module in cgDoc.getElementsByTagName('module'):
+            moduleName = module.getAttribute('name')
+            if not moduleName or moduleName == '':
+                raise Exception("Module without name.")
+            self.moduleNodesByName[moduleName] = module
+
+        for call in cgDoc.getElementsByTagName('call'):
+            self.callNodesByCallerName.setdefault(call.getAttribute('caller'), []).append(call)
+            self.callNodesByCalleeName.setdefault(call.getAttribute('callee'), []).append(call)
+
+        regionsByID = regionTemplatesByID(cgDoc, 'parallelRegionTemplate')
+        for routine in cgDoc.getElementsByTagName('routine'):
+            routineName = routine.getAttribute('name')
+            if routineName in [None, '']:
+                raise Exception("Procedure without name.")
+            if routineName in self.routineNodesByName:
+                self.duplicateRoutineNames.append(routineName)
+            self.routineNodesByName[routineName] = routine
+            moduleName = routine.getAttribute('module')
+            if moduleName not in [None, '']:
+                self.routineNodesByModuleName.setdefault(moduleName, []).append(routine)
+            self.routineNodesBySourceName.setdefault(routine.getAttribute('source'), []).append(routine)
+            parallelRegionsParents = routine.getElementsByTagName('activeParallelRegions')
+            if not parallelRegionsParents or len(parallelRegionsParents) == 0:
+                continue
+            regionTemplates = []
+            templateRelations = parallelRegionsParents[0].getElementsByTagName('templateRelation')
+            for templateRelation in templateRelations:
+                idStr = templateRelation.getAttribute('id')
+                if not idStr or idStr == '':
+                    raise Exception("Template relation without id attribute.")
+                regionTemplate = regionsByID.get(idStr, None)
+                if not regionTemplate:
+                    raise Exception("Template relation id %s could not be matched in procedure '%s'" %(idStr, routineName))
+                regionTemplates.append(regionTemplate)
+            if len(templateRelations) > 0:
+                self.parallelRegionTemplateRelationsByRoutineName[routineName] = templateRelations
+            if len(regionTemplates) > 0:
+                self.parallelRegionTemplatesByRoutineName[routineName] = regionTemplates
+
+    @property
+    def parallelRegionData(self):
+        #same layout as returned by machinery.parser.getParallelRegionData
+        return (
+            self.parallelRegionTemplateRelationsByRoutineName,
+            self.parallelRegionTemplatesByRoutineName,
+            self.routineNodesByName,
+            self.routineNodesByModuleName
+        )
+
+    @property
+    def rootRoutineNodes(self):
+        return [
+            routine
+            for routineName, routine in self.routineNodesByName.items()
+            if len(self.callNodesByCalleeName.get(routineName, [])) == 0
+        ]
+
+    def getArguments(self, routineOrCallNode):
+        argumentNames = self.argumentNamesByNode.get(routineOrCallNode)
+        if argumentNames == None:
+            argumentNames = getArguments(routineOrCallNode)
+            self.argumentNamesByNode[routineOrCallNode] = argumentNames
+        return argumentNames
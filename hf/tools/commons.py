@@ -18,8 +18,9 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
-import os, sys, re, logging, logging.handlers, atexit, traceback
+import os, sys, re, bisect, logging, logging.handlers, atexit, traceback
 from UserDict import DictMixin
+from tools.tokenizer import iterateTokens, tokenize, getArgumentsInOpenedBracketsAndRemainder
 
 class OrderedDict(dict, DictMixin):
 
@@ -291,6 +292,24 @@ def areIndexesWithinQuotes(stringToSearch):
             raise Exception("Index at the end of quotes search is %i. Expected: %i" %(index, len(stringToSearch)))
     return isStringIndexWithinQuote
 
+class QuoteMask(object):
+    '''Tells whether an index of a string is within quotes, with the same rules as areIndexesWithinQuotes.
+    It is built once per string and also answers the question for every suffix of the string (as if areIndexesWithinQuotes
+    had been called on that suffix), so a line can be processed piece by piece without rebuilding the mask.'''
+
+    def __init__(self, string):
+        self.quotePositions = [quoteMatch.start() for quoteMatch in re.finditer(r'''['"]''', string)]
+
+    def isIndexWithinQuotes(self, index, suffixStart=0):
+        #index is relative to the start of the string, not the suffix
+        firstQuote = bisect.bisect_left(self.quotePositions, suffixStart)
+        if (len(self.quotePositions) - firstQuote) % 2 != 0:
+            return False #unbalanced quotes -> areIndexesWithinQuotes treats everything as unquoted
+        quotesBefore = bisect.bisect_left(self.quotePositions, index)
+        if quotesBefore < len(self.quotePositions) and self.quotePositions[quotesBefore] == index:
+            return True
+        return (quotesBefore - firstQuote) % 2 != 0
+
 def findRightMostOccurrenceNotInsideQuotes(stringToMatch, stringToSearch, rightStartAt=-1):
     indexesWithinQuotes = areIndexesWithinQuotes(stringToSearch)
     if rightStartAt > 0:
@@ -350,44 +369,44 @@ def splitTextAtLeftMostOccurrence(matchStrings, text):
         suffix = text[matchIndex + len(matchString):]
     return prefix, matchString, suffix
 
-def splitIntoComponentsAndRemainder(string):
-    if string.strip() == "":
+#characters that can be part of a component, see splitIntoComponentsAndRemainder
+componentCharacters = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_,:+-*/()")
+
+def splitIntoComponentsAndRemainder(text):
+    '''Splits off the comma separated components at the beginning of text, e.g. 'a, b(n, m) :: c' -> (['a', 'b(n, m)'], ':: c').
+    The last component ends before the first character on bracket level zero that cannot be part of a component
+    (e.g. a blank, unless it is followed by an opening bracket).'''
+    if text.strip() == "":
         return [], ""
-    analyzer = BracketAnalyzer()
-    splitted = string.split(',')
-    currComponent = ""
     components = []
-    for index, part in enumerate(splitted):
-        currComponent += part
-        if analyzer.currLevelAfterString(part) == 0:
-            components.append(currComponent.strip())
-            currComponent = ""
-            continue
-        if index < len(splitted) - 1:
-            currComponent += ','
-    remainder = currComponent
+    componentStart = 0
+    level = 0
+    for tokenType, _, start, level in iterateTokens(text):
+        if level < 0:
+            raise Exception("Closing bracket before opening one.")
+        if tokenType == 'comma' and level == 0:
+            components.append(text[componentStart:start].strip())
+            componentStart = start + 1
+    remainder = ""
+    if level == 0:
+        components.append(text[componentStart:].strip())
+    else:
+        remainder = text[componentStart:]
     if len(components) > 0:
-        separated = re.split(r'([^\w\,\:\+\-\*\/\(\)])', components[-1])
-        analyzer = BracketAnalyzer()
-        lastComponent = ""
-        for index, part in enumerate(separated):
-            lastComponent += part
-            lookAheadCharacter = None
-            if index < len(separated) - 1:
-                for lookAheadIndex in range(index + 1, len(separated)):
-                    nextPart = separated[lookAheadIndex].strip()
-                    if len(nextPart) > 0:
-                        lookAheadCharacter = nextPart[0]
-                        break
-            bracketLevelAfterPart = analyzer.currLevelAfterString(part)
-            if lookAheadCharacter != '(' \
-            and bracketLevelAfterPart == 0:
-                components[-1] = lastComponent.strip()
-                if len(separated) > index + 1:
-                    remainder = ''.join(separated[index + 1:])
-                else:
-                    remainder = ""
-                break
+        lastComponent = components[-1]
+        lastComponentTokens = tokenize(lastComponent)
+        componentEnd = len(lastComponent)
+        for tokenIndex, (tokenType, tokenText, start, level) in enumerate(lastComponentTokens):
+            if level != 0 or tokenText[0] in componentCharacters:
+                continue
+            if tokenType == 'whitespace' \
+            and tokenIndex + 1 < len(lastComponentTokens) \
+            and lastComponentTokens[tokenIndex + 1][0] == 'openingBracket':
+                continue
+            componentEnd = start
+            break
+        components[-1] = lastComponent[:componentEnd].strip()
+        remainder = lastComponent[componentEnd:]
     return components, remainder.strip()
 
 def getComponentNameAndBracketContent(component):
@@ -446,82 +465,36 @@ class BracketAnalyzer(object):
     openingChar = ""
     closingChar = ""
 
+    patternsByDelimiters = {}
+
     def __init__(self, openingChar="(", closingChar=")", pass_in_regex_pattern=False):
         self.currLevel = 0
         self.bracketsHaveEverOpened = False
         self.openingChar = openingChar
         self.closingChar = closingChar
-        if pass_in_regex_pattern:
-            self.searchPattern = re.compile(r"(.*?)(" + openingChar + r"|" + closingChar + r")(.*)", re.IGNORECASE)
-            self.openingPattern = re.compile(openingChar, re.IGNORECASE)
-            self.closingPattern = re.compile(closingChar, re.IGNORECASE)
-        else:
-            self.searchPattern = re.compile(r"(.*?)(" + re.escape(openingChar) + r"|" + re.escape(closingChar) + r")(.*)", re.IGNORECASE)
-            self.openingPattern = re.compile(re.escape(openingChar), re.IGNORECASE)
-            self.closingPattern = re.compile(re.escape(closingChar), re.IGNORECASE)
+        #analyzers are created for almost every statement - only compile the patterns once per kind of bracket
+        delimiters = (openingChar, closingChar, pass_in_regex_pattern)
+        patterns = BracketAnalyzer.patternsByDelimiters.get(delimiters)
+        if patterns == None:
+            if not pass_in_regex_pattern:
+                openingChar = re.escape(openingChar)
+                closingChar = re.escape(closingChar)
+            patterns = (
+                re.compile(r"(.*?)(" + openingChar + r"|" + closingChar + r")(.*)", re.IGNORECASE),
+                re.compile(openingChar, re.IGNORECASE),
+                re.compile(closingChar, re.IGNORECASE)
+            )
+            BracketAnalyzer.patternsByDelimiters[delimiters] = patterns
+        self.searchPattern, self.openingPattern, self.closingPattern = patterns
 
     @property
     def level(self):
         return self.currLevel
 
-    def splitAfterCharacterOnSameLevelOrClosingBrackets(self, string, char):
-        charSearchPattern = re.compile(r"(.*?)(" + re.escape(char) + r"|" + re.escape(self.openingChar) + r"|" + re.escape(self.closingChar) + r")(.*)", re.IGNORECASE)
-        charPattern = re.compile(re.escape(char), re.IGNORECASE)
-        work = string
-        match = charSearchPattern.match(work)
-        if not match:
-            return "", string, self.currLevel
-
-        startLevel = self.currLevel
-        substring = ""
-        while match:
-            work = match.group(3)
-            substring += match.group(1) + match.group(2)
-            previousLevel = self.currLevel
-            if charPattern.match(match.group(2)) != None and self.bracketsHaveEverOpened == False:
-                return substring, work, self.currLevel
-            elif self.openingPattern.match(match.group(2)) != None:
-                self.bracketsHaveEverOpened = True
-                self.currLevel += 1
-            elif self.closingPattern.match(match.group(2)) != None:
-                self.currLevel -= 1
-            elif charPattern.match(match.group(2)) == None:
-                raise Exception("Something went wrong in the bracket analysis for string %s - cannot rematch a search character" %(string))
-            match = charSearchPattern.match(work)
-            if self.currLevel < startLevel or (self.currLevel == startLevel and self.currLevel == previousLevel):
-                break
-        if self.currLevel <= startLevel:
-            return substring, work, self.currLevel
-        return "", string, self.currLevel
-
     def getListOfArgumentsInOpenedBracketsAndRemainder(self, string_without_opening_bracket):
-        self.currLevel = 1 #we pass a string where the opening bracket has been removed <-- need to fix level here so it doesn't prematurely split off arguments
         self.bracketsHaveEverOpened = True
-        work = string_without_opening_bracket
-        arguments = []
-        bracketLevel = 0
-        while len(work) > 0 and self.currLevel > 0:
-            currArgument, work, bracketLevel = self.splitAfterCharacterOnSameLevelOrClosingBrackets(work, ',')
-            if bracketLevel > 1 or bracketLevel < 0:
-                raise Exception("Something went wrong when trying to split arguments from '%s'" %(work))
-            self.currLevel = bracketLevel
-            work = work.strip()
-            currArgument = currArgument.strip()
-            if bracketLevel == 1 and len(work) > 0 and work[0] == ',':
-                work = work[1:len(work)]
-            if len(currArgument) > 0 and currArgument[-1] == ',' or len(currArgument) > 0 and currArgument[-1] == ')' and bracketLevel < 1:
-                currArgument = currArgument[0:len(currArgument)-1]
-            if currArgument == "" and bracketLevel == 0:
-                break
-            if currArgument == "":
-                raise Exception("Invalid empty argument. Analyzed string: %s; Bracket Level: %i; Arguments so far: %s; Remainder: %s" %(
-                    string_without_opening_bracket,
-                    bracketLevel,
-                    str(arguments),
-                    work
-                ))
-            arguments.append(currArgument.strip())
-        return arguments, work
+        self.currLevel = 0
+        return getArgumentsInOpenedBracketsAndRemainder(string_without_opening_bracket)
 
     #in case the brackets are not closed, the reminder will be an empty string
     #if this happens, this method may be called again, using the same bracket analyzer, with the continued string.
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#Protocol between preprocessorClient.py and preprocessorDaemon.py:
+#The client sends a JSON request line (script, arguments, working directory, the environment variables listed in
+#requestEnvironmentNames and whether stdin follows), followed by its stdin if requested, and shuts down its sending side.
+#The daemon answers with frames of one channel byte and the payload length - stdout and stderr output, and finally the exit code.
+#The socket lives in a directory only accessible to its user, and both sides check that the other one runs as the same user.
+#This module is imported by the client, so it must not import any of the heavier preprocessor modules.
+
+import os, sys, stat, errno, socket, struct, hashlib, tempfile
+
+frameHeader = struct.Struct("!cI")
+stdoutChannel = "o"
+stderrChannel = "e"
+exitChannel = "x"
+
+#the preprocessor scripts don't read environment variables themselves - the tempfile module does
+requestEnvironmentNames = ["TMPDIR", "TEMP", "TMP"]
+
+#Python 2 doesn't export SO_PEERCRED - the value is the one of Linux, other platforms rely on the socket directory alone
+peerCredentialsOption = getattr(socket, "SO_PEERCRED", 17 if sys.platform.startswith("linux") else None)
+#struct ucred: pid, uid, gid
+peerCredentials = struct.Struct("3i")
+
+class SocketAccessError(Exception):
+    pass
+
+def getSocketDirectory():
+    runtimeDirectory = os.environ.get("XDG_RUNTIME_DIR")
+    if runtimeDirectory:
+        return os.path.join(runtimeDirectory, "hf_preprocessor")
+    return os.path.join(tempfile.gettempdir(), "hf_preprocessor_%i" %(os.getuid()))
+
+def getDefaultSocketPath():
+    '''one daemon per user and Hybrid Fortran installation'''
+    socketPath = os.environ.get("HF_PREPROCESSOR_SOCKET")
+    if socketPath:
+        return socketPath
+    hfDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(getSocketDirectory(), "%s.sock" %(hashlib.sha1(hfDir).hexdigest()[:8]))
+
+def ensurePrivateSocketDirectory(socketPath):
+    '''creates the directory of socketPath with mode 0700 if necessary and makes sure that only the current user can access it -
+    otherwise other users could replace the socket with their own'''
+    directory = os.path.dirname(os.path.abspath(socketPath))
+    try:
+        os.mkdir(directory, 0700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise SocketAccessError("cannot create socket directory %s: %s" %(directory, str(e)))
+    directoryStatus = os.lstat(directory)
+    if not stat.S_ISDIR(directoryStatus.st_mode):
+        raise SocketAccessError("socket directory %s is not a directory" %(directory))
+    if directoryStatus.st_uid != os.getuid():
+        raise SocketAccessError("socket directory %s is owned by uid %i" %(directory, directoryStatus.st_uid))
+    if directoryStatus.st_mode & 0077:
+        raise SocketAccessError("socket directory %s is accessible to other users (mode %o)" %(
+            directory,
+            stat.S_IMODE(directoryStatus.st_mode)
+        ))
+
+def getPeerUID(connection):
+    '''uid of the process at the other end of a Unix socket connection - None where the platform doesn't tell'''
+    if peerCredentialsOption == None:
+        return None
+    _, uid, _ = peerCredentials.unpack(connection.getsockopt(socket.SOL_SOCKET, peerCredentialsOption, peerCredentials.size))
+    return uid
+
+def isSameUserPeer(connection):
+    peerUID = getPeerUID(connection)
+    return peerUID == None or peerUID == os.getuid()
+
+def getRequestEnvironment():
+    return dict(
+        (name, os.environ[name])
+        for name in requestEnvironmentNames
+        if name in os.environ
+    )
+
+def sendFrame(connection, channel, payload):
+    if isinstance(payload, unicode):
+        payload = payload.encode('utf-8')
+    #one call per frame - pool workers of a request may write to the same connection
+    connection.sendall(frameHeader.pack(channel, len(payload)) + payload)
+
+def receiveExactly(connection, length):
+    chunks = []
+    while length > 0:
+        chunk = connection.recv(min(length, 65536))
+        if not chunk:
+            raise EOFError("connection closed")
+        chunks.append(chunk)
+        length -= len(chunk)
+    return "".join(chunks)
+
+def receiveFrame(connection):
+    '''returns (channel, payload)'''
+    channel, length = frameHeader.unpack(receiveExactly(connection, frameHeader.size))
+    return channel, receiveExactly(connection, length)
+
+def receiveLine(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(1)
+        if not chunk:
+            raise EOFError("connection closed")
+        if chunk == "\n":
+            return "".join(chunks)
+        chunks.append(chunk)
+
+def receiveAll(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            return "".join(chunks)
+        chunks.append(chunk)
+
+class FrameWriter(object):
+    '''file-like object that sends everything written to it as frames of one channel.
+    Processes forked off while output is buffered (e.g. pool workers) drop the inherited buffer, such that it is only sent once.'''
+
+    def __init__(self, connection, channel, bufferSize=0):
+        self.connection = connection
+        self.channel = channel
+        self.bufferSize = bufferSize
+        self.softspace = 0
+        self._buffer = []
+        self._bufferedLength = 0
+        self._pid = os.getpid()
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        if os.getpid() != self._pid:
+            self._buffer = []
+            self._bufferedLength = 0
+            self._pid = os.getpid()
+        self._buffer.append(text)
+        self._bufferedLength += len(text)
+        if self._bufferedLength > self.bufferSize:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._bufferedLength == 0 or os.getpid() != self._pid:
+            return
+        payload = "".join(self._buffer)
+        self._buffer = []
+        self._bufferedLength = 0
+        sendFrame(self.connection, self.channel, payload)
+
+    def isatty(self):
+        return False
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+import os, hashlib, json, tempfile, logging
+from tools.cache import getReferencedModuleNames
+from tools.commons import UsageError
+
+def getFingerprint(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+def getOutputState(outputPath):
+    '''size and modification time of an output - an output that has been changed or truncated since its conversion
+    (e.g. by a shell redirection) needs to be converted again'''
+    outputStatus = os.stat(outputPath)
+    return {"size": outputStatus.st_size, "mtime": outputStatus.st_mtime}
+
+class ConversionDependencyGraph(object):
+    '''Persistent record of the callgraph information every converted file has been generated from:
+    The h90 source, the routines of the source together with their direct callers and callees, the calls between them,
+    the symbol analysis of these routines, the modules the source defines or imports, as well as the implementation,
+    option flags and the preprocessor version. Each of these dependencies is stored with a fingerprint, such that
+    after a change only the files whose dependencies differ are converted again - and we can tell why.
+    The size and modification time of every output are recorded as well, such that outputs changed by anything else are converted again.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.conversionsByOutputName = {}
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as dependencyFile:
+                self.conversionsByOutputName = json.load(dependencyFile)
+        except (IOError, ValueError) as e:
+            logging.warning("Could not read dependency graph %s, converting all files: %s" %(path, str(e)))
+
+    def getDependencyFingerprints(self, path, callGraphSlicer, implementationNamesByTemplateName, optionFlags, generatorFingerprint):
+        with open(path, 'rb') as sourceFile:
+            sourceText = sourceFile.read()
+        textsByDependencyName = {}
+        for dependencyName, text in callGraphSlicer.getSliceComponents(
+            os.path.basename(path).split('.')[0],
+            getReferencedModuleNames(sourceText)
+        ):
+            textsByDependencyName.setdefault(dependencyName, []).append(text)
+        fingerprintsByDependencyName = dict(
+            (dependencyName, getFingerprint("\n".join(texts)))
+            for dependencyName, texts in textsByDependencyName.items()
+        )
+        fingerprintsByDependencyName["source:%s" %(os.path.basename(path))] = getFingerprint(sourceText)
+        fingerprintsByDependencyName["implementation"] = getFingerprint(json.dumps(implementationNamesByTemplateName, sort_keys=True))
+        fingerprintsByDependencyName["optionFlags"] = getFingerprint(",".join(sorted(optionFlags)))
+        fingerprintsByDependencyName["preprocessor"] = generatorFingerprint
+        return fingerprintsByDependencyName
+
+    def getRebuildReasons(self, outputPath, fingerprintsByDependencyName):
+        '''returns a list of reasons for converting the file again - empty if its output is up to date'''
+        previousConversion = self.conversionsByOutputName.get(os.path.basename(outputPath))
+        #graphs written by earlier versions don't record the outputs
+        if previousConversion == None or not "output" in previousConversion:
+            return ["no previous conversion recorded"]
+        if not os.path.exists(outputPath):
+            return ["output %s is missing" %(outputPath)]
+        if getOutputState(outputPath) != previousConversion["output"]:
+            return ["output %s has been modified since its conversion" %(outputPath)]
+        previousFingerprintsByDependencyName = previousConversion["dependencies"]
+        reasons = []
+        for dependencyName in sorted(set(fingerprintsByDependencyName.keys() + previousFingerprintsByDependencyName.keys())):
+            fingerprint = fingerprintsByDependencyName.get(dependencyName)
+            previousFingerprint = previousFingerprintsByDependencyName.get(dependencyName)
+            if previousFingerprint == None:
+                reasons.append("new dependency %s" %(dependencyName))
+            elif fingerprint == None:
+                reasons.append("dependency %s removed" %(dependencyName))
+            elif fingerprint != previousFingerprint:
+                reasons.append("%s changed" %(dependencyName))
+        return reasons
+
+    def update(self, outputPath, fingerprintsByDependencyName):
+        '''to be called once the output has been written'''
+        self.conversionsByOutputName[os.path.basename(outputPath)] = {
+            "dependencies": fingerprintsByDependencyName,
+            "output": getOutputState(outputPath)
+        }
+
+    def remove(self, outputPath):
+        self.conversionsByOutputName.pop(os.path.basename(outputPath), None)
+
+    def write(self):
+        #write to a temporary file first, such that an interrupted run doesn't leave a truncated graph behind
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temporaryFile, temporaryPath = tempfile.mkstemp(dir=directory)
+        with os.fdopen(temporaryFile, 'w') as dependencyFile:
+            json.dump(self.conversionsByOutputName, dependencyFile, sort_keys=True, indent=1)
+        os.rename(temporaryPath, self.path)
+
+class ModuleDependencyGraph(object):
+    '''Dependencies between the generated sources, derived from the modules each source defines and imports according to the callgraph.
+    A source needs to be compiled after all sources defining a module it uses - imports of modules that are not defined
+    in the callgraph (framework or library modules) are not taken into account.'''
+
+    def __init__(self, cgDoc):
+        self.sourceByModuleName = {}
+        importedModuleNamesBySource = {}
+        for moduleNode in cgDoc.getElementsByTagName('module'):
+            source = moduleNode.getAttribute('source')
+            if source in [None, '']:
+                raise UsageError("module %s without source - please regenerate the callgraph" %(moduleNode.getAttribute('name')))
+            self.sourceByModuleName[moduleNode.getAttribute('name').lower()] = source
+            importedModuleNames = importedModuleNamesBySource.setdefault(source, set())
+            for importNode in moduleNode.getElementsByTagName('import'):
+                importedModuleNames.add(importNode.getAttribute('module').lower())
+        self.prerequisitesBySource = {}
+        for source, importedModuleNames in importedModuleNamesBySource.items():
+            self.prerequisitesBySource[source] = sorted(set(
+                self.sourceByModuleName[moduleName]
+                for moduleName in importedModuleNames
+                if moduleName in self.sourceByModuleName and self.sourceByModuleName[moduleName] != source
+            ))
+        self._longestChainsBySource = {}
+
+    def makeRules(self, objectSuffix=".o"):
+        '''one make rule per source that depends on other sources, e.g. "example.o: kernels.o storage.o"'''
+        return [
+            "%s%s: %s" %(source, objectSuffix, " ".join(prerequisite + objectSuffix for prerequisite in prerequisites))
+            for source, prerequisites in sorted(self.prerequisitesBySource.items())
+            if len(prerequisites) > 0
+        ]
+
+    def longestChain(self, source, sourcesOnPath=None):
+        '''the longest list of sources that need to be compiled one after the other before source can be compiled, ending with source itself'''
+        if source in self._longestChainsBySource:
+            return self._longestChainsBySource[source]
+        sourcesOnPath = sourcesOnPath if sourcesOnPath != None else []
+        if source in sourcesOnPath:
+            raise UsageError("circular module dependency: %s" %(" -> ".join(sourcesOnPath[sourcesOnPath.index(source):] + [source])))
+        longestPrerequisiteChain = []
+        for prerequisite in self.prerequisitesBySource.get(source, []):
+            chain = self.longestChain(prerequisite, sourcesOnPath + [source])
+            if len(chain) > len(longestPrerequisiteChain):
+                longestPrerequisiteChain = chain
+        self._longestChainsBySource[source] = longestPrerequisiteChain + [source]
+        return self._longestChainsBySource[source]
+
+    def criticalPath(self):
+        '''the longest chain of sources in the whole codebase - it bounds how much a parallel compilation can be sped up'''
+        criticalPath = []
+        for source in sorted(self.prerequisitesBySource.keys()):
+            chain = self.longestChain(source)
+            if len(chain) > len(criticalPath):
+                criticalPath = chain
+        return criticalPath
+
+    def sourcesByLevel(self):
+        '''sources grouped by the length of their longest chain - all sources of one level can be compiled in parallel'''
+        sourcesByLevel = []
+        for source in sorted(self.prerequisitesBySource.keys()):
+            level = len(self.longestChain(source))
+            while len(sourcesByLevel) < level:
+                sourcesByLevel.append([])
+            sourcesByLevel[level - 1].append(source)
+        return sourcesByLevel
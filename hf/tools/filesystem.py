@@ -19,6 +19,7 @@
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import hashlib
 import logging
 
 def dirEntries(dir_name, subdir, *args):
@@ -48,3 +49,48 @@ def dirEntries(dir_name, subdir, *args):
             fileList.extend(dirEntries(dirfile, subdir, *args))
     return fileList
 
+def getFileHash(path, blockSize=65536):
+    fileHash = hashlib.sha1()
+    with open(path, 'rb') as inputFile:
+        while True:
+            block = inputFile.read(blockSize)
+            if not block:
+                break
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
+def writeIfChanged(path, text):
+    '''Writes text to path unless the file already has exactly this content, such that its timestamp is kept.
+    Returns whether the file has been written.'''
+    try:
+        if os.path.getsize(path) == len(text) \
+        and getFileHash(path) == hashlib.sha1(text).hexdigest():
+            return False
+    except (IOError, OSError):
+        pass
+    with open(path, 'wb') as outputFile:
+        outputFile.write(text)
+    return True
+
+def getFileStampsByPath(paths, *args):
+    '''Return (modification time, size) by path for the files in 'paths' and for the files found recursively
+    in the directories in 'paths' - additional arguments are file extensions to match, as with dirEntries.
+    Files that disappear while we look at them are left out.
+    '''
+    fileStampsByPath = {}
+    for path in paths:
+        candidates = dirEntries(path, True, *args) if os.path.isdir(path) else [path]
+        for candidate in candidates:
+            try:
+                fileStat = os.stat(candidate)
+            except OSError:
+                continue
+            fileStampsByPath[candidate] = (fileStat.st_mtime, fileStat.st_size)
+    return fileStampsByPath
+
+def getChangedPaths(fileStampsBefore, fileStampsAfter):
+    '''paths that have been added, removed or modified between two getFileStampsByPath results, sorted'''
+    return sorted(
+        path for path in set(fileStampsBefore.keys()) | set(fileStampsAfter.keys())
+        if fileStampsBefore.get(path) != fileStampsAfter.get(path)
+    )
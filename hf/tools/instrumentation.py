@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#Stage reports of the pipeline scripts:
+#A script run with --stageReport appends one JSON line to the report file, containing the wall time, the CPU time
+#(including the one of finished child processes, e.g. pool workers) and the peak RSS for every stage of the run,
+#as well as its exit status - the main body of a script runs within its StageReport, such that failed runs are reported as well.
+#With --profile, the functions on the stack are sampled periodically and the most frequent ones are added to the line.
+#combineStats.py aggregates the runs in a directory of such reports and flags regressions.
+
+import os, sys, time, json, errno, signal, socket, resource, logging
+
+profileSamplingInterval = 0.005
+numOfProfileEntriesInReport = 50
+stageMetrics = ["wallTime", "cpuTime", "peakRSS"]
+
+def getCPUTime():
+    selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+    childrenUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return selfUsage.ru_utime + selfUsage.ru_stime + childrenUsage.ru_utime + childrenUsage.ru_stime
+
+def getPeakRSSInMB():
+    #ru_maxrss is given in kilobytes on Linux. For the children it is the peak of the largest one.
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) / 1024.0
+
+def getExitStatus(exception):
+    '''the exit status of a script ending with exception (None if it ends normally), as the interpreter determines it'''
+    if exception == None:
+        return 0
+    if not isinstance(exception, SystemExit):
+        return 1
+    if exception.code == None:
+        return 0
+    if isinstance(exception.code, int):
+        return exception.code
+    #sys.exit with a message
+    return 1
+
+def getStageKey(stage):
+    '''identifies a stage across runs of the same script'''
+    return " - ".join(part for part in [stage.get("target"), stage["name"], stage.get("file")] if part)
+
+def median(values):
+    sortedValues = sorted(values)
+    middle = len(sortedValues) / 2
+    if len(sortedValues) % 2 == 1:
+        return sortedValues[middle]
+    return (sortedValues[middle - 1] + sortedValues[middle]) / 2.0
+
+def getMetricsByStageKey(run):
+    '''returns {stage key: {metric: value}} of a run, including the whole run as stage "total"'''
+    metricsByStageKey = {"total": dict((metric, run[metric]) for metric in stageMetrics)}
+    for stage in run["stages"]:
+        metrics = metricsByStageKey.get(getStageKey(stage))
+        if metrics == None:
+            metricsByStageKey[getStageKey(stage)] = dict((metric, stage[metric]) for metric in stageMetrics)
+            continue
+        #stages repeated within a run are added up
+        metrics["wallTime"] += stage["wallTime"]
+        metrics["cpuTime"] += stage["cpuTime"]
+        metrics["peakRSS"] = max(metrics["peakRSS"], stage["peakRSS"])
+    return metricsByStageKey
+
+def getBaselineMetricsByStageKey(baselineRuns):
+    '''the median of every metric over the runs containing the stage'''
+    valuesByStageKeyAndMetric = {}
+    for run in baselineRuns:
+        for stageKey, metrics in getMetricsByStageKey(run).items():
+            valuesByMetric = valuesByStageKeyAndMetric.setdefault(stageKey, {})
+            for metric, value in metrics.items():
+                valuesByMetric.setdefault(metric, []).append(value)
+    return dict(
+        (stageKey, dict((metric, median(values)) for metric, values in valuesByMetric.items()))
+        for stageKey, valuesByMetric in valuesByStageKeyAndMetric.items()
+    )
+
+def getRegressions(metricsByStageKey, baselineMetricsByStageKey, threshold, minimumTimeDifference, minimumRSSDifference):
+    '''returns [(stage key, metric, value, baseline value)] for the metrics that have grown by more than threshold (a fraction of
+    the baseline value) as well as by more than the minimum difference - smaller differences are considered noise'''
+    regressions = []
+    for stageKey in sorted(metricsByStageKey.keys()):
+        baselineMetrics = baselineMetricsByStageKey.get(stageKey)
+        if baselineMetrics == None:
+            continue
+        for metric in stageMetrics:
+            value = metricsByStageKey[stageKey][metric]
+            baselineValue = baselineMetrics[metric]
+            minimumDifference = minimumRSSDifference if metric == "peakRSS" else minimumTimeDifference
+            if value - baselineValue > max(baselineValue * threshold, minimumDifference):
+                regressions.append((stageKey, metric, value, baselineValue))
+    return regressions
+
+def addSamples(samplesByFunction, otherSamplesByFunction):
+    for function, (selfSamples, totalSamples) in otherSamplesByFunction.items():
+        samples = samplesByFunction.setdefault(function, [0, 0])
+        samples[0] += selfSamples
+        samples[1] += totalSamples
+
+class SamplingProfiler(object):
+    '''counts the functions on the stack whenever the process has used up another sampling interval of CPU time -
+    for each function the samples where it has been the innermost one (self) and the samples where it has been on the stack at all (total)'''
+
+    def __init__(self, interval=profileSamplingInterval):
+        self.interval = interval
+        self.samplesByFunction = {}
+        self._functionsByCode = {}
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        #system calls of the profiled code must not be interrupted by the sampling
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+
+    def takeSamples(self):
+        '''returns the samples collected so far and starts counting from zero'''
+        samplesByFunction = self.samplesByFunction
+        self.samplesByFunction = {}
+        return samplesByFunction
+
+    def _getFunction(self, code):
+        function = self._functionsByCode.get(code)
+        if function == None:
+            function = "%s:%i(%s)" %(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+            self._functionsByCode[code] = function
+        return function
+
+    def _sample(self, signalNumber, frame):
+        functionsOnStack = set()
+        isInnermost = True
+        while frame != None:
+            function = self._getFunction(frame.f_code)
+            samples = self.samplesByFunction.setdefault(function, [0, 0])
+            if isInnermost:
+                samples[0] += 1
+                isInnermost = False
+            #recursive functions are only counted once per sample
+            if not function in functionsOnStack:
+                samples[1] += 1
+                functionsOnStack.add(function)
+            frame = frame.f_back
+
+class StageTimer(object):
+    '''measures one stage, starting on creation'''
+
+    def __init__(self, report, name, details):
+        self.report = report
+        self.name = name
+        self.details = details
+        self.startWallTime = time.time()
+        self.startCPUTime = getCPUTime()
+
+    def getRecord(self):
+        record = dict(self.details)
+        record["name"] = self.name
+        record["wallTime"] = round(time.time() - self.startWallTime, 4)
+        record["cpuTime"] = round(getCPUTime() - self.startCPUTime, 4)
+        record["peakRSS"] = round(getPeakRSSInMB(), 1)
+        #stages measured in pool workers bring their samples along to the main process
+        if self.report.profiler and os.getpid() != self.report.pid:
+            record["samples"] = self.report.profiler.takeSamples()
+        return record
+
+class StageReport(object):
+    '''collects the stages of one script run. Without a path, stages are only timed for the debug log.
+    Used as a context manager around the main body of a script, the report is written however the script ends.'''
+
+    def __init__(self, path, profile=False, logLevel=logging.DEBUG):
+        self.path = path
+        self.logLevel = logLevel
+        self.stages = []
+        self.pid = os.getpid()
+        self.startWallTime = time.time()
+        self.startCPUTime = getCPUTime()
+        self.profiler = None
+        if path and profile:
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+
+    def startStage(self, name, **details):
+        '''returns a StageTimer to pass to endStage. Stages measured in another process pass the timer's record to addStage instead.'''
+        return StageTimer(self, name, details)
+
+    def endStage(self, timer):
+        self.addStage(timer.getRecord())
+
+    def addStage(self, record):
+        samplesByFunction = record.pop("samples", None)
+        if samplesByFunction and self.profiler:
+            addSamples(self.profiler.samplesByFunction, samplesByFunction)
+        logging.log(self.logLevel, "%s took %.3fs" %(getStageKey(record), record["wallTime"]))
+        self.stages.append(record)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        self.write(getExitStatus(exception))
+        return False
+
+    def initWorker(self):
+        '''to be called in pool worker initializers - interval timers are not inherited when forking'''
+        if self.profiler:
+            self.profiler.takeSamples()
+            self.profiler.start()
+
+    def getRun(self, exitStatus=0):
+        run = {
+            "script": os.path.basename(sys.argv[0]),
+            "arguments": sys.argv[1:],
+            "host": socket.gethostname(),
+            "startTime": self.startWallTime,
+            "wallTime": round(time.time() - self.startWallTime, 4),
+            "cpuTime": round(getCPUTime() - self.startCPUTime, 4),
+            "peakRSS": round(getPeakRSSInMB(), 1),
+            "stages": self.stages,
+            "exitStatus": exitStatus
+        }
+        if self.profiler:
+            self.profiler.stop()
+            functions = sorted(
+                self.profiler.samplesByFunction.items(),
+                key=lambda item: (-item[1][1], -item[1][0], item[0])
+            )
+            run["profile"] = {
+                "interval": self.profiler.interval,
+                "functions": [
+                    {"function": function, "selfSamples": samples[0], "totalSamples": samples[1]}
+                    for function, samples in functions[:numOfProfileEntriesInReport]
+                ]
+            }
+        return run
+
+    def write(self, exitStatus=0):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise e
+        #one write per run, such that concurrent runs don't mix their lines
+        with open(self.path, 'a') as reportFile:
+            reportFile.write(json.dumps(self.getRun(exitStatus), sort_keys=True) + "\n")
+
+def addStageReportOptions(parser):
+    parser.add_option("--stageReport", dest="stageReport",
+                      help="append the wall time, CPU time and peak memory of every stage of this run as a JSON line to FILE (see combineStats.py)", metavar="FILE")
+    parser.add_option("--profile", action="store_true", dest="profile",
+                      help="together with --stageReport: sample the functions on the stack and add the most frequent ones to the report")
+
+def readStageReport(path):
+    '''returns the runs in a report file, oldest first'''
+    runs = []
+    with open(path, 'r') as reportFile:
+        for line in reportFile:
+            if line.strip() != "":
+                runs.append(json.loads(line))
+    return sorted(runs, key=lambda run: run["startTime"])
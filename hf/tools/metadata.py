@@ -18,12 +18,20 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
-from xml.dom.minidom import Document, Node, parseString as parseStringUsingMinidom
-from tools.commons import BracketAnalyzer, enum
+from xml.dom.minidom import Document, Node, Element, Text, Attr, parseString as parseStringUsingMinidom
+from xml.dom import minidom
+from collections import namedtuple
+from tools.commons import BracketAnalyzer, enum, getDataFromFile
+import os
+import hashlib
 import uuid
 import re
+import gc
+import marshal
 import logging
 
+binaryCallGraphHeader = "HFCG\x01"
+
 domainDependantAttributes = ["autoDom", "present", "transferHere"]
 
 class ParallelRegionDomain(object):
@@ -119,13 +127,92 @@ def getClonedDocument(doc):
         del clone._templateCache
     return clone
 
+def getNodeTuple(node):
+    if node.nodeType == Node.TEXT_NODE:
+        return node.data
+    return (
+        node.tagName,
+        tuple(node.attributes.items()),
+        tuple(getNodeTuple(child) for child in node.childNodes if child.nodeType in [Node.ELEMENT_NODE, Node.TEXT_NODE])
+    )
+
+def binaryFromDocument(doc):
+    '''Compact representation of a callgraph: A marshalled tree of (tagName, attributes, children) tuples.
+    Loading it skips XML parsing and builds the DOM directly.'''
+    return binaryCallGraphHeader + marshal.dumps(getNodeTuple(doc.documentElement), 2)
+
+def documentFromBinary(data):
+    #node construction follows xml.dom.expatbuilder, writing the node dictionaries directly
+    def appendNodeFromTuple(parent, nodeTuple):
+        if isinstance(nodeTuple, basestring):
+            node = Text()
+            d = node.__dict__
+            d['data'] = d['nodeValue'] = nodeTuple
+            d['ownerDocument'] = doc
+            minidom._append_child(parent, node)
+            return
+        tagName, attributes, children = nodeTuple
+        node = Element(tagName)
+        node.ownerDocument = doc
+        minidom._append_child(parent, node)
+        for attributeName, attributeValue in attributes:
+            attribute = Attr(attributeName, None, attributeName, None)
+            node._attrs[attributeName] = attribute
+            node._attrsNS[(None, attributeName)] = attribute
+            d = attribute.childNodes[0].__dict__
+            d['data'] = d['nodeValue'] = attributeValue
+            d = attribute.__dict__
+            d['ownerDocument'] = doc
+            d['value'] = d['nodeValue'] = attributeValue
+            d['ownerElement'] = node
+        for child in children:
+            appendNodeFromTuple(node, child)
+
+    if not data.startswith(binaryCallGraphHeader):
+        raise Exception("not a binary callgraph")
+    doc = Document()
+    appendNodeFromTuple(doc, marshal.loads(data[len(binaryCallGraphHeader):]))
+    return doc
+
 def parseString(data, immutable=False):
-    doc = parseStringUsingMinidom(data)
+    #building the DOM creates a huge amount of container objects at once - without disabling it,
+    #the cyclic garbage collector runs over the growing heap again and again without finding anything to collect
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        if data.startswith(binaryCallGraphHeader):
+            doc = documentFromBinary(data)
+        else:
+            doc = parseStringUsingMinidom(data)
+    finally:
+        if gcWasEnabled:
+            gc.enable()
     if immutable:
         #this saves a lot of preprocessing time by caching the results instead of using minidom's native implementation
         return ImmutableDOMDocument(doc)
     return doc
 
+#callgraphs parsed ahead of time by the preprocessor daemon, as (fingerprint, document) by absolute path.
+#the daemon forks for every request, so changes to these documents stay within the request.
+warmCallGraphsByPath = {}
+
+def warmCallGraphFile(path):
+    data = getDataFromFile(path)
+    fingerprint = hashlib.sha1(data).hexdigest()
+    absolutePath = os.path.abspath(path)
+    warmCallGraph = warmCallGraphsByPath.get(absolutePath)
+    if warmCallGraph and warmCallGraph[0] == fingerprint:
+        return
+    warmCallGraphsByPath[absolutePath] = (fingerprint, parseString(data))
+
+def parseCallGraphFile(path, immutable=False):
+    '''parses a callgraph in XML or binary format - reusing the document parsed by the preprocessor daemon if the file is unchanged'''
+    data = getDataFromFile(path)
+    warmCallGraph = warmCallGraphsByPath.get(os.path.abspath(path))
+    if warmCallGraph and warmCallGraph[0] == hashlib.sha1(data).hexdigest():
+        return ImmutableDOMDocument(warmCallGraph[1]) if immutable else warmCallGraph[1]
+    return parseString(data, immutable)
+
 def addCallers(callGraphDict, routineDict, calls, routineName):
     for call in calls:
         callee = call.getAttribute("callee")
@@ -186,6 +273,103 @@ def getCalleesByCallerName(callNodes):
             currCalleeList.append(callNode)
     return calleesByRoutineName
 
+def getTemplateRelations(routineNode):
+    templateRelations = []
+    parallelRegionParents = routineNode.getElementsByTagName("parallelRegions")
+    if not parallelRegionParents or len(parallelRegionParents) == 0:
+        parallelRegionParents = routineNode.getElementsByTagName("activeParallelRegions")
+    if parallelRegionParents and len(parallelRegionParents) > 0:
+        templateRelations = parallelRegionParents[0].getElementsByTagName("templateRelation")
+    return templateRelations
+
+def getRoutineNodesByName(routineNodes):
+    #first routine wins for duplicate names, same as a linear search through the routine nodes would
+    routineNodesByName = {}
+    for routineNode in routineNodes:
+        routineName = routineNode.getAttribute("name")
+        if not routineName in routineNodesByName:
+            routineNodesByName[routineName] = routineNode
+    return routineNodesByName
+
+def addTemplateRelation(routineNode, templateRelation, templateIDsByRoutineNode):
+    parallelRegionsNodes = routineNode.getElementsByTagName("activeParallelRegions")
+    parallelRegionNode = None
+    if len(parallelRegionsNodes) == 0:
+        parallelRegionNode = routineNode.ownerDocument.createElement("activeParallelRegions")
+        routineNode.appendChild(parallelRegionNode)
+    else:
+        parallelRegionNode = parallelRegionsNodes[0]
+    templateIDs = templateIDsByRoutineNode.get(routineNode)
+    if templateIDs == None:
+        templateIDs = set(
+            existingRelation.getAttribute("id")
+            for existingRelation in parallelRegionNode.getElementsByTagName("templateRelation")
+        )
+        templateIDsByRoutineNode[routineNode] = templateIDs
+    templateID = templateRelation.getAttribute("id")
+    if templateID in templateIDs:
+        return
+    newTemplateRelationNode = routineNode.ownerDocument.createElement("templateRelation")
+    newTemplateRelationNode.setAttribute("id", templateID)
+    parallelRegionNode.appendChild(newTemplateRelationNode)
+    templateIDs.add(templateID)
+
+def addAttributeToAllCallGraphAncestors(routineNodesByName, callNodesByCalleeName, routineNode, attributeName, attributeValue, templateIDsByRoutineNode):
+    #every ancestor receives the template relations of the kernel we start from - the ones of previously analysed kernels
+    #have already been propagated along the same edges. Each ancestor is therefore visited only once.
+    templateRelations = getTemplateRelations(routineNode)
+    visitedRoutineNames = set([routineNode.getAttribute("name")])
+    routineNamesToVisit = [routineNode.getAttribute("name")]
+    while len(routineNamesToVisit) > 0:
+        routineName = routineNamesToVisit.pop()
+        for call in callNodesByCalleeName.get(routineName, []):
+            if call.getAttribute("callee") != routineName:
+                raise Exception("Wrong initialisation of caller-by-callee index.")
+            callerName = call.getAttribute("caller")
+            routine = routineNodesByName.get(callerName)
+            if routine == None:
+                continue
+            if attributeName == 'parallelRegionPosition' and not routine.getAttribute(attributeName) in [None, '', attributeValue]:
+                raise Exception("Routine %s contains one or more kernels and at the same time has one or more kernels in its inner callgraph. \
+This is not allowed in Hybrid Fortran. Please turn this subroutine into a kernel wrapper, putting its own parallel regions into seperate subroutines." %(callerName))
+            if callerName in visitedRoutineNames:
+                continue
+            visitedRoutineNames.add(callerName)
+            routine.setAttribute(attributeName, attributeValue)
+            for templateRelation in templateRelations:
+                addTemplateRelation(routine, templateRelation, templateIDsByRoutineNode)
+            routineNamesToVisit.append(callerName)
+
+def addAttributeToAllCallGraphHeirs(routineNodesByName, callNodesByCallerName, routineNode, attributeName, attributeValue, templateIDsByRoutineNode):
+    #see addAttributeToAllCallGraphAncestors
+    templateRelations = getTemplateRelations(routineNode)
+    visitedRoutineNames = set([routineNode.getAttribute("name")])
+    routinesToVisit = [routineNode]
+    while len(routinesToVisit) > 0:
+        currentRoutine = routinesToVisit.pop()
+        routineName = currentRoutine.getAttribute("name")
+        parallelRegionPosition = currentRoutine.getAttribute("parallelRegionPosition")
+        for call in callNodesByCallerName.get(routineName, []):
+            if call.getAttribute("caller") != routineName:
+                raise Exception("Wrong initialisation of callee-by-caller index.")
+            #check whether this call is within a parallel region. Only take into consideration those that are.
+            if parallelRegionPosition == "within" and call.getAttribute("parallelRegionPosition") != "surround":
+                continue
+            calleeName = call.getAttribute("callee")
+            routine = routineNodesByName.get(calleeName)
+            if routine == None:
+                continue
+            if attributeName == 'parallelRegionPosition' and not routine.getAttribute(attributeName) in [None, '', attributeValue]:
+                raise Exception("Routine %s contains one or more kernels and at the same time is being called inside a kernel. \
+This is not allowed in Hybrid Fortran. Please call this subroutine in a wrapper function instead, moving the other kernel into its own subroutine." %(calleeName))
+            if calleeName in visitedRoutineNames:
+                continue
+            visitedRoutineNames.add(calleeName)
+            routine.setAttribute(attributeName, attributeValue)
+            for templateRelation in templateRelations:
+                addTemplateRelation(routine, templateRelation, templateIDsByRoutineNode)
+            routinesToVisit.append(routine)
+
 def createOrGetFirstNodeWithName(nodeName, doc):
     nodeArr = doc.getElementsByTagName(nodeName)
     node = None
@@ -439,6 +623,41 @@ def setTemplateInfos(doc, parent, specText, templateParentNodeName, templateNode
     referenceParentNode.appendChild(relationNode)
     return relationNode, templateNode
 
+def appendPartialCallGraph(doc, partialDoc):
+    '''Appends a callgraph generated from a single file in a document of its own. The result is the same as if the file had been
+    parsed into doc directly: Templates that doc already contains are not added again, relations to them are pointed to the existing ID.'''
+    templateNodeNamesByParentName = {
+        "domainDependantTemplates": "domainDependantTemplate",
+        "parallelRegionTemplates": "parallelRegionTemplate"
+    }
+    duplicateTemplateIDs = set()
+    templateIDReplacements = {}
+    for templateParentName, templateNodeName in templateNodeNamesByParentName.items():
+        for templateLibrary in [
+            node for node in doc.documentElement.childNodes
+            if node.nodeType == Node.ELEMENT_NODE and node.tagName == templateParentName
+        ][:1]:
+            for templateNode in partialDoc.getElementsByTagName(templateNodeName):
+                duplicateTemplateNode = firstDuplicateChild(templateLibrary, templateNode)
+                if duplicateTemplateNode:
+                    duplicateTemplateIDs.add(templateNode.getAttribute("id"))
+                    templateIDReplacements[templateNode.getAttribute("id")] = duplicateTemplateNode.getAttribute("id")
+    if len(templateIDReplacements) > 0:
+        for relationNode in partialDoc.getElementsByTagName("templateRelation"):
+            replacementID = templateIDReplacements.get(relationNode.getAttribute("id"))
+            if replacementID:
+                relationNode.setAttribute("id", replacementID)
+    for partialParentNode in partialDoc.documentElement.childNodes:
+        if partialParentNode.nodeType != Node.ELEMENT_NODE:
+            continue
+        parentNode = getOrCreateFirstLevelElement(doc, partialParentNode.tagName)
+        for partialNode in partialParentNode.childNodes:
+            if partialParentNode.tagName in templateNodeNamesByParentName \
+            and partialNode.nodeType == Node.ELEMENT_NODE \
+            and partialNode.getAttribute("id") in duplicateTemplateIDs:
+                continue
+            parentNode.appendChild(doc.importNode(partialNode, True))
+
 def regionTemplatesByID(cgDoc, templateTypeName):
     regionTemplatesByID = None
     if hasattr(cgDoc, "_templateCache"):
@@ -522,6 +741,21 @@ def getAttributes(templateNode):
         return []
     return [node.firstChild.nodeValue for node in attributesTemplateNodes[0].getElementsByTagName("entry")]
 
+TemplateData = namedtuple("TemplateData", ["attributes", "domains", "declarationPrefix"])
+
+def getTemplateData(templateNode):
+    '''Attributes, domains and declaration prefix of a domain dependant or parallel region template as immutable tuples.
+    Templates don't change anymore once they're part of the callgraph, so this is only read once per template node -
+    all symbols loaded from the same template share the result.'''
+    if hasattr(templateNode, "_templateData"):
+        return templateNode._templateData
+    templateNode._templateData = TemplateData(
+        tuple(getAttributes(templateNode)),
+        tuple(getDomNameAndSize(templateNode)),
+        getDeclarationPrefix(templateNode)
+    )
+    return templateNode._templateData
+
 def getDomainDependantTemplatesAndEntries(cgDoc, routineNode):
     result = []
     domainDependantTemplateByID = regionTemplatesByID(cgDoc, "domainDependantTemplate")
@@ -19,9 +19,101 @@
 # along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import hashlib
 import logging
 from tools.commons import Singleton
 
+def getStaticPatternsFingerprint():
+    '''changes whenever a static pattern is changed - line classifications computed with other patterns are invalid'''
+    return hashlib.sha1(repr(sorted(RegExPatterns.Instance().staticRegexByPatternName.items()))).hexdigest()
+
+wordCharacters = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
+declarationSeparatorCharacters = frozenset(" \t\n\r\f\v,:")
+
+def isWordCharacterAt(text, index):
+    #\w in our patterns - out of range counts as a non word character
+    return index >= 0 and index < len(text) and text[index] in wordCharacters
+
+def getNameOccurrences(text, name, startIndex=0):
+    '''yields (start, end) of all case insensitive occurrences of name in text starting at startIndex or later'''
+    text = text.lower()
+    name = name.lower()
+    nameStart = text.find(name, startIndex)
+    while nameStart >= 0:
+        yield nameStart, nameStart + len(name)
+        nameStart = text.find(name, nameStart + 1)
+
+class LineMatch(object):
+    '''Stands in for the match object of a static pattern whose result has been taken from a line classification.
+    Offers the parts of the match object interface used by the parsers.'''
+
+    def __init__(self, matchGroups):
+        self.matchGroups = matchGroups #group 0 followed by all subgroups
+
+    def group(self, *indices):
+        if len(indices) == 0:
+            return self.matchGroups[0]
+        if len(indices) == 1:
+            return self.matchGroups[indices[0]]
+        return tuple(self.matchGroups[index] for index in indices)
+
+    def groups(self):
+        return self.matchGroups[1:]
+
+class StaticPattern(object):
+    '''A compiled static pattern that can use a line classification, i.e. a dictionary of
+    {pattern name: {line: match groups or None}}, as a cache for its matches.'''
+
+    def __init__(self, patternName, compiledPattern):
+        self.patternName = patternName
+        self.compiledPattern = compiledPattern
+        self.matchGroupsByLine = None
+        self.match = compiledPattern.match #no overhead as long as there is no classification
+
+    def __getattr__(self, name):
+        return getattr(self.compiledPattern, name)
+
+    def setLineClassification(self, matchGroupsByPatternNameAndLine):
+        if matchGroupsByPatternNameAndLine == None:
+            self.matchGroupsByLine = None
+            self.match = self.compiledPattern.match
+        else:
+            self.matchGroupsByLine = matchGroupsByPatternNameAndLine.setdefault(self.patternName, {})
+            self.match = self.classifiedMatch
+
+    def classifiedMatch(self, string, *args):
+        if args:
+            return self.compiledPattern.match(string, *args)
+        matchGroups = self.matchGroupsByLine.get(string, False)
+        if matchGroups is False:
+            match = self.compiledPattern.match(string)
+            matchGroups = (match.group(0),) + match.groups() if match else None
+            self.matchGroupsByLine[string] = matchGroups
+        if matchGroups == None:
+            return None
+        return LineMatch(matchGroups)
+
+class LineClassifier(object):
+    '''Matches a line against several static patterns with one combined regex. The patterns are tried in the given order,
+    so the first matching one is reported - the same result as checking them one after the other, but in one scan.'''
+
+    def __init__(self, patterns, patternNames):
+        self.patternNames = patternNames
+        self.staticPatternsByName = dict((patternName, getattr(patterns, patternName)) for patternName in patternNames)
+        self.combinedPattern = re.compile(
+            "|".join("(?P<%s>%s)" %(patternName, patterns.staticRegexByPatternName[patternName]) for patternName in patternNames),
+            re.IGNORECASE | re.VERBOSE
+        )
+
+    def classify(self, line):
+        '''returns the name of the first matching pattern together with its match, (None, None) if no pattern matches'''
+        combinedMatch = self.combinedPattern.match(line)
+        if not combinedMatch:
+            return None, None
+        #the alternative's own group closes last, so lastgroup names the matching pattern
+        patternName = combinedMatch.lastgroup
+        return patternName, self.staticPatternsByName[patternName].match(line)
+
 @Singleton
 class RegExPatterns:
     attributeRegex = r"\w*\s*(?:\(\s*[\w\,\s\:\+\-\*\/]*\s*(?:\(.*?\))?\s*\))?"
@@ -62,6 +154,9 @@ class RegExPatterns:
         'argumentPattern': r'\s*(?:subroutine|call)?\s*(?:\w*)\s*\((.*)',
         'importPattern': r'^\s*use\s+(\w*)[,\s]*only\s*\:\s*([=>,\s\w]*)(?:\s.*|$)',
         'importAllPattern': r'^\s*use\s+(\w*)\s*$',
+        'symbolImportPrefixPattern': r'^\s*use\s*(\w*)\s*,\s*only',
+        'symbolImportMapSuffixPattern': r'\s*=>\s*(\w*)',
+        'pointerOrAllocatablePrefixPattern': r'\s*(?:double\s+precision|real|integer|character|logical|complex).*?(?:pointer|allocatable)',
         'singleMappedImportPattern': r'\s*(\w*)\s*=>\s*(\w*)\s*',
         'callArgumentPattern': r'\s*(\w*)\s*(.*)',
         'containsPattern': r'\s*contains\s*',
@@ -79,12 +174,89 @@ class RegExPatterns:
 
     def __init__(self):
         self.dynamicPatternsByRegex = {}
+        self.dynamicPatternLookups = 0
+        self.symbolNameChecks = 0
+        self.lineClassifiersByPatternNames = {}
+        self.staticPatterns = []
         for patternName in self.staticRegexByPatternName:
-            setattr(self, patternName, re.compile(self.staticRegexByPatternName[patternName], re.IGNORECASE | re.VERBOSE))
+            staticPattern = StaticPattern(patternName, re.compile(self.staticRegexByPatternName[patternName], re.IGNORECASE | re.VERBOSE))
+            self.staticPatterns.append(staticPattern)
+            setattr(self, patternName, staticPattern)
+
+    def getLineClassifier(self, patternNames):
+        patternNames = tuple(patternNames)
+        lineClassifier = self.lineClassifiersByPatternNames.get(patternNames)
+        if lineClassifier == None:
+            lineClassifier = LineClassifier(self, patternNames)
+            self.lineClassifiersByPatternNames[patternNames] = lineClassifier
+        return lineClassifier
+
+    def setLineClassification(self, matchGroupsByPatternNameAndLine):
+        '''While a classification is set, the static patterns look up their results there first and record the ones they had to compute.
+        Pass None to match directly again.'''
+        for staticPattern in self.staticPatterns:
+            staticPattern.setLineClassification(matchGroupsByPatternNameAndLine)
 
     def get(self, regex):
+        self.dynamicPatternLookups += 1
         pattern = self.dynamicPatternsByRegex.get(regex)
         if pattern == None:
             pattern = re.compile(regex, re.IGNORECASE | re.VERBOSE)
             self.dynamicPatternsByRegex[regex] = pattern
         return pattern
+
+    def logStatistics(self):
+        logging.debug("Regular expressions: %i static patterns compiled, %i dynamic patterns compiled in %i lookups, %i symbol name checks" %(
+            len(self.staticPatterns),
+            len(self.dynamicPatternsByRegex),
+            self.dynamicPatternLookups,
+            self.symbolNameChecks
+        ))
+
+    #The following replace patterns that would have to be compiled for every symbol name.
+    #They use a static pattern for the part of the line that doesn't depend on the name and look for the name in the rest.
+    #The static patterns are used directly, since we need their match positions - no line classification for these.
+    #Names are matched case insensitively, like all our patterns.
+
+    def matchSymbolImport(self, line, symbolName):
+        '''same as ^\s*use\s*(\w*)\s*,\s*only\s*.*?\W\s*<symbolName>(?:\W|$).*'''
+        self.symbolNameChecks += 1
+        prefixMatch = self.symbolImportPrefixPattern.compiledPattern.match(line)
+        if not prefixMatch:
+            return None
+        for nameStart, nameEnd in getNameOccurrences(line, symbolName, prefixMatch.end() + 1):
+            if not isWordCharacterAt(line, nameStart - 1) and not isWordCharacterAt(line, nameEnd):
+                return LineMatch((line.split("\n", 1)[0], prefixMatch.group(1)))
+        return None
+
+    def matchSymbolImportMap(self, line, symbolName):
+        '''same as .*?\W<symbolName>\s*\=\>\s*(\w*).*'''
+        self.symbolNameChecks += 1
+        for nameStart, nameEnd in getNameOccurrences(line, symbolName, 1):
+            if isWordCharacterAt(line, nameStart - 1):
+                continue
+            suffixMatch = self.symbolImportMapSuffixPattern.compiledPattern.match(line, nameEnd)
+            if suffixMatch:
+                return LineMatch((line.split("\n", 1)[0], suffixMatch.group(1)))
+        return None
+
+    def isPointerOrAllocatableDeclaration(self, declarationLine, symbolName):
+        '''same as \s*(?:double\s+precision|real|integer|character|logical|complex).*?(?:pointer|allocatable).*?[\s,:]+<symbolName>'''
+        self.symbolNameChecks += 1
+        prefixMatch = self.pointerOrAllocatablePrefixPattern.compiledPattern.match(declarationLine)
+        if not prefixMatch:
+            return False
+        for nameStart, _ in getNameOccurrences(declarationLine, symbolName, prefixMatch.end() + 1):
+            if declarationLine[nameStart - 1] in declarationSeparatorCharacters:
+                return True
+        return False
+
+    def isTypeDependency(self, declarationPrefix, symbolName):
+        '''same as .*?\W<symbolName>\W.*, i.e. whether the declaration prefix references symbolName, e.g. as a kind or length parameter'''
+        self.symbolNameChecks += 1
+        for nameStart, nameEnd in getNameOccurrences(declarationPrefix, symbolName, 1):
+            if not isWordCharacterAt(declarationPrefix, nameStart - 1) \
+            and nameEnd < len(declarationPrefix) \
+            and not isWordCharacterAt(declarationPrefix, nameEnd):
+                return True
+        return False
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+#all token types in the order they are tried
+tokenPattern = re.compile(r'''
+    (?P<whitespace>\s+)
+    |(?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+    |(?P<number>(?:\d+(?:\.(?![a-zA-Z]+\.)\d*)?|\.\d+)(?:[eEdD][+-]?\d+)?(?:_\w+)?)
+    |(?P<identifier>[a-zA-Z_]\w*)
+    |(?P<operator>\.[a-zA-Z]+\.|\*\*|//|::|=>|==|/=|<=|>=|[-+*/=<>%&:;])
+    |(?P<openingBracket>\()
+    |(?P<closingBracket>\))
+    |(?P<comma>,)
+    |(?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+def iterateTokens(text):
+    '''Yields the tokens of a Fortran statement (or a part of one) as (token type, token text, start index, bracket level) tuples.
+    The bracket level is the one after the token, i.e. the level inside an opening bracket and outside a closing one -
+    it becomes negative for unbalanced closing brackets. Brackets, commas and quotes within string literals are part of the string token.'''
+    level = 0
+    for tokenMatch in tokenPattern.finditer(text):
+        tokenType = tokenMatch.lastgroup
+        if tokenType == 'openingBracket':
+            level += 1
+        elif tokenType == 'closingBracket':
+            level -= 1
+        yield tokenType, tokenMatch.group(), tokenMatch.start(), level
+
+def tokenize(text):
+    return list(iterateTokens(text))
+
+def getArgumentsInOpenedBracketsAndRemainder(text):
+    '''Splits the arguments of a bracket that has been opened just before text, e.g. 'a, b(1, 2)) + c' -> (['a', 'b(1, 2)'], '+ c').
+    Raises a UsageError naming the bracket in case it is not closed.'''
+    arguments = []
+    argumentStart = 0
+    level = 0
+    #start of the name (or of the bracket itself) for every bracket opened within text that is still open
+    openedBracketStarts = []
+    nameStart = None
+    for tokenType, _, start, level in iterateTokens(text):
+        if tokenType == 'openingBracket':
+            openedBracketStarts.append(nameStart if nameStart != None else start)
+        elif tokenType == 'closingBracket' and level >= 0:
+            openedBracketStarts.pop()
+        if tokenType != 'whitespace':
+            nameStart = start if tokenType == 'identifier' else None
+        if (tokenType == 'comma' and level == 0) or level < 0:
+            argument = text[argumentStart:start].strip()
+            if argument == "" and level < 0:
+                return arguments, text[start + 1:].strip()
+            if argument == "":
+                raise Exception("Invalid empty argument. Analyzed string: %s; Arguments so far: %s; Remainder: %s" %(
+                    text,
+                    str(arguments),
+                    text[start:].strip()
+                ))
+            arguments.append(argument)
+            if level < 0:
+                return arguments, text[start + 1:].strip()
+            argumentStart = start + 1
+    #tools.commons depends on this module
+    from tools.commons import UsageError
+    if level > 0:
+        raise UsageError("missing closing bracket for '%s' in '(%s'" %(text[openedBracketStarts[-1]:].strip(), text.strip()))
+    raise UsageError("missing closing bracket for '(%s'" %(text.strip()))
@@ -5,6 +5,44 @@ def tupleFromMatch(match):
 		return ()
 	return match.groups()
 
+def stripFortranLineContinuationsInMemory(text):
+	#the original three pass implementation of strip_fortran_line_continuations.py, used as reference for the streaming one
+	import re, io
+	from tools.commons import findLeftMostOccurrenceNotInsideQuotes
+	openMPLinePattern = re.compile(r'\s*\!\$OMP.*', re.IGNORECASE)
+	openACCLinePattern = re.compile(r'\s*\!\$ACC.*', re.IGNORECASE)
+	emptyLinePattern = re.compile(r'(.*?)(?:[\n\r\f\v]+[ \t]*)+(.*)', re.DOTALL)
+	multiLineContinuationPattern = re.compile(r'(.*?)\s*\&\s+(?:\!?\$?(?:OMP|ACC)?\&)?\s*(.*)', re.DOTALL)
+	noComments = ""
+	for line in io.BytesIO(text).readlines():
+		if openMPLinePattern.match(line) or openACCLinePattern.match(line):
+			noComments += line
+			continue
+		commentIndex = findLeftMostOccurrenceNotInsideQuotes("!", line)
+		if commentIndex < 0:
+			noComments += line
+			continue
+		noComments += line[:commentIndex] + "\n"
+	stripped = ""
+	remainder = noComments
+	while True:
+		emptyLineMatch = emptyLinePattern.match(remainder)
+		if not emptyLineMatch:
+			stripped += remainder
+			break
+		stripped += emptyLineMatch.group(1) + "\n"
+		remainder = emptyLineMatch.group(2)
+	remainder = stripped
+	output = ""
+	while True:
+		lineContinuationMatch = multiLineContinuationPattern.match(remainder)
+		if not lineContinuationMatch:
+			output += remainder
+			break
+		output += lineContinuationMatch.group(1) + " "
+		remainder = lineContinuationMatch.group(2)
+	return output
+
 class TestPatterns(unittest.TestCase):
 	def testImportPatterns(self):
 		from tools.patterns import RegExPatterns
@@ -30,6 +68,54 @@ class TestPatterns(unittest.TestCase):
 			("my_module", "a, ab => my_ba, ba")
 		)
 
+	def testSymbolNamePatterns(self):
+		from tools.patterns import RegExPatterns
+		patterns = RegExPatterns.Instance()
+		self.assertEqual(
+			tupleFromMatch(patterns.matchSymbolImport("use my_module, only: a, ab, ba", "ab")),
+			("my_module",)
+		)
+		self.assertEqual(
+			tupleFromMatch(patterns.matchSymbolImport("USE my_module, only: a, AB=>my_ba", "ab")),
+			("my_module",)
+		)
+		self.assertEqual(tupleFromMatch(patterns.matchSymbolImport("use my_module, only: a, abc, ba", "ab")), ())
+		self.assertEqual(tupleFromMatch(patterns.matchSymbolImport("use ab", "ab")), ())
+		self.assertEqual(
+			tupleFromMatch(patterns.matchSymbolImportMap("use my_module, only: a, ab => my_ba, ba", "ab")),
+			("my_ba",)
+		)
+		self.assertEqual(tupleFromMatch(patterns.matchSymbolImportMap("use my_module, only: a, cab => my_ba", "ab")), ())
+		self.assertEqual(tupleFromMatch(patterns.matchSymbolImportMap("use my_module, only: a, ab, ba", "ab")), ())
+		self.assertTrue(patterns.isPointerOrAllocatableDeclaration("real(8), allocatable, dimension(:) :: a, b", "b"))
+		self.assertTrue(patterns.isPointerOrAllocatableDeclaration("double precision, pointer :: b", "B"))
+		self.assertFalse(patterns.isPointerOrAllocatableDeclaration("real(8), dimension(:) :: a, b", "b"))
+		self.assertFalse(patterns.isPointerOrAllocatableDeclaration("real(8), allocatable :: pointer_b", "b"))
+		self.assertTrue(patterns.isTypeDependency("real(rp), dimension(n)", "rp"))
+		self.assertTrue(patterns.isTypeDependency("character(len=n)", "n"))
+		self.assertFalse(patterns.isTypeDependency("real(rp_kind), dimension(n_x)", "rp"))
+		self.assertFalse(patterns.isTypeDependency("real, dimension(nx) ", "n"))
+
+	def testLineClassifier(self):
+		from tools.patterns import RegExPatterns
+		patterns = RegExPatterns.Instance()
+		patternNames = ['branchPattern', 'subprocCallPattern', 'subprocEndPattern', 'whileLoopPattern', 'loopPattern']
+		lineClassifier = patterns.getLineClassifier(patternNames)
+		self.assertTrue(patterns.getLineClassifier(patternNames) is lineClassifier)
+		for line in ["@if {parallelRegion(within)}", "call foo(a, b)", "end subroutine", "do while (a)", "do i=1,n", "a = 1", ""]:
+			expectedPatternName = None
+			for patternName in patternNames:
+				if getattr(patterns, patternName).match(line):
+					expectedPatternName = patternName
+					break
+			patternName, match = lineClassifier.classify(line)
+			self.assertEqual(patternName, expectedPatternName)
+			if expectedPatternName:
+				self.assertEqual(match.groups(), getattr(patterns, expectedPatternName).match(line).groups())
+			else:
+				self.assertEqual(match, None)
+		self.assertEqual(tupleFromMatch(lineClassifier.classify("call foo(a, b)")[1]), ("foo", "(a, b)"))
+
 class TestCommonTools(unittest.TestCase):
 	def testTextSplittingBasic(self):
 		from tools.commons import splitTextAtLeftMostOccurrence
@@ -201,6 +287,494 @@ class TestCommonTools(unittest.TestCase):
 		)
 		self.assertEqual(remainder, "::b")
 
+	def testTokenizer(self):
+		from tools.tokenizer import tokenize, getArgumentsInOpenedBracketsAndRemainder
+		from tools.commons import splitIntoComponentsAndRemainder
+		self.assertEqual(
+			[(tokenType, tokenText, level) for tokenType, tokenText, _, level in tokenize("a(i, 'x, (y' .and. 1.5d0**b_2)")],
+			[
+				("identifier", "a", 0), ("openingBracket", "(", 1), ("identifier", "i", 1), ("comma", ",", 1),
+				("whitespace", " ", 1), ("string", "'x, (y'", 1), ("whitespace", " ", 1), ("operator", ".and.", 1),
+				("whitespace", " ", 1), ("number", "1.5d0", 1), ("operator", "**", 1), ("identifier", "b_2", 1),
+				("closingBracket", ")", 0)
+			]
+		)
+		self.assertEqual([tokenText for _, tokenText, _, _ in tokenize("1.eq.n")], ["1", ".eq.", "n"])
+		self.assertEqual([start for _, _, start, _ in tokenize("a = b")], [0, 1, 2, 3, 4])
+		self.assertEqual(getArgumentsInOpenedBracketsAndRemainder(")"), ([], ""))
+		self.assertEqual(getArgumentsInOpenedBracketsAndRemainder("i, j + 1, min(k, n)) + b(i)"), (["i", "j + 1", "min(k, n)"], "+ b(i)"))
+		self.assertEqual(getArgumentsInOpenedBracketsAndRemainder("'a, b', \"c)\")"), (["'a, b'", "\"c)\""], ""))
+		self.assertRaises(Exception, getArgumentsInOpenedBracketsAndRemainder, "a, , b)")
+		self.assertEqual(splitIntoComponentsAndRemainder("s = 'a, b'"), (["s"], "= 'a, b'"))
+		self.assertEqual(splitIntoComponentsAndRemainder("b (n, m), c :: d"), (["b (n, m)", "c"], ":: d"))
+		self.assertRaises(Exception, splitIntoComponentsAndRemainder, "a), b")
+
+	def testTokenizerUnclosedBrackets(self):
+		from tools.tokenizer import getArgumentsInOpenedBracketsAndRemainder
+		from tools.commons import UsageError
+		for text, bracket in [
+			("", "("),
+			("a, b", "(a, b"),
+			("a, b,", "(a, b,"),
+			("a, b(1)", "(a, b(1)"),
+			("a, min(b, c", "min(b, c"),
+			("a, (b + c) * (d", "(d"),
+			("a, 'b)', c", "(a, 'b)', c")
+		]:
+			with self.assertRaises(UsageError) as context:
+				getArgumentsInOpenedBracketsAndRemainder(text)
+			self.assertTrue("missing closing bracket for '%s'" %(bracket) in str(context.exception), str(context.exception))
+
+	def testLineContinuationStripping(self):
+		import os, io
+		from tools.filesystem import dirEntries
+		from strip_fortran_line_continuations import stripFortranLineContinuations
+		def streamed(text):
+			#same line splitting as fileinput
+			return "".join(stripFortranLineContinuations(io.BytesIO(text).readlines()))
+		for text in [
+			"",
+			"a\n",
+			"a",
+			"  a = 1 ! comment\n\n\n   b = 'x!y' !\n",
+			"call foo(a, &\n  \n   & b) ! comment\n",
+			"call foo(a, & ! comment\n  b)\n",
+			"!$OMP PARALLEL DO &\n!$OMP& PRIVATE(i)\n",
+			"a = 1\r\n\f\n  b = 2 &\n",
+			"a = 'x & y'\n"
+		]:
+			self.assertEqual(streamed(text), stripFortranLineContinuationsInMemory(text))
+		examplesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+		sourceFiles = dirEntries(examplesDir, True, "h90", "H90")
+		self.assertTrue(len(sourceFiles) > 0)
+		for sourceFile in sourceFiles:
+			with open(sourceFile, "r") as f:
+				text = f.read()
+			self.assertEqual(streamed(text), stripFortranLineContinuationsInMemory(text), sourceFile)
+
+	def testConversionCacheKeyComponents(self):
+		from tools.cache import getCanonicalNodeText, getReferencedModuleNames
+		from tools.metadata import parseString
+		self.assertEqual(
+			getReferencedModuleNames("module a\n  use b, only: c\n  use D\n  call e()\nend module"),
+			set(["a", "b", "d"])
+		)
+		def canonicalRoutineText(templateID, attributeOrder):
+			cgDoc = parseString(
+				"<callGraph><domainDependantTemplates><domainDependantTemplate id=\"%s\"><attribute><entry>autoDom</entry></attribute></domainDependantTemplate></domainDependantTemplates>\
+<routine %s><domainDependants><templateRelation id=\"%s\"><entry>a</entry></templateRelation></domainDependants></routine></callGraph>" %(
+					templateID, attributeOrder, templateID
+				)
+			)
+			templatesByID = {templateID:cgDoc.getElementsByTagName("domainDependantTemplate")[0]}
+			return getCanonicalNodeText(cgDoc.getElementsByTagName("routine")[0], templatesByID)
+		self.assertEqual(
+			canonicalRoutineText("1234", "name=\"r\" source=\"s\""),
+			canonicalRoutineText("5678", "source=\"s\" name=\"r\"")
+		)
+		self.assertNotEqual(
+			canonicalRoutineText("1234", "name=\"r\" source=\"s\""),
+			canonicalRoutineText("1234", "name=\"r\" source=\"t\"")
+		)
+
+	def testConversionDependencyGraph(self):
+		import os, shutil, tempfile
+		from tools.dependencies import ConversionDependencyGraph
+		directory = tempfile.mkdtemp()
+		try:
+			dependencyPath = os.path.join(directory, "dependencies.json")
+			outputPath = os.path.join(directory, "a.P90.temp")
+			with open(outputPath, "w") as outputFile:
+				outputFile.write("module a\nend module\n")
+			fingerprints = {"source:a.h90":"1", "routine:r":"2"}
+			dependencyGraph = ConversionDependencyGraph(dependencyPath)
+			self.assertEqual(dependencyGraph.getRebuildReasons(outputPath, fingerprints), ["no previous conversion recorded"])
+			dependencyGraph.update(outputPath, fingerprints)
+			dependencyGraph.write()
+			dependencyGraph = ConversionDependencyGraph(dependencyPath)
+			self.assertEqual(dependencyGraph.getRebuildReasons(outputPath, fingerprints), [])
+			self.assertEqual(
+				dependencyGraph.getRebuildReasons(outputPath, {"source:a.h90":"1", "routine:r":"3", "module:m":"4"}),
+				["new dependency module:m", "routine:r changed"]
+			)
+			#e.g. truncated by a shell redirection to the output
+			open(outputPath, "w").close()
+			self.assertEqual(
+				dependencyGraph.getRebuildReasons(outputPath, fingerprints),
+				["output %s has been modified since its conversion" %(outputPath)]
+			)
+			dependencyGraph.update(outputPath, fingerprints)
+			self.assertEqual(dependencyGraph.getRebuildReasons(outputPath, fingerprints), [])
+			os.unlink(outputPath)
+			self.assertEqual(dependencyGraph.getRebuildReasons(outputPath, fingerprints), ["output %s is missing" %(outputPath)])
+		finally:
+			shutil.rmtree(directory)
+
+	def testModuleDependencyGraph(self):
+		from tools.dependencies import ModuleDependencyGraph
+		from tools.metadata import parseString
+		from tools.commons import UsageError
+		def moduleDependencyGraph(importsBySourceAndModule):
+			return ModuleDependencyGraph(parseString("<callGraph><modules>%s</modules></callGraph>" %("".join(
+				"<module name=\"%s\" source=\"%s\"><imports>%s</imports></module>" %(
+					moduleName, source, "".join("<import module=\"%s\"/>" %(importedName) for importedName in importedNames)
+				)
+				for (source, moduleName), importedNames in sorted(importsBySourceAndModule.items())
+			))))
+		dependencyGraph = moduleDependencyGraph({
+			("example", "example"):["kernels", "Storage", "iso_c_binding"],
+			("kernels", "kernels"):["storage", "kernels_helpers"],
+			("kernels", "kernels_helpers"):["storage"],
+			("storage", "storage"):[]
+		})
+		self.assertEqual(dependencyGraph.makeRules(), ["example.o: kernels.o storage.o", "kernels.o: storage.o"])
+		self.assertEqual(dependencyGraph.criticalPath(), ["storage", "kernels", "example"])
+		self.assertEqual(dependencyGraph.sourcesByLevel(), [["storage"], ["kernels"], ["example"]])
+		dependencyGraph = moduleDependencyGraph({("a", "a"):["b"], ("b", "b"):["a"]})
+		self.assertRaises(UsageError, dependencyGraph.criticalPath)
+
+	def testWriteIfChanged(self):
+		import os, shutil, tempfile
+		from tools.filesystem import writeIfChanged
+		directory = tempfile.mkdtemp()
+		try:
+			outputPath = os.path.join(directory, "a.P90.temp")
+			self.assertTrue(writeIfChanged(outputPath, "module a\nend module\n"))
+			os.utime(outputPath, (0, 0))
+			self.assertFalse(writeIfChanged(outputPath, "module a\nend module\n"))
+			self.assertEqual(os.path.getmtime(outputPath), 0)
+			self.assertTrue(writeIfChanged(outputPath, "module b\nend module\n"))
+			self.assertNotEqual(os.path.getmtime(outputPath), 0)
+			with open(outputPath, "rb") as outputFile:
+				self.assertEqual(outputFile.read(), "module b\nend module\n")
+		finally:
+			shutil.rmtree(directory)
+
+	def testChangedPaths(self):
+		import os, shutil, tempfile
+		from tools.filesystem import getFileStampsByPath, getChangedPaths
+		directory = tempfile.mkdtemp()
+		try:
+			os.mkdir(os.path.join(directory, "sub"))
+			for name in ["a.h90", "sub/b.H90", "c.f90"]:
+				with open(os.path.join(directory, name), "w") as sourceFile:
+					sourceFile.write("module x\nend module\n")
+			before = getFileStampsByPath([directory], "h90", "H90")
+			self.assertEqual(sorted(before.keys()), [os.path.join(directory, "a.h90"), os.path.join(directory, "sub/b.H90")])
+			self.assertEqual(getChangedPaths(before, getFileStampsByPath([directory], "h90", "H90")), [])
+			with open(os.path.join(directory, "a.h90"), "a") as sourceFile:
+				sourceFile.write("! comment\n")
+			os.unlink(os.path.join(directory, "sub/b.H90"))
+			self.assertEqual(
+				getChangedPaths(before, getFileStampsByPath([directory], "h90", "H90")),
+				[os.path.join(directory, "a.h90"), os.path.join(directory, "sub/b.H90")]
+			)
+		finally:
+			shutil.rmtree(directory)
+
+	def testDaemonFrames(self):
+		import socket
+		from tools.daemon import FrameWriter, sendFrame, receiveFrame, stdoutChannel, exitChannel
+		daemonSide, clientSide = socket.socketpair()
+		try:
+			writer = FrameWriter(daemonSide, stdoutChannel, bufferSize=100)
+			writer.write("module a\n")
+			writer.write(u"end module\n")
+			writer.flush()
+			writer.flush()
+			sendFrame(daemonSide, exitChannel, "0")
+			daemonSide.close()
+			self.assertEqual(receiveFrame(clientSide), (stdoutChannel, "module a\nend module\n"))
+			self.assertEqual(receiveFrame(clientSide), (exitChannel, "0"))
+			self.assertRaises(EOFError, receiveFrame, clientSide)
+		finally:
+			clientSide.close()
+
+	def testDaemonSocketAccess(self):
+		import os, socket, shutil, tempfile
+		from tools.daemon import ensurePrivateSocketDirectory, getPeerUID, isSameUserPeer, SocketAccessError
+		directory = tempfile.mkdtemp()
+		try:
+			socketDirectory = os.path.join(directory, "sockets")
+			ensurePrivateSocketDirectory(os.path.join(socketDirectory, "hf.sock"))
+			self.assertEqual(os.stat(socketDirectory).st_mode & 0777, 0700)
+			ensurePrivateSocketDirectory(os.path.join(socketDirectory, "hf.sock"))
+			os.chmod(socketDirectory, 0777)
+			self.assertRaises(SocketAccessError, ensurePrivateSocketDirectory, os.path.join(socketDirectory, "hf.sock"))
+			os.rmdir(socketDirectory)
+			os.symlink(tempfile.gettempdir(), socketDirectory)
+			self.assertRaises(SocketAccessError, ensurePrivateSocketDirectory, os.path.join(socketDirectory, "hf.sock"))
+		finally:
+			shutil.rmtree(directory)
+		daemonSide, clientSide = socket.socketpair()
+		try:
+			self.assertIn(getPeerUID(clientSide), [None, os.getuid()])
+			self.assertTrue(isSameUserPeer(daemonSide))
+		finally:
+			daemonSide.close()
+			clientSide.close()
+
+	def testWarmCallGraphFile(self):
+		import os, shutil, tempfile
+		from tools.metadata import warmCallGraphFile, parseCallGraphFile, warmCallGraphsByPath
+		directory = tempfile.mkdtemp()
+		try:
+			callGraphPath = os.path.join(directory, "cg.xml")
+			with open(callGraphPath, "w") as callGraphFile:
+				callGraphFile.write("<callGraph><routines/></callGraph>")
+			warmCallGraphFile(callGraphPath)
+			warmDoc = warmCallGraphsByPath[os.path.abspath(callGraphPath)][1]
+			self.assertTrue(parseCallGraphFile(callGraphPath) is warmDoc)
+			with open(callGraphPath, "w") as callGraphFile:
+				callGraphFile.write("<callGraph><modules/></callGraph>")
+			doc = parseCallGraphFile(callGraphPath)
+			self.assertFalse(doc is warmDoc)
+			self.assertEqual(doc.documentElement.firstChild.tagName, "modules")
+		finally:
+			warmCallGraphsByPath.clear()
+			shutil.rmtree(directory)
+
+	def testStageReportRegressions(self):
+		import os, sys, shutil, tempfile
+		from tools.instrumentation import StageReport, readStageReport, getMetricsByStageKey, getBaselineMetricsByStageKey, getRegressions
+		directory = tempfile.mkdtemp()
+		try:
+			reportPath = os.path.join(directory, "reports", "conversion.json")
+			for _ in range(2):
+				stageReport = StageReport(reportPath)
+				stageReport.endStage(stageReport.startStage("Reading the callgraph"))
+				stageReport.addStage(stageReport.startStage("Converting to Standard Fortran", file="a.h90").getRecord())
+				stageReport.write()
+			#scripts run their main body within the report, such that it is written however they exit
+			with self.assertRaises(SystemExit):
+				with StageReport(reportPath) as stageReport:
+					stageReport.endStage(stageReport.startStage("Reading the callgraph"))
+					sys.exit(2)
+			with self.assertRaises(ValueError):
+				with StageReport(reportPath):
+					raise ValueError("broken callgraph")
+			runs = readStageReport(reportPath)
+			self.assertEqual([run["exitStatus"] for run in runs], [0, 0, 2, 1])
+			self.assertEqual(
+				sorted(getMetricsByStageKey(runs[1]).keys()),
+				["Converting to Standard Fortran - a.h90", "Reading the callgraph", "total"]
+			)
+			self.assertEqual([stage["name"] for stage in runs[2]["stages"]], ["Reading the callgraph"])
+		finally:
+			shutil.rmtree(directory)
+		def run(wallTime, peakRSS):
+			return {"wallTime": wallTime, "cpuTime": wallTime, "peakRSS": peakRSS, "stages": [
+				{"name": "Symbol parsing", "target": "cpu", "wallTime": wallTime, "cpuTime": wallTime, "peakRSS": peakRSS}
+			]}
+		baselineMetricsByStageKey = getBaselineMetricsByStageKey([run(1.0, 100.0), run(3.0, 100.0), run(1.2, 100.0)])
+		self.assertEqual(baselineMetricsByStageKey["cpu - Symbol parsing"]["wallTime"], 1.2)
+		self.assertEqual(getRegressions(getMetricsByStageKey(run(1.3, 104.0)), baselineMetricsByStageKey, 0.1, 0.05, 5.0), [])
+		self.assertEqual(
+			getRegressions(getMetricsByStageKey(run(1.5, 120.0)), baselineMetricsByStageKey, 0.1, 0.05, 5.0),
+			[
+				("cpu - Symbol parsing", "wallTime", 1.5, 1.2),
+				("cpu - Symbol parsing", "cpuTime", 1.5, 1.2),
+				("cpu - Symbol parsing", "peakRSS", 120.0, 100.0),
+				("total", "wallTime", 1.5, 1.2),
+				("total", "cpuTime", 1.5, 1.2),
+				("total", "peakRSS", 120.0, 100.0)
+			]
+		)
+
+	def testBinaryCallGraphRoundTrip(self):
+		from tools.metadata import parseString, binaryFromDocument
+		xmlData = "<callGraph><routines><routine name=\"a\" source=\"s\"/><routine name=\"b\"><entry>x</entry></routine></routines></callGraph>"
+		doc = parseString(binaryFromDocument(parseString(xmlData)))
+		self.assertEqual(doc.documentElement.toxml(), xmlData)
+		routines = doc.getElementsByTagName("routine")
+		self.assertEqual(routines[0].getAttribute("source"), "s")
+		self.assertEqual(routines[0].nextSibling, routines[1])
+		self.assertEqual(routines[1].firstChild.firstChild.nodeValue, "x")
+
+	def testAppendPartialCallGraph(self):
+		from tools.metadata import parseString, appendPartialCallGraph
+		doc = parseString("<callGraph/>")
+		appendPartialCallGraph(doc, parseString(
+			"<callGraph><routines><routine name=\"a\"><domainDependants><templateRelation id=\"1\"/></domainDependants></routine></routines>\
+<domainDependantTemplates><domainDependantTemplate id=\"1\"><domName><entry>i</entry></domName></domainDependantTemplate></domainDependantTemplates></callGraph>"
+		))
+		appendPartialCallGraph(doc, parseString(
+			"<callGraph><routines><routine name=\"b\"><domainDependants><templateRelation id=\"2\"/><templateRelation id=\"3\"/></domainDependants></routine></routines>\
+<domainDependantTemplates><domainDependantTemplate id=\"2\"><domName><entry>i</entry></domName></domainDependantTemplate>\
+<domainDependantTemplate id=\"3\"><domName><entry>j</entry></domName></domainDependantTemplate></domainDependantTemplates></callGraph>"
+		))
+		self.assertEqual(
+			[template.getAttribute("id") for template in doc.getElementsByTagName("domainDependantTemplate")],
+			["1", "3"]
+		)
+		self.assertEqual(
+			[relation.getAttribute("id") for relation in doc.getElementsByTagName("templateRelation")],
+			["1", "1", "3"]
+		)
+		self.assertEqual([routine.getAttribute("name") for routine in doc.getElementsByTagName("routine")], ["a", "b"])
+		self.assertEqual(len(doc.getElementsByTagName("routines")), 1)
+
+	def testCallGraphIndex(self):
+		from tools.callgraph import CallGraph
+		from tools.metadata import parseString
+		callGraph = CallGraph(parseString(
+			"<callGraph><parallelRegionTemplates><parallelRegionTemplate id=\"1\"/></parallelRegionTemplates>\
+<modules><module name=\"m\"/></modules><routines><routine name=\"a\" module=\"m\" source=\"s\"/>\
+<routine name=\"b\" module=\"m\" source=\"s\"><activeParallelRegions><templateRelation id=\"1\"/></activeParallelRegions></routine>\
+</routines><calls><call caller=\"a\" callee=\"b\"><arguments><argument symbolName=\"x\"/></arguments></call></calls></callGraph>"
+		))
+		self.assertEqual(sorted(callGraph.routineNodesByName.keys()), ["a", "b"])
+		self.assertEqual(len(callGraph.routineNodesBySourceName["s"]), 2)
+		self.assertEqual(callGraph.moduleNodesByName.keys(), ["m"])
+		self.assertEqual(callGraph.callNodesByCalleeName["b"][0].getAttribute("caller"), "a")
+		self.assertEqual([routine.getAttribute("name") for routine in callGraph.rootRoutineNodes], ["a"])
+		self.assertEqual(callGraph.parallelRegionData[1].keys(), ["b"])
+		self.assertEqual(callGraph.getArguments(callGraph.callNodesByCalleeName["b"][0]), ["x"])
+		self.assertEqual(callGraph.duplicateRoutineNames, [])
+
+	def testMemoizedSymbolAnalysis(self):
+		from tools.analysis import SymbolDependencyAnalyzer, getSymbolAnalysisDifferences
+		from tools.metadata import parseString
+		def routine(name, arguments, domainDependants):
+			return "<routine name=\"%s\"><arguments>%s</arguments><domainDependants><templateRelation id=\"t\">%s</templateRelation></domainDependants></routine>" %(
+				name,
+				"".join("<argument symbolName=\"%s\"/>" %(argument) for argument in arguments),
+				"".join("<entry%s>%s</entry>" %(attributes, symbolName) for (symbolName, attributes) in domainDependants)
+			)
+		def call(caller, callee, arguments):
+			return "<call caller=\"%s\" callee=\"%s\"><arguments>%s</arguments></call>" %(
+				caller,
+				callee,
+				"".join("<argument symbolName=\"%s\"/>" %(argument) for argument in arguments)
+			)
+		#two roots, with a diamond from r1 to c
+		cgDoc = parseString("<callGraph><domainDependantTemplates><domainDependantTemplate id=\"t\"/></domainDependantTemplates><routines>%s</routines><calls>%s</calls></callGraph>" %(
+			"".join([
+				routine("r1", [], [("a", "")]),
+				routine("r2", [], [("b", "")]),
+				routine("p1", ["x"], [("x", "")]),
+				routine("p2", ["y"], [("y", "")]),
+				routine("c", ["z"], [("z", ""), ("m", " sourceModule=\"mod\" sourceSymbol=\"m\"")])
+			]),
+			"".join([
+				call("r1", "p1", ["a"]),
+				call("r1", "p2", ["a"]),
+				call("p1", "c", ["x"]),
+				call("p2", "c", ["y"]),
+				call("r2", "c", ["b"])
+			])
+		))
+		exhaustiveAnalysis = SymbolDependencyAnalyzer(cgDoc, memoize=False).getSymbolAnalysisByRoutine()
+		memoizedAnalysis = SymbolDependencyAnalyzer(cgDoc).getSymbolAnalysisByRoutine()
+		self.assertEqual(getSymbolAnalysisDifferences(exhaustiveAnalysis, memoizedAnalysis), [])
+		self.assertEqual(len(exhaustiveAnalysis["c"]["z"]), 3)
+		self.assertEqual(
+			[analysis.name for analysis in memoizedAnalysis["c"]["z"]],
+			["a", "b"]
+		)
+		self.assertEqual(
+			memoizedAnalysis["c"]["z"][0].aliasNamesByRoutineName,
+			{"r1":"a", "p1":"x", "p2":"y", "c":"z"}
+		)
+
+	def testCallGraphAttributePropagation(self):
+		from tools.metadata import parseString, getRoutineNodesByName, getCallersByCalleeName, getCalleesByCallerName, \
+			addAttributeToAllCallGraphAncestors, addAttributeToAllCallGraphHeirs
+		class CountingIndex(dict):
+			def __init__(self, *args):
+				dict.__init__(self, *args)
+				self.lookupCounts = {}
+			def get(self, key, default=None):
+				self.lookupCounts[key] = self.lookupCounts.get(key, 0) + 1
+				return dict.get(self, key, default)
+		def routine(name, parallelRegionPosition="", regionsNodeName=None, templateIDs=[]):
+			regions = ""
+			if regionsNodeName:
+				regions = "<%s>%s</%s>" %(
+					regionsNodeName,
+					"".join("<templateRelation id=\"%s\"/>" %(templateID) for templateID in templateIDs),
+					regionsNodeName
+				)
+			return "<routine name=\"%s\"%s>%s</routine>" %(
+				name,
+				" parallelRegionPosition=\"%s\"" %(parallelRegionPosition) if parallelRegionPosition else "",
+				regions
+			)
+		def call(caller, callee, parallelRegionPosition=""):
+			return "<call caller=\"%s\" callee=\"%s\"%s/>" %(
+				caller,
+				callee,
+				" parallelRegionPosition=\"%s\"" %(parallelRegionPosition) if parallelRegionPosition else ""
+			)
+		def propagate(routines, calls, kernelName):
+			doc = parseString("<callGraph><routines>%s</routines><calls>%s</calls></callGraph>" %("".join(routines), "".join(calls)))
+			routineNodesByName = getRoutineNodesByName(doc.getElementsByTagName("routine"))
+			callNodesByCalleeName = CountingIndex(getCallersByCalleeName(doc.getElementsByTagName("call")))
+			callNodesByCallerName = CountingIndex(getCalleesByCallerName(doc.getElementsByTagName("call")))
+			templateIDsByRoutineNode = {}
+			kernel = routineNodesByName[kernelName]
+			addAttributeToAllCallGraphAncestors(routineNodesByName, callNodesByCalleeName, kernel, "parallelRegionPosition", "inside", templateIDsByRoutineNode)
+			addAttributeToAllCallGraphHeirs(routineNodesByName, callNodesByCallerName, kernel, "parallelRegionPosition", "outside", templateIDsByRoutineNode)
+			return routineNodesByName, callNodesByCalleeName.lookupCounts, callNodesByCallerName.lookupCounts
+		def templateIDs(routineNode):
+			return sorted(relation.getAttribute("id") for relation in routineNode.getElementsByTagName("templateRelation"))
+		#a diamond above and below the kernel k, with cycles on both sides
+		routineNodesByName, callerLookupCounts, calleeLookupCounts = propagate(
+			[
+				routine("top"),
+				routine("left"),
+				routine("right"),
+				routine("k", "within", "parallelRegions", ["t1", "t2"]),
+				routine("inner_a"),
+				routine("inner_b"),
+				routine("leaf", "", "activeParallelRegions", ["t1"]),
+				routine("not_in_region")
+			],
+			[
+				call("top", "left"),
+				call("top", "right"),
+				call("left", "k"),
+				call("right", "k"),
+				call("left", "top"),
+				call("k", "inner_a", "surround"),
+				call("k", "inner_b", "surround"),
+				call("k", "not_in_region"),
+				call("inner_a", "leaf"),
+				call("inner_b", "leaf"),
+				call("leaf", "inner_a")
+			],
+			"k"
+		)
+		for routineName in ["top", "left", "right"]:
+			self.assertEqual(routineNodesByName[routineName].getAttribute("parallelRegionPosition"), "inside")
+			self.assertEqual(templateIDs(routineNodesByName[routineName]), ["t1", "t2"])
+		for routineName in ["inner_a", "inner_b", "leaf"]:
+			self.assertEqual(routineNodesByName[routineName].getAttribute("parallelRegionPosition"), "outside")
+			self.assertEqual(templateIDs(routineNodesByName[routineName]), ["t1", "t2"])
+		self.assertEqual(routineNodesByName["k"].getAttribute("parallelRegionPosition"), "within")
+		self.assertEqual(templateIDs(routineNodesByName["k"]), ["t1", "t2"])
+		self.assertEqual(routineNodesByName["not_in_region"].getAttribute("parallelRegionPosition"), "")
+		self.assertEqual(templateIDs(routineNodesByName["not_in_region"]), [])
+		#every routine is visited once, i.e. its calls are looked up once
+		self.assertEqual(callerLookupCounts, {"k":1, "left":1, "right":1, "top":1})
+		self.assertEqual(calleeLookupCounts, {"k":1, "inner_a":1, "inner_b":1, "leaf":1})
+		#a kernel calling a kernel from inside its region
+		with self.assertRaises(Exception) as context:
+			propagate(
+				[routine("k", "within", "parallelRegions", ["t1"]), routine("other_k", "within", "parallelRegions", ["t2"])],
+				[call("k", "other_k", "surround")],
+				"k"
+			)
+		self.assertTrue(str(context.exception).startswith("Routine other_k contains one or more kernels and at the same time is being called inside a kernel."))
+		#a kernel calling a kernel wrapper
+		with self.assertRaises(Exception) as context:
+			propagate(
+				[routine("k", "within", "parallelRegions", ["t1"]), routine("wrapper", "inside"), routine("other_k", "within", "parallelRegions", ["t2"])],
+				[call("k", "wrapper"), call("wrapper", "other_k")],
+				"other_k"
+			)
+		self.assertTrue(str(context.exception).startswith("Routine k contains one or more kernels and at the same time has one or more kernels in its inner callgraph."))
+
 class TestMachineryAlgorithms(unittest.TestCase):
 	def testSpecificationParsing(self):
 		from machinery.commons import parseSpecification
@@ -285,6 +859,242 @@ class TestMachineryAlgorithms(unittest.TestCase):
 			("double precision, attribute", (("a", None),), "= 1.0d0")
 		)
 
+	def testFileIntermediate(self):
+		import os, tempfile
+		import machinery.commons
+		from machinery.commons import parseSpecification
+		from machinery.intermediate import H90FileIntermediate
+		from tools.commons import UsageError
+		temporaryFile, path = tempfile.mkstemp(suffix=".h90")
+		try:
+			os.write(temporaryFile, "module m\nreal a\nend module\n")
+			os.close(temporaryFile)
+			intermediate = H90FileIntermediate(path)
+			self.assertEqual(intermediate.lines, ["module m\n", "real a\n", "end module\n"])
+			with intermediate:
+				self.assertEqual(parseSpecification("real a"), ("real", (("a", None),), ""))
+				self.assertEqual(parseSpecification("real a"), ("real", (("a", None),), ""))
+				self.assertRaises(UsageError, parseSpecification, "real :: a, b c")
+				self.assertRaises(UsageError, parseSpecification, "real :: a, b c")
+			self.assertEqual(machinery.commons.currSpecificationTuplesByLine, None)
+			self.assertEqual(sorted(intermediate.specificationTuplesByLine.keys()), ["real :: a, b c", "real a"])
+		finally:
+			os.unlink(path)
+
+	def testLineClassification(self):
+		import os, shutil, tempfile
+		from machinery.intermediate import H90FileIntermediate, getLineClassificationPath
+		from tools.patterns import RegExPatterns
+		patterns = RegExPatterns.Instance()
+		directory = tempfile.mkdtemp()
+		try:
+			path = os.path.join(directory, "a.h90")
+			with open(path, "w") as sourceFile:
+				sourceFile.write("module m\nend module\n")
+			intermediate = H90FileIntermediate(path, getLineClassificationPath(path))
+			with intermediate:
+				self.assertEqual(tupleFromMatch(patterns.moduleBeginPattern.match("module m\n")), ("m",))
+				self.assertEqual(patterns.moduleBeginPattern.match("module m\n").group(0), "module m")
+				self.assertEqual(patterns.moduleEndPattern.match("module m\n"), None)
+			self.assertTrue(os.path.exists(getLineClassificationPath(path)))
+			intermediate = H90FileIntermediate(path, getLineClassificationPath(path))
+			self.assertEqual(intermediate.matchGroupsByPatternNameAndLine["moduleBeginPattern"], {"module m\n":("module m", "m")})
+			self.assertEqual(intermediate.matchGroupsByPatternNameAndLine["moduleEndPattern"], {"module m\n":None})
+			with open(path, "a") as sourceFile:
+				sourceFile.write("module n\nend module\n")
+			intermediate = H90FileIntermediate(path, getLineClassificationPath(path))
+			self.assertEqual(intermediate.matchGroupsByPatternNameAndLine, {})
+			self.assertEqual(tupleFromMatch(patterns.moduleBeginPattern.match("module m\n")), ("m",))
+		finally:
+			shutil.rmtree(directory)
+
+	def testLineBreakUp(self):
+		from machinery.commons import FortranCodeSanitizer
+		from tools.commons import QuoteMask, areIndexesWithinQuotes
+		line = "write(0,*) 'a b', \"c ' d\", e 'f'"
+		quoteMask = QuoteMask(line)
+		for suffixStart in range(len(line)):
+			self.assertEqual(
+				[quoteMask.isIndexWithinQuotes(index, suffixStart) for index in range(suffixStart, len(line))],
+				areIndexesWithinQuotes(line[suffixStart:])
+			)
+		arguments = ", ".join("argument_%i" %(index) for index in range(100))
+		for codeLine, continuation in [
+			("call kernel(%s)" %(arguments), "& "),
+			("!$acc kernels deviceptr(%s)" %(arguments), "!$acc& "),
+			("write(0,*) %s" %(", ".join("'value %i is'" %(index) for index in range(50))), "& ")
+		]:
+			sanitizedLines = FortranCodeSanitizer().sanitizeLines(codeLine).rstrip("\n").split("\n")
+			self.assertTrue(len(sanitizedLines) > 1)
+			for sanitizedLine in sanitizedLines:
+				#the continuation is not taken into account when looking for a blank - lines may exceed the limit by its length
+				self.assertTrue(len(sanitizedLine) <= 132 + len(continuation))
+				self.assertEqual(sanitizedLine.count("'") % 2, 0)
+			for sanitizedLine in sanitizedLines[1:]:
+				self.assertTrue(sanitizedLine.startswith(continuation))
+			self.assertEqual("".join(
+				sanitizedLine[len(continuation) if index > 0 else 0:len(sanitizedLine) - 2 if index < len(sanitizedLines) - 1 else None]
+				for index, sanitizedLine in enumerate(sanitizedLines)
+			), codeLine)
+
+	def testSanitizedOutputWriter(self):
+		from machinery.commons import FortranCodeSanitizer, SanitizedOutputWriter
+		from StringIO import StringIO
+		elements = [
+			"  \nmodule m\n  implicit none\ncontains\n\n",
+			"",
+			"subroutine a()\n\n\n",
+			"do i = 1, n\n  call kernel(%s)\nend do\n" %(", ".join("argument_%i" %(index) for index in range(50))),
+			"end subroutine\n \n",
+			"end module  "
+		]
+		outputStream = StringIO()
+		#a tiny buffer size, such that every line is flushed separately
+		writer = SanitizedOutputWriter(outputStream, FortranCodeSanitizer(), bufferSize=1)
+		for element in elements[:3]:
+			writer.beginStrippedElement()
+			writer.write(element)
+			if writer.endStrippedElement():
+				writer.write("\n\n")
+		for element in elements[3:]:
+			writer.write(element)
+		writer.close()
+		expectedText = "".join(element.strip() + "\n\n" for element in elements[:3] if element.strip() != "") + "".join(elements[3:])
+		self.assertEqual(outputStream.getvalue(), FortranCodeSanitizer().sanitizeLines(expectedText))
+		outputStream = StringIO()
+		writer = SanitizedOutputWriter(outputStream, FortranCodeSanitizer())
+		writer.write(" \n")
+		writer.close()
+		self.assertEqual(outputStream.getvalue(), "\n")
+
+	def testSinglePassImplementation(self):
+		from machinery.commons import implement, implementSymbolBySymbol, getAccessorsAndRemainder
+		from tools.commons import splitTextAtLeftMostOccurrence
+		class AccessedSymbol(object):
+			def __init__(self, name, hasDomains):
+				self.name = name
+				self.hasDomains = hasDomains
+			def splitTextAtLeftMostOccurrence(self, text):
+				return splitTextAtLeftMostOccurrence([self.name], text)
+		def implementation(work, suffix, symbol, iterators, parallelRegionTemplate, callee):
+			if not symbol.hasDomains:
+				return symbol.name + "_d", suffix
+			accessors, remainder = getAccessorsAndRemainder(suffix)
+			return "%s(%s)" %(symbol.name, ",".join(accessors + iterators)), remainder
+		a, b, n, z = AccessedSymbol("a", True), AccessedSymbol("b", True), AccessedSymbol("n", False), AccessedSymbol("z", True)
+		self.assertEqual(implement("a(n) = b(n) + 'a'", [a, b, n], implementation, ["i"]), "a(n_d,i)= b(n_d,i)+ 'a'")
+		self.assertEqual(implement("a(n) = b(n) + 'a'", [n, a, b], implementation, ["i"]), "a(n_d,i)= b(n_d,i)+ 'a'")
+		self.assertEqual(implement("ab = a_b", [a, b], implementation), "ab = a_b")
+		for line in [
+			"a(n) = b(n) + 'a'",
+			"a(z(n), b(1)) = z(n)*a(n-1)",
+			"call foo(a, z, b(a(1)), n)",
+			"n = 'b(1)' // \"a\"",
+			"z = a(1, n)"
+		]:
+			for symbols in [[a, b, n, z], [z, n, b, a], [n, a, z, b], [b, z]]:
+				for iterators in [[], ["z"], ["n", "i"]]:
+					self.assertEqual(
+						implement(line, symbols, implementation, iterators),
+						implementSymbolBySymbol(line, symbols, implementation, iterators)
+					)
+
+	def testLazyModuleSymbolTable(self):
+		from machinery.converter import LazyModuleSymbolTable, getSymbolsByModuleNameAndSymbolName
+		from tools.metadata import parseString
+		from tools.callgraph import CallGraph
+		cgDoc = parseString(
+			"<callGraph><domainDependantTemplates><domainDependantTemplate id=\"t\">\
+<domName><entry>i</entry></domName><domSize><entry>n</entry></domSize></domainDependantTemplate></domainDependantTemplates>\
+<modules><module name=\"m\"><domainDependants><templateRelation id=\"t\"><entry>a</entry><entry>b</entry></templateRelation>\
+</domainDependants></module><module name=\"other\"/></modules></callGraph>"
+		)
+		moduleNodesByName = CallGraph(cgDoc).moduleNodesByName
+		symbolsByModuleNameAndSymbolName = LazyModuleSymbolTable(cgDoc, moduleNodesByName)
+		self.assertEqual(sorted(symbolsByModuleNameAndSymbolName.keys()), ["m", "other"])
+		self.assertEqual(sorted(symbolsByModuleNameAndSymbolName["m"].keys()), ["a_hfauto_m", "b_hfauto_m"])
+		self.assertFalse(symbolsByModuleNameAndSymbolName.get("other"))
+		self.assertEqual(symbolsByModuleNameAndSymbolName.get("missing", {}), {})
+		self.assertTrue("b_hfauto_m" in symbolsByModuleNameAndSymbolName["m"])
+		self.assertEqual(symbolsByModuleNameAndSymbolName.numOfSymbols, 2)
+		self.assertEqual(symbolsByModuleNameAndSymbolName.numOfMaterializedSymbols, 0)
+		symbol = symbolsByModuleNameAndSymbolName.get("m").get("a_hfauto_m")
+		self.assertTrue(symbolsByModuleNameAndSymbolName["m"]["a_hfauto_m"] is symbol)
+		self.assertEqual(symbolsByModuleNameAndSymbolName.get("m").get("c_hfauto_m"), None)
+		self.assertEqual(symbolsByModuleNameAndSymbolName.numOfMaterializedSymbols, 1)
+		eagerSymbol = getSymbolsByModuleNameAndSymbolName(cgDoc, moduleNodesByName)["m"]["a_hfauto_m"]
+		self.assertEqual(symbol.sourceModule, "m")
+		self.assertEqual(symbol.domains, eagerSymbol.domains)
+		self.assertEqual(symbol.nameInScope(), eagerSymbol.nameInScope())
+		self.assertEqual(symbol.declarationType, eagerSymbol.declarationType)
+
+	def testParallelConversion(self):
+		import os, sys, shutil, tempfile, subprocess, filecmp
+		from tools.instrumentation import readStageReport
+		hfDir = os.path.dirname(os.path.abspath(__file__))
+		def runScript(scriptName, arguments, outputPath=None):
+			with open(outputPath or os.devnull, "w") as outputFile, open(os.devnull, "w") as errorFile:
+				return subprocess.call(
+					[sys.executable, os.path.join(hfDir, scriptName)] + arguments,
+					cwd=directory,
+					stdout=outputFile,
+					stderr=errorFile
+				)
+		def convert(outputDir, jobs, *arguments):
+			return runScript("generateP90Codebase.py", [
+				"-i", sourceDir, "-o", outputDir, "-c", callGraphPath, "-m", implementationPath, "--jobs=%i" %(jobs)
+			] + list(arguments))
+		directory = tempfile.mkdtemp()
+		try:
+			sourceDir = os.path.join(directory, "source")
+			os.mkdir(sourceDir)
+			for moduleName in ["stencil_a", "stencil_b", "stencil_c", "stencil_d"]:
+				with open(os.path.join(sourceDir, moduleName + ".h90"), "w") as sourceFile:
+					sourceFile.write("module %s\ncontains\n\
+subroutine %s_run(n, m, a, b)\n\
+implicit none\n\
+integer(4), intent(in) :: n, m\n\
+real(8), intent(in), dimension(n,m) :: a\n\
+real(8), intent(out), dimension(n,m) :: b\n\
+@domainDependant{attribute(autoDom)}\n\
+a, b, n, m\n\
+@end domainDependant\n\
+@parallelRegion{domName(i,j), domSize(n,m), endAt(n-1,m)}\n\
+b(i,j) = a(i,j) + a(i+1,j)\n\
+@end parallelRegion\n\
+end subroutine\n\
+end module\n" %(moduleName, moduleName))
+			implementationPath = os.path.join(directory, "implementationNamesByTemplate")
+			with open(implementationPath, "w") as implementationFile:
+				implementationFile.write("{\"default\":\"OpenMPFortranImplementation\"}")
+			rawCallGraphPath = os.path.join(directory, "rawCG.xml")
+			callGraphPath = os.path.join(directory, "CG_CPU.xml")
+			self.assertEqual(runScript("annotatedCallGraphFromH90SourceDir.py", ["-i", sourceDir], rawCallGraphPath), 0)
+			self.assertEqual(runScript("loopAnalysisWithAnnotatedCallGraph.py", ["-i", rawCallGraphPath, "-a", "CPU"], callGraphPath), 0)
+			sequentialDir = os.path.join(directory, "sequential")
+			parallelDir = os.path.join(directory, "parallel")
+			reportPath = os.path.join(directory, "conversion.json")
+			self.assertEqual(convert(sequentialDir, 1, "--stageReport=%s" %(reportPath)), 0)
+			self.assertEqual(convert(parallelDir, 3), 0)
+			outputNames = sorted(os.listdir(sequentialDir))
+			self.assertEqual(len(outputNames), 4)
+			self.assertEqual(sorted(os.listdir(parallelDir)), outputNames)
+			_, mismatches, errors = filecmp.cmpfiles(sequentialDir, parallelDir, outputNames, shallow=False)
+			self.assertEqual(mismatches + errors, [])
+			#an output that can't be written fails the conversion of this file only - the run still has to fail
+			failingDir = os.path.join(directory, "failing")
+			os.mkdir(failingDir)
+			os.mkdir(os.path.join(failingDir, "stencil_b.P90.temp"))
+			self.assertNotEqual(convert(failingDir, 3, "--stageReport=%s" %(reportPath)), 0)
+			self.assertTrue(filecmp.cmp(os.path.join(sequentialDir, "stencil_d.P90.temp"), os.path.join(failingDir, "stencil_d.P90.temp"), shallow=False))
+			self.assertNotEqual(convert(failingDir, 1, "--stageReport=%s" %(reportPath)), 0)
+			#failed runs are reported as well, up to the stage they have failed in
+			runs = readStageReport(reportPath)
+			self.assertEqual([run["exitStatus"] != 0 for run in runs], [False, True, True])
+			self.assertIn("Converting to Standard Fortran", [stage["name"] for stage in runs[-1]["stages"]])
+		finally:
+			shutil.rmtree(directory)
+
 class TestSymbolAlgorithms(unittest.TestCase):
 	def testSymbolNamesFromDeclaration(self):
 		def symbolNamesFromDeclaration(declaration):
@@ -314,6 +1124,31 @@ class TestSymbolAlgorithms(unittest.TestCase):
 			("a", "b", "c")
 		)
 
+	def testSymbolsShareTemplateData(self):
+		from machinery.parser import getSymbolsByName
+		from tools.metadata import parseString, getTemplateData
+		cgDoc = parseString(
+			"<callGraph><domainDependantTemplates><domainDependantTemplate id=\"t\">\
+<attribute><entry>present</entry></attribute><domName><entry>i</entry><entry>j</entry></domName>\
+<domSize><entry>nx</entry><entry>ny</entry></domSize></domainDependantTemplate></domainDependantTemplates>\
+<routines><routine name=\"r\" module=\"m\" source=\"s\"><domainDependants><templateRelation id=\"t\">\
+<entry>a</entry><entry>b</entry></templateRelation></domainDependants></routine></routines></callGraph>"
+		)
+		symbolsByName = getSymbolsByName(cgDoc, cgDoc.getElementsByTagName("routine")[0])
+		a = symbolsByName[[name for name in symbolsByName if name.startswith("a")][0]]
+		b = symbolsByName[[name for name in symbolsByName if name.startswith("b")][0]]
+		self.assertFalse(hasattr(a, "__dict__"))
+		self.assertEqual(a.domains, [("i", "nx"), ("j", "ny")])
+		self.assertEqual(b.domains, [("i", "nx"), ("j", "ny")])
+		self.assertTrue(a.isPresent)
+		self.assertTrue(a.attributes is b.attributes)
+		self.assertTrue(a.template is b.template)
+		self.assertTrue(getTemplateData(a.template) is getTemplateData(b.template))
+		self.assertEqual(getTemplateData(a.template).domains, (("i", "nx"), ("j", "ny")))
+		a.domains.append(("k", "nz"))
+		self.assertEqual(getTemplateData(a.template).domains, (("i", "nx"), ("j", "ny")))
+		self.assertEqual(b.domains, [("i", "nx"), ("j", "ny")])
+
 	def testDimensionString(self):
 		def dimensionStringFromDeclaration(symbolName, declaration):
 			from models.symbol import dimensionStringFromSpecification
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+#**********************************************************************#
+#  Procedure        watchSources.py                                    #
+#  Comment          Polls the hybrid sources and runs the given        #
+#                   (incremental) regeneration command whenever one of #
+#                   them is saved. Reports which P90 files have been   #
+#                   rewritten.                                         #
+#**********************************************************************#
+
+from optparse import OptionParser
+from tools.filesystem import getFileStampsByPath, getChangedPaths
+import os, sys, time, subprocess
+
+sourceExtensions = ['h90', 'H90']
+
+def report(message):
+    sys.stderr.write("[%s] %s\n" %(time.strftime("%H:%M:%S"), message))
+
+def regenerate(command, outputPaths):
+    outputStampsBefore = getFileStampsByPath(outputPaths, 'P90')
+    exitCode = subprocess.call(command, shell=True)
+    if exitCode != 0:
+        report("regeneration failed with exit code %i - waiting for the next change" %(exitCode))
+        return
+    outputStampsAfter = getFileStampsByPath(outputPaths, 'P90')
+    rewrittenPaths = getChangedPaths(outputStampsBefore, outputStampsAfter)
+    report("%i of %i P90 files rewritten%s" %(
+        len(rewrittenPaths),
+        len(outputStampsAfter),
+        ": " + ", ".join(os.path.basename(path) for path in rewrittenPaths) if len(rewrittenPaths) > 0 else ""
+    ))
+
+def waitForChanges(sourcePaths, sourceStamps, interval):
+    '''returns the new source stamps and the changed paths, once the sources have changed and then been stable for one interval
+    (editors often save in several steps)'''
+    while True:
+        time.sleep(interval)
+        newSourceStamps = getFileStampsByPath(sourcePaths, *sourceExtensions)
+        if newSourceStamps == sourceStamps:
+            continue
+        while True:
+            time.sleep(interval)
+            settledSourceStamps = getFileStampsByPath(sourcePaths, *sourceExtensions)
+            if settledSourceStamps == newSourceStamps:
+                break
+            newSourceStamps = settledSourceStamps
+        return newSourceStamps, getChangedPaths(sourceStamps, newSourceStamps)
+
+##################### MAIN ##############################
+#get all program arguments
+parser = OptionParser()
+parser.add_option("-p", "--paths", dest="paths",
+                  help="space separated list of h90/H90 files and directories (searched recursively) to watch")
+parser.add_option("-c", "--command", dest="command",
+                  help="shell command regenerating the P90 files, run once at the start and after every change")
+parser.add_option("-o", "--outputs", dest="outputs", default="",
+                  help="space separated list of directories containing the generated P90 files, to report the rewritten ones")
+parser.add_option("-i", "--interval", dest="interval", type="float", default=0.5,
+                  help="seconds between polling the sources (default: 0.5)")
+(options, args) = parser.parse_args()
+
+if not options.paths or not options.command:
+    sys.stderr.write("paths and command options are mandatory. Use '--help' for informations on how to use this module\n")
+    sys.exit(1)
+
+if options.interval <= 0:
+    sys.stderr.write("interval needs to be positive\n")
+    sys.exit(1)
+
+sourcePaths = options.paths.split()
+outputPaths = options.outputs.split()
+sourceStamps = getFileStampsByPath(sourcePaths, *sourceExtensions)
+report("watching %i hybrid source files - press Ctrl-C to stop" %(len(sourceStamps)))
+try:
+    regenerate(options.command, outputPaths)
+    while True:
+        sourceStamps, changedPaths = waitForChanges(sourcePaths, sourceStamps, options.interval)
+        report("changed: %s" %(", ".join(changedPaths)))
+        regenerate(options.command, outputPaths)
+except KeyboardInterrupt:
+    sys.stderr.write("\n")
@@ -0,0 +1,52 @@
+#!/bin/bash
+set -e
+
+# Copyright (C) 2016 Michel Müller, Tokyo Institute of Technology
+
+# This file is part of Hybrid Fortran.
+
+# Hybrid Fortran is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Hybrid Fortran is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with Hybrid Fortran. If not, see <http://www.gnu.org/licenses/>.
+
+# Generates the sources of a configured project incrementally and checks that
+# a second make doesn't change any file, and that touching a hybrid source
+# leaves the generated P90 files alone.
+
+project_dir=$1
+make_args="PREPROCESSOR_INCREMENTAL=1 PREPROCESSOR_WRITE_IF_CHANGED=1 ${2}"
+
+function fileStates {
+	find . -type f "$@" -printf '%p %s %T@\n' | sort
+}
+
+cd ${project_dir}
+make clean > /dev/null
+make source ${make_args}
+states_after_build=$(fileStates)
+
+make source ${make_args}
+if [[ "$(fileStates)" != "${states_after_build}" ]]; then
+	echo "Error: a second make has changed these files:" >&2
+	diff <(echo "${states_after_build}") <(fileStates) >&2 && :
+	exit 1
+fi
+
+generated_states=$(fileStates -name '*.P90*')
+touch $(find . -path ./build -prune -o -name '*.h90' -print | head -n 1)
+make source ${make_args}
+if [[ "$(fileStates -name '*.P90*')" != "${generated_states}" ]]; then
+	echo "Error: touching a hybrid source has changed these generated files:" >&2
+	diff <(echo "${generated_states}") <(fileStates -name '*.P90*') >&2 && :
+	exit 1
+fi
+echo "Incremental build of ${project_dir} is a no-op for unchanged sources."